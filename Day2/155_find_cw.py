@@ -8,6 +8,7 @@ logger = logging.getLogger(__name__)
 
 # Import from the course utilities package
 from python_rf_course_utils.scpi import SCPIWrapper
+from rf_perf.cwsearch import CwFinder
 
 
 def read_max_peak(sa):
@@ -54,6 +55,142 @@ def read_max_peak(sa):
         return False, None, None
 
 
+def find_cw(sa_wrapper, sa, Fspan=np.logspace(2, -4, 7)):
+    """
+    Find the strongest CW signal: a full span sweep, then a zoom on the peak with
+    decreasing spans (the center frequency follows the peak at every step).
+
+    Args:
+        sa_wrapper: SCPIWrapper of the spectrum analyzer
+        sa: VISA instrument object (raw instrument, not wrapper)
+        Fspan: zoom spans in MHz
+
+    Returns:
+        tuple: (success: bool, frequency_mhz: float or None, power_dbm: float or None)
+    """
+    # Reset and clear all status (errors) of the spectrum analyzer
+    sa_wrapper.write("*RST")
+    sa_wrapper.write("*CLS")
+    # Set the spectrum analyzer to maximal span
+    sa_wrapper.write("sense:FREQuency:SPAN:FULL")
+    # Set auto resolution bandwidth
+    sa_wrapper.write("sense:BANDwidth:RESolution:AUTO ON")
+    # Set the trace to write mode
+    sa_wrapper.write(":TRACe1:TYPE WRITe")
+    # Set the detector to positive peak
+    sa_wrapper.write("sense:DETEctor POSitive")
+    # Set the sweep mode to single sweep
+    sa_wrapper.write("INITiate:CONTinuous OFF")
+    # Start the sweep
+    sa_wrapper.write("INITiate:IMMediate")
+    # Wait for the sweep to complete
+    sa.query("*OPC?")
+
+    # Read the maximum peak (frequency and power) with error handling
+    success, Fc, p = read_max_peak(sa)
+    if not success:
+        return False, None, None
+
+    # Set the reference level to the maximum
+    max_level = np.ceil(p / 10 + 1) * 10
+    sa_wrapper.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
+
+    # Set the span to 100 MHz, 10 MHz, 1 MHz, 100 kHz, 10 kHz, 1 kHz, 100 Hz
+    for span in Fspan:
+        sa_wrapper.write(f"sense:FREQuency:CENTer {Fc} MHz")
+        sa_wrapper.write(f"sense:FREQuency:SPAN {span} MHz")
+        sa_wrapper.write("INITiate:IMMediate")
+        # Wait for the sweep to complete
+        sa.query("*OPC?")
+
+        # Read the maximum peak with error handling
+        success, f_peak, p_peak = read_max_peak(sa)
+        if not success:
+            logger.warning(f"Failed to find peak at span {span} MHz, skipping...")
+            continue
+        Fc, p = f_peak, p_peak
+
+        logger.info(f'Center Frequency: {Fc:.6f} MHz, Span: {span:.2e} MHz, Peak: {p:.2f} dBm')
+
+    return True, Fc, p
+
+
+def find_cw_fast(sa_wrapper, sa, accuracy_hz=10.0):
+    """
+    Find the strongest CW signal: a full span sweep (the reference level is then set above
+    its peak, as find_cw), then zoom stages whose span follows the frequency uncertainty
+    reached so far (the peak is interpolated on the host from the binary trace) until the
+    requested accuracy.
+
+    Args:
+        sa_wrapper: SCPIWrapper of the spectrum analyzer
+        sa: VISA instrument object (raw instrument, not wrapper)
+        accuracy_hz: requested frequency uncertainty in Hz
+
+    Returns:
+        tuple: (success: bool, frequency_mhz: float or None, power_dbm: float or None,
+                uncertainty_hz: float or None, elapsed_s: float or None)
+    """
+    setup_full_span(sa_wrapper)
+
+    try:
+        result = CwFinder(sa, accuracy=accuracy_hz, log=logger).find()
+    except ValueError as e:
+        logger.error(f"Error reading the trace: {e}")
+        return False, None, None, None, None
+
+    logger.info(f'Center Frequency: {result.freq*1e-6:.6f} MHz +- {result.uncertainty:.1f} Hz, '
+                f'Peak: {result.power:.2f} dBm ({result.stages} sweeps, {result.elapsed:.2f} s)')
+    return True, result.freq*1e-6, result.power, result.uncertainty, result.elapsed
+
+
+def setup_full_span(sa_wrapper):
+    """Reset the spectrum analyzer to a full span, single sweep, positive peak trace."""
+    # Reset and clear all status (errors) of the spectrum analyzer
+    sa_wrapper.write("*RST")
+    sa_wrapper.write("*CLS")
+    # Set the spectrum analyzer to maximal span
+    sa_wrapper.write("sense:FREQuency:SPAN:FULL")
+    # Set auto resolution bandwidth
+    sa_wrapper.write("sense:BANDwidth:RESolution:AUTO ON")
+    # Set the trace to write mode
+    sa_wrapper.write(":TRACe1:TYPE WRITe")
+    # Set the detector to positive peak
+    sa_wrapper.write("sense:DETEctor POSitive")
+    # Set the sweep mode to single sweep
+    sa_wrapper.write("INITiate:CONTinuous OFF")
+
+
+def find_cw_all(sa_wrapper, sa, accuracy_hz=10.0, threshold_db=10.0):
+    """
+    Find all the CW signals of one full span sweep: every peak above the noise floor
+    (rolling median) + threshold_db, the reference level set above the strongest one,
+    then the zoom stages of all the carriers in turn, in frequency order.
+
+    Args:
+        sa_wrapper: SCPIWrapper of the spectrum analyzer
+        sa: VISA instrument object (raw instrument, not wrapper)
+        accuracy_hz: requested frequency uncertainty in Hz
+        threshold_db: detection threshold above the noise floor in dB
+
+    Returns:
+        tuple: (success: bool, table: list of (frequency_mhz, power_dbm, uncertainty_hz))
+    """
+    setup_full_span(sa_wrapper)
+
+    try:
+        result = CwFinder(sa, accuracy=accuracy_hz, log=logger).find_all(threshold_db=threshold_db)
+    except ValueError as e:
+        logger.error(f"Error reading the trace: {e}")
+        return False, []
+
+    table = [(c.freq*1e-6, c.power, c.uncertainty) for c in result]
+    logger.info(f'{"Frequency [MHz]":>18} {"Power [dBm]":>12} {"+- [Hz]":>10}')
+    for f, p, u in table:
+        logger.info(f'{f:18.6f} {p:12.2f} {u:10.1f}')
+    return True, table
+
+
 if __name__ == "__main__":
     # Setup simple logging for console output
     logging.basicConfig(
@@ -80,52 +217,12 @@ if __name__ == "__main__":
     sa = sa_wrapper.instr
 
     try:
-        # Reset and clear all status (errors) of the spectrum analyzer
-        sa_wrapper.write("*RST")
-        sa_wrapper.write("*CLS")
-        # Set the spectrum analyzer to maximal span
-        sa_wrapper.write("sense:FREQuency:SPAN:FULL")
-        # Set auto resolution bandwidth
-        sa_wrapper.write("sense:BANDwidth:RESolution:AUTO ON")
-        # Set the trace to write mode
-        sa_wrapper.write(":TRACe1:TYPE WRITe")
-        # Set the detector to positive peak
-        sa_wrapper.write("sense:DETEctor POSitive")
-        # Set the sweep mode to single sweep
-        sa_wrapper.write("INITiate:CONTinuous OFF")
-        # Start the sweep
-        sa_wrapper.write("INITiate:IMMediate")
-        # Wait for the sweep to complete
-        sa.query("*OPC?")
-
-        # Read the maximum peak (frequency and power) with error handling
-        success, Fc, p = read_max_peak(sa)
+        # Full span sweep and zoom on the strongest CW signal (10 Hz accuracy)
+        success, Fc, p, _, _ = find_cw_fast(sa_wrapper, sa, accuracy_hz=10.0)
         if not success:
             logger.error("Failed to find initial peak, exiting")
             sys.exit(1)
 
-        # Set the reference level to the maximum
-        max_level = np.ceil(p / 10 + 1) * 10
-        sa_wrapper.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
-
-        # Set the span to 100 MHz, 10 MHz, 1 MHz, 100 kHz, 10 kHz, 1 kHz, 100 Hz
-        Fspan = np.logspace(2, -4, 7)  # Span in MHz
-
-        for span in Fspan:
-            sa_wrapper.write(f"sense:FREQuency:CENTer {Fc} MHz")
-            sa_wrapper.write(f"sense:FREQuency:SPAN {span} MHz")
-            sa_wrapper.write("INITiate:IMMediate")
-            # Wait for the sweep to complete
-            sa.query("*OPC?")
-
-            # Read the maximum peak with error handling
-            success, Fc, p = read_max_peak(sa)
-            if not success:
-                logger.warning(f"Failed to find peak at span {span} MHz, skipping...")
-                continue
-
-            logger.info(f'Center Frequency: {Fc:.6f} MHz, Span: {span:.2e} MHz, Peak: {p:.2f} dBm')
-
         # Read the final RBW with error handling using the wrapper's enhanced query
         success, rbw = sa_wrapper.query("sense:BANDwidth:RESolution?", expected_type=float)
         if success:
@@ -7,6 +7,8 @@ import matplotlib.pyplot as plt
 plt.ion()
 import numpy as np
 
+from rf_perf.trace import TraceReader
+
 class SpectrumAnalyzer:
     def __init__(self, visa_address):
         """Initialize connection to spectrum analyzer."""
@@ -19,6 +21,8 @@ class SpectrumAnalyzer:
             self.sa.write("*CLS")
             # Reset to known state
             self.sa.write("*RST")
+            # Binary trace transfer (REAL,32), the reset restored ASCII
+            self.reader = TraceReader(self.sa)
             print(f"Connected to: {self.sa.query('*IDN?')}")
         except Exception as e:
             print(f"Error initializing instrument: {str(e)}")
@@ -90,8 +94,8 @@ class SpectrumAnalyzer:
     def get_trace_data(self):
         """Read trace data after sweep completion."""
         try:
-            # Query trace data PyVISA method for reading numerical data from instruments
-            p = self.sa.query_ascii_values(":TRACe:DATA? TRACE1", container=np.array)
+            # Query trace data (binary REAL,32 transfer with ASCII fallback)
+            p = self.reader.read()
             # Build the frequency list
             start_freq  = float(self.sa.query(":FREQuency:START?" ).strip())*1e-6
             stop_freq   = float(self.sa.query(":FREQuency:STOP?"  ).strip())*1e-6
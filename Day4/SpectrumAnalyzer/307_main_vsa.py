@@ -13,6 +13,7 @@ import numpy as np
 from python_rf_course_utils.qt import h_gui, PlotWidget
 
 from o310_long_process import LongProcess
+from rf_perf.trace import TraceReader
 
 
 def is_valid_ip(ip:str) -> bool:
@@ -47,6 +48,7 @@ class LabDemoVsaControl(QMainWindow):
         # Create a Resource Manager object
         self.rm         = pyvisa.ResourceManager('@py')
         self.vsa        = None
+        self.vsa_trace  = None
         self.vsa_arb    = None
 
 
@@ -81,8 +83,8 @@ class LabDemoVsaControl(QMainWindow):
         if self.vsa is not None:
             # Query the instrument for the trace data
             trace_id = 1
-            # Query trace data PyVISA method for reading numerical data from instruments
-            p           = self.vsa.query_ascii_values(":TRACe:DATA? TRACE1", container=np.array)
+            # Query trace data (binary REAL,32 transfer with ASCII fallback)
+            p           = self.vsa_trace.read()
             # Build the frequency list
 
             # Get the current frequency settings
@@ -115,6 +117,8 @@ class LabDemoVsaControl(QMainWindow):
                 # Reset and clear all status (errors) of the spectrum analyzer
                 self.vsa.write("*RST")
                 self.vsa.write("*CLS")
+                # Binary trace transfer (*RST restores the ASCII format)
+                self.vsa_trace  = TraceReader(self.vsa)
                 sleep(.1)
                 # Aligned the spectrum analyzer to the GUI values
                 self.cb_fc()
@@ -246,7 +250,8 @@ class LabDemoVsaControl(QMainWindow):
         if self.vsa is not None:
             if self.sender().isChecked():
                 print("HiResSnapshot button Checked")
-                self.thread = LongProcess(self.vsa)
+                # Only the whole scan is plotted (data): no streamed segments, fewest sweeps
+                self.thread = LongProcess(self.vsa, stream=False)
                 self.thread.progress.connect(self.cb_hires_scan)
                 self.thread.data.connect(self.cb_hi_res_plot)
 
@@ -17,6 +17,8 @@ import logging # for pyinstaller
 from python_rf_course_utils.qt import h_gui, PlotWidget, setup_logger
 
 from o310_long_process import LongProcess
+from rf_perf.trace import TraceReader
+from rf_perf.scpi import ErrorQueue
 
 
 def is_valid_ip(ip:str) -> bool:
@@ -65,6 +67,8 @@ class LabDemoVsaControl(QMainWindow):
         # Create a Resource Manager object
         self.rm         = pyvisa.ResourceManager('@py')
         self.vsa        = None
+        self.vsa_trace  = None
+        self.vsa_errors = None
 
         # Load the configuration/default values from the YAML file
         self.Params     = None
@@ -95,24 +99,23 @@ class LabDemoVsaControl(QMainWindow):
         if self.vsa is not None:
             # Add logging to the write command (Debug Level)
             self.log.debug(f"VSA Write: {cmd}")
-            self.vsa.write(cmd)
-            # Check for errors
-            e = self.vsa.query('SYST:ERR?').strip().split(',')
-            if int(e[0]) != 0:
-                self.log.error(f"Error: {e[1]}")
+            # Write and check for errors (per command, at the end of a group or on demand)
+            self.vsa_errors.write(cmd)
 
     def vsa_query(self, cmd:str):
         if self.vsa is not None:
             # Add logging to the query command (Debug Level)
             self.log.debug(f"VSA Query: {cmd}")
+            # Send the commands of an open group first (in order)
+            self.vsa_errors.flush()
             return self.vsa.query(cmd).strip()
 
     def vsa_read_trace(self):
         if self.vsa is not None:
             # Query the instrument for the trace data
             trace_id = 1
-            # Query trace data PyVISA method for reading numerical data from instruments
-            p           = self.vsa.query_ascii_values(":TRACe:DATA? TRACE1", container=np.array)
+            # Query trace data (binary REAL,32 transfer with ASCII fallback)
+            p           = self.vsa_trace.read()
             # Build the frequency list
 
             # Get the current frequency settings
@@ -135,6 +138,9 @@ class LabDemoVsaControl(QMainWindow):
                 ip              = self.h_gui['IP'].get_val()
                 self.vsa        = self.rm.open_resource(f"TCPIP0::{ip}::inst0::INSTR")
                 self.vsa.timeout = 5000
+                # Error check policy (command, batch or manual)
+                self.vsa_errors = ErrorQueue(self.vsa, log=self.log,
+                                             policy=self.Params.get('ErrorCheck', 'batch'))
                 self.log.info(f"Connected to {ip}")
                 # Read the signal generator status and update the GUI (RF On/Off, Modulation On/Off,Pout and Fc)
                 # Query the signal generator name
@@ -147,15 +153,19 @@ class LabDemoVsaControl(QMainWindow):
                 # Reset and clear all status (errors) of the spectrum analyzer
                 self.vsa_write("*RST")
                 self.vsa_write("*CLS")
+                # Binary trace transfer (*RST restores the ASCII format)
+                self.vsa_trace  = TraceReader(self.vsa, log=self.log)
                 sleep(.1)
                 # Aligned the spectrum analyzer to the GUI values
-                self.cb_fc()
-                self.cb_rbw()
-                self.cb_span()
-                self.cb_trace()
-                self.cb_detector()
-                # Sweep mode to continuous
-                self.vsa_write(":INITiate:CONTinuous ON")
+                # (a single error check for the whole group)
+                with self.vsa_errors.group():
+                    self.cb_fc()
+                    self.cb_rbw()
+                    self.cb_span()
+                    self.cb_trace()
+                    self.cb_detector()
+                    # Sweep mode to continuous
+                    self.vsa_write(":INITiate:CONTinuous ON")
 
             except Exception:
                 self.log.error("Connection failed")
@@ -269,8 +279,9 @@ class LabDemoVsaControl(QMainWindow):
             ref_level   = np.ceil(( y_max + 5.0 ) / 5.0) * 5.0
             scale2div   = np.round((ref_level - y_min)/10.0) + 1
 
-            self.vsa_write( f"DISP:WIND:TRAC:Y:PDIV {scale2div}")
-            self.vsa_write( f"DISP:WIND:TRAC:Y:RLEV {ref_level}")
+            with self.vsa_errors.group():
+                self.vsa_write( f"DISP:WIND:TRAC:Y:PDIV {scale2div}")
+                self.vsa_write( f"DISP:WIND:TRAC:Y:RLEV {ref_level}")
 
     def cb_hires_scan(self,i):
         self.h_gui['HiResProgress'].set_val(i)
@@ -279,7 +290,8 @@ class LabDemoVsaControl(QMainWindow):
         if self.vsa is not None:
             if self.sender().isChecked():
                 self.log.info("HiResSnapshot button Checked")
-                self.thread = LongProcess(self.vsa)
+                # Only the whole scan is plotted (data): no streamed segments, fewest sweeps
+                self.thread = LongProcess(self.vsa, stream=False)
                 self.thread.progress.connect(self.cb_hires_scan)
                 self.thread.data.connect(self.cb_hi_res_plot)
 
@@ -295,6 +307,9 @@ class LabDemoVsaControl(QMainWindow):
 
     def timer_refresh_plot(self):
         if self.vsa is not None:
+            # Errors of the writes since the last refresh (e.g. slider moves), one check for all
+            if self.vsa_errors.policy == 'batch':
+                self.vsa_errors.check()
             y,x = self.vsa_read_trace()
             self.plot_sa.plot( x , y ,
                                line='y-' , line_width=1.5,
@@ -17,6 +17,9 @@ import logging # for pyinstaller
 from python_rf_course_utils.qt import h_gui, PlotWidget, setup_logger
 
 from o310_long_process import LongProcess
+from rf_perf.trace import TraceReader, FreqAxisCache
+from rf_perf.scpi import ErrorQueue
+from rf_perf.decimate import MinMaxDecimator, minmax_decimate
 import ipaddress
 
 # Validate IP using ipaddress library
@@ -70,6 +73,12 @@ class LabDemoVsaControl(QMainWindow):
         # Create a Resource Manager object
         self.rm         = pyvisa.ResourceManager('@py')
         self.vsa        = None
+        self.vsa_trace  = None
+        self.vsa_errors = None
+        # Additional analyzer sessions of a parallel hi-res scan
+        self.hires_vsas = []
+        # Frequency axis of the trace (re-queried only after Fc/Span changes)
+        self.vsa_freq   = FreqAxisCache(self.vsa_query)
 
         # Load the configuration/default values from the YAML file
         self.Params     = None
@@ -90,6 +99,9 @@ class LabDemoVsaControl(QMainWindow):
         layout.addWidget(self.plot_sa)
         # Set the background color of the plot widget to white
         self.plot_sa.set_background_color('white')
+        # Min/max per pixel column of the traces longer than the plot is wide
+        # (the column split is recomputed on Fc/Span changes and resizes only)
+        self.plot_decimator = MinMaxDecimator(width=self.plot_sa.width())
 
         # Create a timer for the Spectrum Analyzer plot
         self.timer          = QTimer()
@@ -103,32 +115,25 @@ class LabDemoVsaControl(QMainWindow):
         if self.vsa is not None:
             # Add logging to the write command (Debug Level)
             self.log.debug(f"VSA Write: {cmd}")
-            self.vsa.write(cmd)
-            # Check for errors
-            e = self.vsa.query('SYST:ERR?').strip().split(',')
-            if int(e[0]) != 0:
-                self.log.error(f"Error: {e[1]}")
+            # Write and check for errors (per command, at the end of a group or on demand)
+            self.vsa_errors.write(cmd)
 
     def vsa_query(self, cmd:str):
         if self.vsa is not None:
             # Add logging to the query command (Debug Level)
             self.log.debug(f"VSA Query: {cmd}")
+            # Send the commands of an open group first (in order)
+            self.vsa_errors.flush()
             return self.vsa.query(cmd).strip()
 
     def vsa_read_trace(self):
         if self.vsa is not None:
             # Query the instrument for the trace data
             trace_id = 1
-            # Query trace data PyVISA method for reading numerical data from instruments
-            p           = self.vsa.query_ascii_values(":TRACe:DATA? TRACE1", container=np.array)
-            # Build the frequency list
-
-            # Get the current frequency settings
-            start_freq  = float(self.vsa_query(":FREQuency:START?" ))*1e-6
-            stop_freq   = float(self.vsa_query(":FREQuency:STOP?"  ))*1e-6
-            num_points  =   int(self.vsa_query(":SENSe:SWEep:POIN?"))
-            # Calculate frequency points
-            f           = np.linspace(start_freq, stop_freq, num_points)
+            # Query trace data (binary REAL,32 transfer with ASCII fallback)
+            p           = self.vsa_trace.read()
+            # Frequency list from the cache (a single SCPI round trip per refresh)
+            f           = self.vsa_freq.get(len(p))
 
             return p, f
 
@@ -142,7 +147,11 @@ class LabDemoVsaControl(QMainWindow):
             try:
                 ip              = self.h_gui['IP'].get_val()
                 self.vsa        = self.rm.open_resource(f"TCPIP0::{ip}::inst0::INSTR")
-                self.vsa.timeout = 60000
+                # Sweeps are not waited with a blocking *OPC? (see rf_perf.sweep), a short timeout is enough
+                self.vsa.timeout = 5000
+                # Error check policy (command, batch or manual)
+                self.vsa_errors = ErrorQueue(self.vsa, log=self.log,
+                                             policy=self.Params.get('ErrorCheck', 'batch'))
                 self.log.info(f"Connected to {ip}")
                 # Read the signal generator status and update the GUI (RF On/Off, Modulation On/Off,Pout and Fc)
                 # Query the signal generator name
@@ -155,15 +164,20 @@ class LabDemoVsaControl(QMainWindow):
                 # Reset and clear all status (errors) of the spectrum analyzer
                 self.vsa_write("*RST")
                 self.vsa_write("*CLS")
+                # Binary trace transfer (*RST restores the ASCII format)
+                self.vsa_trace  = TraceReader(self.vsa, log=self.log)
+                self.vsa_freq.invalidate()
                 sleep(.1)
                 # Aligned the spectrum analyzer to the GUI values
-                self.cb_fc()
-                self.cb_rbw()
-                self.cb_span()
-                self.cb_trace()
-                self.cb_detector()
-                # Sweep mode to continuous
-                self.vsa_write(":INITiate:CONTinuous ON")
+                # (a single error check for the whole group)
+                with self.vsa_errors.group():
+                    self.cb_fc()
+                    self.cb_rbw()
+                    self.cb_span()
+                    self.cb_trace()
+                    self.cb_detector()
+                    # Sweep mode to continuous
+                    self.vsa_write(":INITiate:CONTinuous ON")
 
             except Exception:
                 self.log.error("Connection failed")
@@ -204,6 +218,7 @@ class LabDemoVsaControl(QMainWindow):
             self.h_gui['Fc'].set_val(frequency_mhz)
 
         self.vsa_write(f"sense:FREQuency:CENTer {frequency_mhz} MHz") # can replace the '} MHz' with '}e6'
+        self.vsa_freq.invalidate()
         self.log.info(f"Fc = {frequency_mhz} MHz")
 
     def cb_rbw(self):
@@ -230,6 +245,7 @@ class LabDemoVsaControl(QMainWindow):
             self.h_gui['Span'].set_val(span)
 
         self.vsa_write(f"sense:FREQuency:SPAN {span} MHz")
+        self.vsa_freq.invalidate()
         self.log.info(f"Span = {span} MHz")
 
     def cb_trace(self):
@@ -277,8 +293,9 @@ class LabDemoVsaControl(QMainWindow):
             ref_level   = np.ceil(( y_max + 5.0 ) / 5.0) * 5.0
             scale2div   = np.round((ref_level - y_min)/10.0) + 1
 
-            self.vsa_write( f"DISP:WIND:TRAC:Y:PDIV {scale2div}")
-            self.vsa_write( f"DISP:WIND:TRAC:Y:RLEV {ref_level}")
+            with self.vsa_errors.group():
+                self.vsa_write( f"DISP:WIND:TRAC:Y:PDIV {scale2div}")
+                self.vsa_write( f"DISP:WIND:TRAC:Y:RLEV {ref_level}")
 
     def cb_hires_scan(self,i):
         self.h_gui['HiResProgress'].set_val(i)
@@ -287,9 +304,21 @@ class LabDemoVsaControl(QMainWindow):
         if self.vsa is not None:
             if self.sender().isChecked():
                 self.log.info("HiResSnapshot button Checked")
-                self.thread = LongProcess(self.vsa)
+                # Idle analyzers of the bench sweep part of the segments in parallel
+                self.hires_vsas = []
+                for ip in self.Params.get('HiResIPs') or []:
+                    try:
+                        vsa = self.rm.open_resource(f"TCPIP0::{ip}::inst0::INSTR")
+                        vsa.timeout = 5000
+                        self.hires_vsas.append(vsa)
+                        self.log.info(f"Hi-Res scan: analyzer {ip} added")
+                    except Exception:
+                        self.log.error(f"Hi-Res scan: connection to {ip} failed")
+                self.thread = LongProcess([self.vsa] + self.hires_vsas)
                 self.thread.progress.connect(self.cb_hires_scan)
-                self.thread.data.connect(self.cb_hi_res_plot)
+                # Every segment is drawn as soon as it is read
+                self.thread.segment.connect(self.cb_hi_res_plot)
+                self.thread.log.connect(self.log.info)
 
                 self.timer.stop()
                 self.thread.start() # Start the thread calling the run method
@@ -297,23 +326,39 @@ class LabDemoVsaControl(QMainWindow):
                 self.log.info("HiResSnapshot button Cleared")
                 self.thread.stop()
                 self.thread.wait()
+                for vsa in self.hires_vsas:
+                    vsa.close()
+                self.hires_vsas = []
                 self.h_gui['HiResProgress'].set_val(0)
+                # The recalled state is re-read on the next refresh
+                self.vsa_freq.invalidate()
                 self.timer.start()
 
 
     def timer_refresh_plot(self):
         if self.vsa is not None:
+            # Errors of the writes since the last refresh (e.g. slider moves), one check for all
+            if self.vsa_errors.policy == 'batch':
+                self.vsa_errors.check()
             y,x = self.vsa_read_trace()
+            self.log.debug(f"Frequency axis cache: {self.vsa_freq.hits} hits, {self.vsa_freq.misses} misses")
+            self.plot_decimator.width = self.plot_sa.width()
+            x,y = self.plot_decimator(x, y)
             self.plot_sa.plot( x , y ,
                                line='b-' , line_width=4.0,
                                xlabel='Frequency (MHz)', ylabel='Power dBm',
                                title='PSA', xlog=False, clf=True)
 
-    def cb_hi_res_plot(self, freq, power):
+    def cb_hi_res_plot(self, start, freq, power):
+            # Pixel columns of the segment (its share of the whole scan), min/max of each
+            plan        = self.thread.plan
+            width       = int(np.ceil(self.plot_sa.width()*(freq[-1] - freq[0])/(plan.f_stop - plan.f_start))) + 1
+            freq, power = minmax_decimate(freq, power, width)
+            # Only the new segment is added to the plot (the first one clears the live trace)
             self.plot_sa.plot( freq , power ,
                                line='b-' , line_width=4.0,
                                xlabel='Frequency (MHz)', ylabel='Power dBm',
-                               title='Hi-Res PSA', xlog=False, clf=True)
+                               title='Hi-Res PSA', xlog=False, clf=start == 0)
 
     def cb_save(self):
         self.log.info("Save")
@@ -349,6 +394,8 @@ class LabDemoVsaControl(QMainWindow):
         # Close the connection to the signal generator
         if self.vsa is not None:
             self.vsa.close()
+        for vsa in self.hires_vsas:
+            vsa.close()
         # Close the Resource Manager
         self.rm.close()
 
@@ -1,22 +1,54 @@
+import queue
+import threading
+
 from PyQt6.QtCore       import QThread, pyqtSignal
 
 import numpy as np
 
+from rf_perf.trace import TraceReader
+from rf_perf.sweep import SweepCompletion
+from rf_perf.stitch import SegmentPlan, Stitcher, query_max_points
+
 
 class LongProcess(QThread):
     # Define signals as class attributes (for progressbar and returned data)
     progress    = pyqtSignal(int)
     data        = pyqtSignal(np.ndarray, np.ndarray)
+    # Streaming: (start index in the stitched scan, freq, power) of every new segment
+    segment     = pyqtSignal(int, np.ndarray, np.ndarray)
+    log         = pyqtSignal(str)
 
-    def __init__(self, vsa):
+    def __init__(self, vsa, stream=True, overlap=3, trim=1, stitch='drop', bins_per_rbw=3.0, max_points=None,
+                 min_segments=None):
         super().__init__()
-        self.vsa = vsa
+        # One analyzer session, or a list of them sweeping the segments in parallel
+        # (the first one holds the scan settings)
+        self.vsas = list(vsa) if isinstance(vsa, (list, tuple)) else [vsa]
+        self.vsa = self.vsas[0]
+        # Emit every segment as soon as it is read (views of the preallocated scan buffer)
+        self.stream = stream
+        # Segment stitching: bins shared by neighbours, edge bins dropped, 'drop' or 'fade'
+        self.overlap = overlap
+        self.trim = trim
+        self.stitch = stitch
+        # Sweep points chosen for this bin density (trace bins per RBW)
+        self.bins_per_rbw = bins_per_rbw
+        # Cap of the sweep points per segment (None: the instrument maximum)
+        self.max_points = max_points
+        # Fewest segments: a streamed scan is cut in pieces, the first one is drawn early
+        self.min_segments = min_segments if min_segments is not None else (10 if stream else 1)
+        self.plan = None
+        # Predicted total sweep time of the scan (s)
+        self.predicted_time = None
         self.running = False
 
     def run(self):
         # Save the instrument attributes for recall at the end of the scan
         self.running = True
-        self.vsa.write("*SAV 1")
+        for vsa in self.vsas:
+            vsa.write("*SAV 1")
+        # Binary trace transfer for the scan
+        readers = [TraceReader(vsa) for vsa in self.vsas]
         # Hi-Res scan of the spectrum analyzer
         fc              = float(self.vsa.query(':sens:FREQ:CENT?').strip())*1e-6  # MHz Center Frequency
         # Get the current RBW and span settings
@@ -24,9 +56,18 @@ class LongProcess(QThread):
         # rbw             = 0.01      # MHz Resolution Bandwidth
         span            = float(self.vsa.query(':sens:FREQuency:SPAN?').strip())*1e-6  # MHz Span
         # span            = 5.0       # MHz Span
-        Fstart          = fc - span*20.0 # MHz Start center Frequency
-        Fstop           = fc + span*20.0 # MHz Stop center Frequency
-        Fscan           = np.arange(Fstart, Fstop, span)
+        Fstart          = fc - span*20.0 # MHz Start Frequency
+        Fstop           = fc + span*20.0 # MHz Stop Frequency
+        # Fewest segments (sweeps) with bins_per_rbw bins per RBW, up to the maximum points of
+        # every analyzer (and max_points), at least min_segments and one segment per analyzer
+        num_points      = int(self.vsa.query(':SENS:SWE:POIN?'))
+        max_points      = min(query_max_points(vsa, fallback=num_points) for vsa in self.vsas)
+        if self.max_points is not None:
+            max_points  = min(max_points, self.max_points)
+        self.plan       = SegmentPlan.for_rbw(Fstart, Fstop, rbw, max_points=max_points,
+                                              bins_per_rbw=self.bins_per_rbw,
+                                              overlap=self.overlap, trim=self.trim,
+                                              min_segments=max(self.min_segments, len(self.vsas)))
 
         # Calculate the refrence level
         # set the RBW to maximum
@@ -35,64 +76,111 @@ class LongProcess(QThread):
         self.vsa.write(":TRACe1:TYPE MAXHold"               )
         self.vsa.write("sense:DETEctor POS"                 )
         self.vsa.write("INITiate:CONTinuous OFF"            )
-        self.vsa.write("INITiate:IMMediate"                 )
+        # Sweep completion by SRQ / *ESR? polling (no blocking *OPC? on the session)
+        sweeps = [SweepCompletion(vsa) for vsa in self.vsas]
+        sweeps[0].start()
         # Wait for the sweep to complete
-        self.vsa.query("*OPC?")
+        sweeps[0].wait()
         # Read the trace data
         # Query the instrument for the trace data
-        trace_data  = self.vsa.query_ascii_values(':TRAC? TRACE1', container=np.array)
+        trace_data  = readers[0].read()
         max_level   = np.ceil( np.max(trace_data)/5 + 1)*5
-        # Set the reference level
-        self.vsa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
-
-        # Set the hi-res scan attributes
-        self.vsa.write(f"sense:BANDwidth:RESolution {rbw} MHz"          )
-        self.vsa.write(f"sense:FREQuency:SPAN {span} MHz"               )
-        self.vsa.write(":TRACe1:TYPE WRITe"                             )
-        self.vsa.write("sense:DETEctor AVERage"                         )
-        # Set single sweep mode
-        self.vsa.write("INITiate:CONTinuous OFF"                        )
-
-        # Create a list to store the scan data
-        all_data = []
-        all_freq = []
-        for i, f in enumerate(Fscan):
-            # Set the center frequency
-            self.vsa.write(f"sense:FREQuency:CENTer {f} MHz")
-            # Initiate a single sweep
-            self.vsa.write("INITiate:IMMediate")
-            # Wait for the sweep to complete
-            # time_start = time.perf_counter()
-            self.vsa.query("*OPC?")
-            # print(f"Sweep {i+1} completed in {time.perf_counter() - time_start:.2f} seconds")
-            # Query the instrument for the trace data
-            trace_data = self.vsa.query_ascii_values(':TRAC? TRACE1', container=np.array)
-
-            # Get the current frequency settings
-            start_freq  = float(self.vsa.query(':SENS:FREQ:START?'))
-            stop_freq   = float(self.vsa.query(':SENS:FREQ:STOP?' ))
-            num_points  =   int(self.vsa.query(':SENS:SWE:POIN?'  ))
-
-            # Calculate frequency points
-            f           = np.linspace(start_freq*1e-6, stop_freq*1e-6, num_points)
-
-            # Append the data to the list (in a flattened format)
-            all_data = np.concatenate([all_data, trace_data  ])
-            all_freq = np.concatenate([all_freq, f           ])
-            # Update the progress bar
-            self.progress.emit(100 * (i + 1) // len(Fscan))
-            if not self.running:
-                break
-
-        # Recall the instrument settings
-        self.vsa.write("*RCL 1")
-        # Set continuous sweep mode
-        self.vsa.write("INITiate:CONTinuous ON")
+
+        # Set the hi-res scan attributes of every analyzer
+        sweep_times = [self.setup_scan(vsa, rbw, max_level) for vsa in self.vsas]
+        # Segments of every analyzer (round robin, they come in about frequency order)
+        parts       = self.plan.partition(len(self.vsas))
+        # The analyzers sweep in parallel, the busiest one sets the scan time
+        self.predicted_time = max(t*len(part) for t, part in zip(sweep_times, parts))
+        self.log.emit(f"Hi-Res scan: {len(self.plan)} segments x {self.plan.points} points on "
+                      f"{len(self.vsas)} analyzer(s), {max(sweep_times):.3f} s per sweep, "
+                      f"{self.predicted_time:.2f} s total")
+
+        # Preallocated stitched scan (all the segments)
+        scan = Stitcher(self.plan, mode=self.stitch)
+        # One worker per analyzer, the traces come back through the queue as (segment, trace)
+        traces  = queue.Queue()
+        workers = [threading.Thread(target=self.scan_segments, daemon=True,
+                                    args=(vsa, reader, sweep, part, sweep_time, traces))
+                   for vsa, reader, sweep, part, sweep_time in zip(self.vsas, readers, sweeps, parts, sweep_times)]
+        for worker in workers:
+            worker.start()
+
+        # Stitch in frequency order, the segments read ahead by the other analyzers wait in pending
+        pending     = {}
+        stitched    = 0
+        finished    = 0
+        while stitched < len(self.plan) and finished < len(workers):
+            i, trace_data = traces.get()
+            if i is None:
+                # End of a worker (trace_data is the exception of a failed one)
+                finished += 1
+                if trace_data is not None:
+                    self.log.emit(f"Hi-Res scan failed: {trace_data}")
+                    self.running = False
+                continue
+            pending[i] = trace_data
+            while stitched in pending:
+                # Stitch the segment on the common frequency grid
+                start, stop = scan.add(stitched, pending.pop(stitched))
+                if self.stream:
+                    # Views of the new region only (the buffer is preallocated, they stay valid)
+                    self.segment.emit(start, scan.freq[start:stop], scan.power[start:stop])
+                stitched += 1
+                # Update the progress bar
+                self.progress.emit(100 * stitched // len(self.plan))
+        for worker in workers:
+            worker.join()
+
+        for vsa, reader in zip(self.vsas, readers):
+            # Recall the instrument settings (also the sweep points)
+            vsa.write("*RCL 1")
+            # The recalled state may include the ASCII format, restore the binary transfer
+            reader.configure()
+            # Set continuous sweep mode
+            vsa.write("INITiate:CONTinuous ON")
         if self.running:
             # Emit the data signal
-            self.data.emit(all_freq , all_data)
+            self.data.emit(scan.freq , scan.power)
+
+    def setup_scan(self, vsa, rbw, ref_level):
+        '''
+        Set the hi-res scan attributes of one analyzer.
 
+        Returns: sweep time of a segment (s)
+        '''
+        vsa.write(f"DISP:WIND:TRAC:Y:RLEV {ref_level}"             )
+        vsa.write(f"sense:BANDwidth:RESolution {rbw} MHz"          )
+        vsa.write(f"sense:FREQuency:SPAN {self.plan.span} MHz"     )
+        vsa.write(f"sense:SWEep:POINts {self.plan.points}"         )
+        vsa.write(":TRACe1:TYPE WRITe"                             )
+        vsa.write("sense:DETEctor AVERage"                         )
+        # Set single sweep mode
+        vsa.write("INITiate:CONTinuous OFF"                        )
+        # The sweep time is the same for all the segments
+        return float(vsa.query(":SWEep:TIME?"))
+
+    def scan_segments(self, vsa, reader, sweep, segments, sweep_time, traces):
+        '''
+        Worker of one analyzer: sweep its segments and queue (segment, trace), then
+        (None, None) at the end or (None, exception) on a failure.
+        '''
+        try:
+            for i in segments:
+                if not self.running:
+                    break
+                # Set the center frequency
+                vsa.write(f"sense:FREQuency:CENTer {self.plan.centers[i]} MHz")
+                # Initiate a single sweep
+                sweep.start(sweep_time)
+                # Wait for the sweep to complete
+                sweep.wait()
+                # Query the instrument for the trace data
+                traces.put((i, reader.read()))
+        except Exception as e:
+            traces.put((None, e))
+            return
+        traces.put((None, None))
 
     def stop(self):
         self.running = False
-
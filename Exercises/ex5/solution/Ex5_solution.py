@@ -9,10 +9,11 @@ from    PyQt6.uic          import loadUi
 import numpy as np
 
 from python_rf_course_utils.qt   import h_gui, PlotWidget, setup_logger
-from python_rf_course_utils.scpi import SCPIWrapper
 
 from ex5_long_process import LongProcess
 
+from rf_perf.scpi import FastSCPIWrapper
+
 
 def is_valid_ip(ip:str) -> bool:
     # Regular expression pattern for matching IP address
@@ -86,15 +87,18 @@ class LabNetworkControl(QMainWindow):
                 self.sg        = self.rm.open_resource(f"TCPIP0::{ip_sg}::inst0::INSTR")
                 self.sa.timeout = 5000
                 self.sg.timeout = 5000
-                self.scpi_sa    = SCPIWrapper(instr=self.sa, log= self.log, name='SA')
-                self.scpi_sg    = SCPIWrapper(instr=self.sg, log= self.log, name='SG')
+                # SCPI wrappers with write coalescing (batch)
+                self.scpi_sa    = FastSCPIWrapper(instr=self.sa, log= self.log, name='SA')
+                self.scpi_sg    = FastSCPIWrapper(instr=self.sg, log= self.log, name='SG')
 
                 self.log.info(f"Connected to {ip_sa=} and {ip_sg=}")
                 # Reset and clear all status (errors) of the spectrum analyzer
-                self.scpi_sa.write("*RST")
-                self.scpi_sa.write("*CLS")
-                self.scpi_sg.write("*RST")
-                self.scpi_sg.write("*CLS")
+                # (each instrument batch is sent as a single message)
+                with self.scpi_sa.batch(), self.scpi_sg.batch():
+                    self.scpi_sa.write("*RST")
+                    self.scpi_sa.write("*CLS")
+                    self.scpi_sg.write("*RST")
+                    self.scpi_sg.write("*CLS")
                 # Read the signal generator status and update the GUI (RF On/Off, Modulation On/Off,Pout and Fc)
                 # Query the signal generator name
                 # <company_name>, <model_number>, <serial_number>,<firmware_revision>
@@ -154,8 +158,13 @@ class LabNetworkControl(QMainWindow):
 
     # thread callback functions
     def tcb_plot(self, freq, power):
-        freq_v  = self.f_scan
-        power_v = np.concatenate((power, np.ones(len(freq_v)-len(power))*-100)) - self.Params['Pout']
+        if self.Params.get('Adaptive', False):
+            # Non-uniform grid measured so far (it spans the whole scan from the first pass)
+            freq_v  = freq
+            power_v = power - self.Params['Pout']
+        else:
+            freq_v  = self.f_scan
+            power_v = np.concatenate((power, np.ones(len(freq_v)-len(power))*-100)) - self.Params['Pout']
         self.plot_sa.plot( freq_v , power_v,
                            line='b-' , line_width=1.5,
                            xlabel='Frequency (MHz)', ylabel='Power dBm',
@@ -168,13 +177,18 @@ class LabNetworkControl(QMainWindow):
                                       self.h_gui['Fstop'  ].get_val(),
                                       self.h_gui['Npoints'].get_val())
             # Set the signal generator to output power (self.Params["Pout"]))
-            self.scpi_sg.write(f":OUTP:STAT OFF")
-            self.scpi_sg.write(f":POW:LEV {self.Params['Pout']} dBm")
+            with self.scpi_sg.batch():
+                self.scpi_sg.write(f":OUTP:STAT OFF")
+                self.scpi_sg.write(f":POW:LEV {self.Params['Pout']} dBm")
             # initialize the freq and power arrays to empty
             self.freq = np.array([])
             self.power = np.array([])
             # Create the thread object
-            self.thread = LongProcess(f_scan=self.f_scan, scpi_sa=self.scpi_sa,scpi_sg=self.scpi_sg) # Create the thread object
+            self.thread = LongProcess(f_scan=self.f_scan, scpi_sa=self.scpi_sa,scpi_sg=self.scpi_sg,
+                                      pipelined=self.Params.get('Pipelined', True),
+                                      zero_span=self.Params.get('ZeroSpan', False),
+                                      adaptive=self.Params.get('Adaptive', False),
+                                      adaptive_tol=self.Params.get('AdaptiveTol', 0.5)) # Create the thread object
             self.thread.progress.connect(self.tcb_progress)
             self.thread.data.connect(self.tcb_plot)
             self.thread.log.connect(        self.log.info      )
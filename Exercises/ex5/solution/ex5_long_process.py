@@ -1,5 +1,16 @@
 from PyQt6.QtCore       import QThread, pyqtSignal
+import asyncio
 import numpy as np
+import pyvisa
+import time
+
+from rf_perf.sweep import SweepCompletion
+from rf_perf.timing import StageTimer
+from rf_perf.buffers import ResultBuffer
+from rf_perf.listsweep import ListSweep
+from rf_perf.trace import TraceReader
+from rf_perf.adaptive import AdaptiveScan
+from rf_perf.aioscpi import AsyncSCPIWrapper
 
 
 class LongProcess(QThread):
@@ -8,18 +19,47 @@ class LongProcess(QThread):
     data        = pyqtSignal(np.ndarray, np.ndarray)
     log         = pyqtSignal(str)
 
-    def __init__(self, f_scan,scpi_sa, scpi_sg):
+    def __init__(self, f_scan,scpi_sa, scpi_sg, pipelined=True, sg_settle=0.005, sg_list=True,
+                 zero_span=False, zs_sweep_time=0.001, zs_points=101, adaptive=False, adaptive_tol=0.5,
+                 use_async=False):
         super().__init__()
         self.f_scan     = f_scan
         self.scpi_sa    = scpi_sa
         self.scpi_sg    = scpi_sg
-        
+        # Pipelined mode: the SG tunes to the next point while the SA trace is read out
+        self.pipelined  = pipelined
+        self.sg_settle  = sg_settle # s SG frequency settling time
+        # SG list sweep (f_scan downloaded once, *TRG per point), stepped writes if False
+        # or if the SG has no list mode
+        self.sg_list    = sg_list
+        self.sg_sweep   = None
+        # Zero span mode: the SA stays on the tone (span 0) for a short acquisition and
+        # the trace is averaged on the host instead of a swept span and a marker search
+        self.zero_span  = zero_span
+        self.zs_sweep_time = zs_sweep_time # s
+        self.zs_points  = zs_points
+        # Adaptive scan: coarse pass, then refinement where the response bends, at most
+        # len(f_scan) points (non-uniform grid)
+        self.adaptive   = adaptive
+        self.adaptive_tol = adaptive_tol # dB target interpolation error
+        # asyncio scan (run_async) on separate asyncio connections to the same instruments:
+        # the pipelined swept scan with stepped SG writes only
+        if use_async and (sg_list or zero_span or adaptive or not pipelined):
+            raise ValueError("use_async runs the pipelined swept scan with stepped SG writes only: "
+                             "sg_list, zero_span and adaptive must be False and pipelined True")
+        self.use_async  = use_async
+        self.timer      = None
+
         self.running    = False
 
     def run(self):
+        if self.use_async:
+            asyncio.run(self.run_async_connected())
+            return
         # Save the instrument attributes for recall at the end of the scan
         self.running = True
-        self.log.emit("Thread: Starting scan")
+        mode = 'zero span' if self.zero_span else ('pipelined' if self.pipelined else 'sequential')
+        self.log.emit(f"Thread: Starting {'adaptive ' if self.adaptive else ''}scan ({mode})")
 
         # Set RF output on
         self.scpi_sg.write(":OUTPUT:STATE ON")
@@ -27,53 +67,378 @@ class LongProcess(QThread):
         # set the RBW
         self.scpi_sa.write("sense:BANDwidth:RESolution 0.1 MHz")
         self.scpi_sa.write("sense:DETEctor AVERage")
+        # Set the span (the same for all the scan points)
+        self.scpi_sa.write(f"sense:FREQuency:SPAN 5 MHz")
         # Trace Clear/write mode
         self.scpi_sa.write("TRACe:MODE WRITe")
         self.scpi_sa.write("INITiate:CONTinuous OFF")
+        # Sweep completion by SRQ / *ESR? polling, the sweeps of the scan are ~1 ms: a missed
+        # poll is retried after 0.5 ms, not the 5 ms default (4x the sweep)
+        self.sweep = SweepCompletion(self.scpi_sa, min_poll=0.0005)
+        # Per stage timing breakdown
+        self.timer = StageTimer()
 
-        # Create a list to store the scan data
-        power = np.array([])
-        freq  = np.array([])
-        for i, f in enumerate(self.f_scan):
-            # Set the SG to the frequency of the current scan point
-            self.scpi_sg.write(f"freq {f} MHz")
-            # Set the SA center frequency
-            self.scpi_sa.write(f"sense:FREQuency:CENTer {f} MHz")
-            # Set the span
-            self.scpi_sa.write(f"sense:FREQuency:SPAN 5 MHz")
-            # Initiate a single sweep
-            self.scpi_sa.write("INITiate:IMMediate")
-            try:
-                self.scpi_sa.query("*OPC?")
-            except pyvisa.errors.VisaIOError:
-                self.log.emit(f"Thread: OPC Failed at {f} MHz")
-
-            # Set marker to peak
-            self.scpi_sa.write("CALCulate:MARKer:MAXimum")
-            # Get the peak value
-            peak_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?").strip())
-            # Set the reference level
+        if self.adaptive:
+            freq, power = self.scan_adaptive()
+        else:
+            freq, power = self.scan(self.f_scan)
+        self.log.emit(f"Thread: SG {self.sg_sweep.mode}")
+
+        self.log.emit(f"Thread: {self.timer.report(len(freq))}")
+        # Emit the data signal
+        self.data.emit(freq, power)
+
+    def scan(self, f_scan, is_batch=False):
+        '''
+        Measure the scan points with the selected method.
+        Args:
+            f_scan:   frequencies in MHz (ascending)
+            is_batch: part of an adaptive scan (no partial data and progress signals)
+
+        Returns: (freq, power) arrays
+        '''
+        # SG frequency list (Hz)
+        self.sg_sweep = ListSweep(self.scpi_sg, np.asarray(f_scan)*1e6, use_list=self.sg_list)
+        try:
+            if self.zero_span:
+                freq, power = self.scan_zero_span(f_scan, is_batch)
+            elif self.pipelined:
+                freq, power = self.scan_pipelined(f_scan, is_batch)
+            else:
+                freq, power = self.scan_sequential(f_scan, is_batch)
+        finally:
+            # Leave the list mode also on an error (a FREQ write has no effect in list mode)
+            self.sg_sweep.stop()
+        return freq, power
+
+    def scan_adaptive(self):
+        '''
+        Adaptive scan: a coarse uniform pass, then batches of points in the middle of the
+        intervals whose estimated interpolation error exceeds adaptive_tol, within a
+        budget of len(f_scan) points.
+
+        Returns: (freq, power) of the non-uniform grid, sorted by frequency
+        '''
+        planner = AdaptiveScan(self.f_scan[0], self.f_scan[-1], tol_db=self.adaptive_tol,
+                               max_points=len(self.f_scan))
+        f_batch = planner.next_batch()
+        while len(f_batch) and self.running:
+            planner.add(*self.scan(f_batch, is_batch=True))
+            # The whole grid measured so far (non-uniform)
+            self.data.emit(*planner.result())
+            self.progress.emit(100 * planner.points // len(self.f_scan))
+            f_batch = planner.next_batch()
+        self.progress.emit(100)
+        self.log.emit(f"Thread: adaptive scan {planner.points} points in {planner.batches} batches")
+        return planner.result()
+
+    def scan_sequential(self, f_scan, is_batch=False):
+        # The span, RBW and detector are the same for all the points: one sweep time query
+        sweep_time = float(self.scpi_sa.query(":SWEep:TIME?"))
+        # Preallocated buffer for the scan data
+        scan = ResultBuffer(len(f_scan), columns=('freq', 'power'))
+        for i, f in enumerate(f_scan):
+            with self.timer.stage('tune'):
+                # Set the SG to the frequency of the current scan point
+                self.sg_tune(i)
+                # The settling starts when the SG has applied the step, not when the write returns
+                self.scpi_sg.query("*OPC?")
+                t_sg_tuned = time.perf_counter()
+                # Set the SA center frequency
+                self.scpi_sa.write(f"sense:FREQuency:CENTer {f} MHz")
+            with self.timer.stage('settle'):
+                # Let the SG settle before the sweep starts
+                time.sleep(max(t_sg_tuned + self.sg_settle - time.perf_counter(), 0.0))
+            with self.timer.stage('sweep'):
+                # Initiate a single sweep
+                self.sweep.start(sweep_time)
+                try:
+                    self.sweep.wait()
+                except (pyvisa.errors.VisaIOError, TimeoutError):
+                    self.log.emit(f"Thread: OPC Failed at {f} MHz")
+
+            with self.timer.stage('readout'):
+                # Set marker to peak
+                self.scpi_sa.write("CALCulate:MARKer:MAXimum")
+                # Get the peak value
+                peak_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?").strip())
+                # Set the reference level
+                max_level  = np.ceil( peak_value/10 + 1)*10
+                set_level  = float(self.scpi_sa.query(f"DISP:WIND:TRAC:Y:RLEV?").strip() )
+                if set_level != max_level:
+                    self.log.emit(f"Thread: Setting reference level to {max_level}")
+                    self.scpi_sa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
+            # save the peak value and frequency
+            scan.append(f, peak_value)
+
+            if i%20==0 and not is_batch:
+                # Views of the results (no copy)
+                self.data.emit(*scan.views())
+
+            # Update the progress bar
+            if not is_batch:
+                self.progress.emit(100 * (i + 1) // len(f_scan))
+            if not self.running:
+                break
+
+        return scan.views()
+
+    def scan_pipelined(self, f_scan, is_batch=False):
+        '''
+        Pipelined scan: as soon as the sweep of point i ends the SG is tuned to point i+1,
+        so its command parsing and settling overlap the marker readout of point i. The SA
+        re-tune, reference level and sweep start of point i+1 are sent as one message.
+        (The SG can not move during the sweep of point i, the tone must stay in the span.)
+        '''
+        n_points    = len(f_scan)
+        sweep_time  = float(self.scpi_sa.query(":SWEep:TIME?"))
+        set_level   = float(self.scpi_sa.query("DISP:WIND:TRAC:Y:RLEV?").strip())
+        # Reference level for the next sweep (unchanged for an empty scan)
+        max_level   = set_level
+
+        # Tune the first point
+        if n_points:
+            with self.timer.stage('tune'):
+                self.sg_tune(0)
+                self.scpi_sa.write(f"sense:FREQuency:CENTer {f_scan[0]} MHz")
+        t_sg_tuned = time.perf_counter()
+
+        # Preallocated buffer for the scan data
+        scan = ResultBuffer(n_points, columns=('freq', 'power'))
+        for i, f in enumerate(f_scan):
+            with self.timer.stage('settle'):
+                # Let the SG settle before the sweep starts
+                time.sleep(max(t_sg_tuned + self.sg_settle - time.perf_counter(), 0.0))
+            with self.timer.stage('sweep'):
+                if i > 0:
+                    # SA center, reference level and sweep start in one message
+                    with self.scpi_sa.batch():
+                        self.scpi_sa.write(f"sense:FREQuency:CENTer {f} MHz")
+                        if set_level != max_level:
+                            self.log.emit(f"Thread: Setting reference level to {max_level}")
+                            self.scpi_sa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
+                            set_level = max_level
+                        self.sweep.start(sweep_time)
+                else:
+                    self.sweep.start(sweep_time)
+                try:
+                    self.sweep.wait()
+                except (pyvisa.errors.VisaIOError, TimeoutError):
+                    self.log.emit(f"Thread: OPC Failed at {f} MHz")
+
+            # The trace of point i is captured, start tuning the SG to point i+1
+            if i + 1 < n_points:
+                with self.timer.stage('tune'):
+                    self.sg_tune(i + 1)
+                t_sg_tuned = time.perf_counter()
+
+            with self.timer.stage('readout'):
+                # Marker to peak and its value in one transaction
+                peak_value = float(self.scpi_sa.query("CALCulate:MARKer:MAXimum;:CALCulate:MARKer:Y?").strip())
+            # Reference level for the next sweep
             max_level  = np.ceil( peak_value/10 + 1)*10
-            set_level  = float(self.scpi_sa.query(f"DISP:WIND:TRAC:Y:RLEV?").strip() )
+            # save the peak value and frequency
+            scan.append(f, peak_value)
+
+            if i%20==0 and not is_batch:
+                # Views of the results (no copy)
+                self.data.emit(*scan.views())
+
+            # Update the progress bar
+            if not is_batch:
+                self.progress.emit(100 * (i + 1) // n_points)
+            if not self.running:
+                break
+
+        if set_level != max_level:
+            self.scpi_sa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
+
+        return scan.views()
+
+    def scan_zero_span(self, f_scan, is_batch=False):
+        '''
+        Zero span scan: the SA is centered on the tone with span 0 and a short sweep time,
+        the power is the mean (in W) of the trace, read in binary. Pipelined like
+        scan_pipelined (the SG tunes to point i+1 while the trace of point i is read).
+        '''
+        n_points    = len(f_scan)
+        set_level   = float(self.scpi_sa.query("DISP:WIND:TRAC:Y:RLEV?").strip())
+        # Reference level for the next sweep (unchanged for an empty scan)
+        max_level   = set_level
+        points      = int(self.scpi_sa.query(":SWEep:POINts?"))
+        with self.scpi_sa.batch():
+            self.scpi_sa.write("sense:FREQuency:SPAN 0 Hz")
+            self.scpi_sa.write(f"sense:SWEep:POINts {self.zs_points}")
+            self.scpi_sa.write(f"sense:SWEep:TIME {self.zs_sweep_time}")
+        reader      = TraceReader(self.scpi_sa)
+
+        # Tune the first point
+        if n_points:
+            with self.timer.stage('tune'):
+                self.sg_tune(0)
+                self.scpi_sa.write(f"sense:FREQuency:CENTer {f_scan[0]} MHz")
+        t_sg_tuned = time.perf_counter()
+
+        # Preallocated buffer for the scan data
+        scan = ResultBuffer(n_points, columns=('freq', 'power'))
+        for i, f in enumerate(f_scan):
+            with self.timer.stage('settle'):
+                # Let the SG settle before the acquisition starts
+                time.sleep(max(t_sg_tuned + self.sg_settle - time.perf_counter(), 0.0))
+            with self.timer.stage('sweep'):
+                if i > 0:
+                    # SA center, reference level and sweep start in one message
+                    with self.scpi_sa.batch():
+                        self.scpi_sa.write(f"sense:FREQuency:CENTer {f} MHz")
+                        if set_level != max_level:
+                            self.log.emit(f"Thread: Setting reference level to {max_level}")
+                            self.scpi_sa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
+                            set_level = max_level
+                        self.sweep.start(self.zs_sweep_time)
+                else:
+                    self.sweep.start(self.zs_sweep_time)
+                try:
+                    self.sweep.wait()
+                except (pyvisa.errors.VisaIOError, TimeoutError):
+                    self.log.emit(f"Thread: OPC Failed at {f} MHz")
+
+            # The trace of point i is captured, start tuning the SG to point i+1
+            if i + 1 < n_points:
+                with self.timer.stage('tune'):
+                    self.sg_tune(i + 1)
+                t_sg_tuned = time.perf_counter()
+
+            with self.timer.stage('readout'):
+                trace       = reader.read()
+                # Mean power (not the mean of the dB values, biased on noise)
+                peak_value  = 10*np.log10(np.mean(10**(trace/10)))
+            # Reference level for the next sweep
+            max_level  = np.ceil( peak_value/10 + 1)*10
+            # save the power value and frequency
+            scan.append(f, peak_value)
+
+            if i%20==0 and not is_batch:
+                # Views of the results (no copy)
+                self.data.emit(*scan.views())
+
+            # Update the progress bar
+            if not is_batch:
+                self.progress.emit(100 * (i + 1) // n_points)
+            if not self.running:
+                break
+
+        # Back to the swept span
+        with self.scpi_sa.batch():
             if set_level != max_level:
-                self.log.emit(f"Thread: Setting reference level to {max_level}")
                 self.scpi_sa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
+            self.scpi_sa.write(f"sense:FREQuency:SPAN 5 MHz")
+            self.scpi_sa.write(f"sense:SWEep:POINts {points}")
+            self.scpi_sa.write("sense:SWEep:TIME:AUTO ON")
+
+        return scan.views()
+
+    async def run_async_connected(self):
+        '''
+        Open asyncio connections to the instruments of scpi_sa and scpi_sg and run the
+        coroutine scan.
+        '''
+        sa, sg = await asyncio.gather(AsyncSCPIWrapper.from_wrapper(self.scpi_sa),
+                                      AsyncSCPIWrapper.from_wrapper(self.scpi_sg))
+        try:
+            await self.run_async(sa, sg)
+        finally:
+            await asyncio.gather(sa.close(), sg.close())
+
+    async def run_async(self, sa, sg):
+        '''
+        Coroutine version of the pipelined scan (swept span, stepped SG writes) on
+        AsyncSCPIWrapper connections. The sweep wait is a plain *OPC? that suspends only
+        this coroutine, so the scans of several benches can share one event loop thread.
+        Args:
+            sa: AsyncSCPIWrapper of the spectrum analyzer
+            sg: AsyncSCPIWrapper of the signal generator
+
+        Returns: (freq, power) arrays
+        '''
+        self.running = True
+        self.log.emit("Thread: Starting scan (asyncio)")
+        f_scan      = self.f_scan
+        n_points    = len(f_scan)
+        self.timer  = StageTimer()
+
+        # RF output on, RBW, detector, span, trace mode and single sweep (one message each)
+        await sg.write(":OUTPUT:STATE ON;:OUTPUT:MOD:STATE OFF")
+        await sa.write("sense:BANDwidth:RESolution 0.1 MHz;:sense:DETEctor AVERage;"
+                       ":sense:FREQuency:SPAN 5 MHz;:TRACe:MODE WRITe;:INITiate:CONTinuous OFF")
+        sweep_time, set_level = await asyncio.gather(sa.query(":SWEep:TIME?"), sa.query("DISP:WIND:TRAC:Y:RLEV?"))
+        sweep_time  = float(sweep_time)
+        set_level   = float(set_level)
+        max_level   = set_level
+
+        # Tune the first point
+        with self.timer.stage('tune'):
+            await sg.write(f"freq {f_scan[0]} MHz")
+        t_sg_tuned = time.perf_counter()
+
+        # Preallocated buffer for the scan data
+        scan = ResultBuffer(n_points, columns=('freq', 'power'))
+        for i, f in enumerate(f_scan):
+            with self.timer.stage('settle'):
+                # Let the SG settle before the sweep starts
+                await asyncio.sleep(max(t_sg_tuned + self.sg_settle - time.perf_counter(), 0.0))
+            with self.timer.stage('sweep'):
+                # SA center, reference level, sweep start and completion in one message
+                cmd = f"sense:FREQuency:CENTer {f} MHz"
+                if set_level != max_level:
+                    self.log.emit(f"Thread: Setting reference level to {max_level}")
+                    cmd      += f";:DISP:WIND:TRAC:Y:RLEV {max_level}"
+                    set_level = max_level
+                try:
+                    await sa.query(cmd + ";:INITiate:IMMediate;*OPC?", timeout=10*sweep_time + sa.client.timeout)
+                except asyncio.TimeoutError:
+                    self.log.emit(f"Thread: OPC Failed at {f} MHz")
+
+            # The trace of point i is captured: tune the SG to point i+1 during the readout
+            with self.timer.stage('readout'):
+                readout = [sa.query("CALCulate:MARKer:MAXimum;:CALCulate:MARKer:Y?")]
+                if i + 1 < n_points:
+                    # *OPC?: the settling starts when the SG has applied the step, not when
+                    # the write is queued
+                    readout.append(sg.query(f"freq {f_scan[i + 1]} MHz;*OPC?"))
+                peak_value = float((await asyncio.gather(*readout))[0])
+                t_sg_tuned = time.perf_counter()
+            # Reference level for the next sweep
+            max_level  = np.ceil( peak_value/10 + 1)*10
             # save the peak value and frequency
-            power = np.append(power, peak_value)
-            freq  = np.append(freq, f)
+            scan.append(f, peak_value)
 
             if i%20==0:
-                self.data.emit(freq, power)
+                # Views of the results (no copy)
+                self.data.emit(*scan.views())
 
             # Update the progress bar
-            self.progress.emit(100 * (i + 1) // len(self.f_scan))
+            self.progress.emit(100 * (i + 1) // n_points)
             if not self.running:
                 break
 
-        # Emit the data signal
+        if set_level != max_level:
+            await sa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
+        freq, power = scan.views()
+        self.log.emit(f"Thread: {self.timer.report(len(freq))}")
         self.data.emit(freq, power)
+        return freq, power
 
+    def sg_tune(self, i):
+        '''
+        Tune the SG to the scan point i (in order: the list sweep only steps forward).
+        Args:
+            i: scan point index
+        '''
+        if i == 0:
+            # Download the list and output the first point
+            self.sg_sweep.start()
+        else:
+            self.sg_sweep.next()
 
     def stop(self):
         self.running = False
-
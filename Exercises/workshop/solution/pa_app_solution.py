@@ -14,6 +14,9 @@ from python_rf_course_utils.arb import multitone
 
 from pa_app_thread import PaScan
 
+from rf_perf.trace import TraceReader
+from rf_perf.scpi import FastSCPIWrapper
+
 import pyvisa
 import pyvisa_py
 import pyarbtools as arb
@@ -66,6 +69,7 @@ class PA_App(QMainWindow):
         # Create a Resource Manager object
         self.rm         = pyvisa.ResourceManager('@py')
         self.sa         = None
+        self.sa_trace   = None
         self.sg         = None
         self.arb        = None
 
@@ -115,16 +119,21 @@ class PA_App(QMainWindow):
                 self.arb       = arb.instruments.VSG(ip_sg, timeout=5)
                 self.sa.timeout = 5000
                 self.sg.timeout = 5000
-                self.scpi_sa    = SCPIWrapper(instr=self.sa, log= self.log, name='SA')
-                self.scpi_sg    = SCPIWrapper(instr=self.sg, log= self.log, name='SG')
+                # SCPI wrappers with write coalescing (batch) and shadow state cache
+                self.scpi_sa    = FastSCPIWrapper(instr=self.sa, log= self.log, name='SA', shadow=True)
+                self.scpi_sg    = FastSCPIWrapper(instr=self.sg, log= self.log, name='SG', shadow=True)
 
                 self.log.info(f"Connected to {ip_sa=} and {ip_sg=}")
 
                 # Reset and clear all status (errors) of the spectrum analyzer
-                self.scpi_sa.write("*RST")
-                self.scpi_sa.write("*CLS")
-                self.scpi_sg.write("*RST")
-                self.scpi_sg.write("*CLS")
+                # (each instrument batch is sent as a single message)
+                with self.scpi_sa.batch(), self.scpi_sg.batch():
+                    self.scpi_sa.write("*RST")
+                    self.scpi_sa.write("*CLS")
+                    self.scpi_sg.write("*RST")
+                    self.scpi_sg.write("*CLS")
+                # Binary trace transfer (*RST restores the ASCII format)
+                self.sa_trace   = TraceReader(self.sa, log=self.log)
 
                 # Query the signal generator name
                 # <company_name>, <model_number>, <serial_number>,<firmware_revision>
@@ -141,21 +150,24 @@ class PA_App(QMainWindow):
                 self.arb.download_wfm(sig, wfmID='TwoTones')
                 self.arb.set_alcState(0) # ALC Off (DO not use bool)
                 self.arb.play('TwoTones')
-                # Set the signal generator to output power
-                self.scpi_sg.write(f":POW:LEV {self.h_gui["Ptx"].get_val()} dBm")
-                # Set the spectrum analyzer span and RBW detector AVG and trace to clear/write
-                self.Fspan = self.Params['ArbFd']*5.0 + 2.0 # Contains the 5th harmonic
-                self.scpi_sa.write(f"freq:span {self.Fspan} MHz")
-                self.scpi_sa.write(f"sense:BANDwidth:RESolution {self.Params['ArbFd']/8.0} MHz") # Maximal RBW for the scan
-                self.scpi_sa.write("sense:DETEctor AVERage")
-                self.scpi_sa.write("TRACe:MODE WRITe")
-                self.scpi_sa.write("INITiate:CONTinuous On")
-                # Set the spectrum analyzer center frequency and the signal generator frequency
-                self.scpi_sa.write(f"freq:cent {self.Params['Fnominal']} MHz")
-                self.scpi_sg.write(f"freq {     self.Params['Fnominal']} MHz")
-                # Save the signal generator and spectrum analyzer state
-                self.scpi_sa.write("*SAV 1")
-                self.scpi_sg.write("*SAV 1")
+                # The arb session changed the SG state behind the SCPI wrapper
+                self.scpi_sg.invalidate()
+                with self.scpi_sa.batch(), self.scpi_sg.batch():
+                    # Set the signal generator to output power
+                    self.scpi_sg.write(f":POW:LEV {self.h_gui["Ptx"].get_val()} dBm")
+                    # Set the spectrum analyzer span and RBW detector AVG and trace to clear/write
+                    self.Fspan = self.Params['ArbFd']*5.0 + 2.0 # Contains the 5th harmonic
+                    self.scpi_sa.write(f"freq:span {self.Fspan} MHz")
+                    self.scpi_sa.write(f"sense:BANDwidth:RESolution {self.Params['ArbFd']/8.0} MHz") # Maximal RBW for the scan
+                    self.scpi_sa.write("sense:DETEctor AVERage")
+                    self.scpi_sa.write("TRACe:MODE WRITe")
+                    self.scpi_sa.write("INITiate:CONTinuous On")
+                    # Set the spectrum analyzer center frequency and the signal generator frequency
+                    self.scpi_sa.write(f"freq:cent {self.Params['Fnominal']} MHz")
+                    self.scpi_sg.write(f"freq {     self.Params['Fnominal']} MHz")
+                    # Save the signal generator and spectrum analyzer state
+                    self.scpi_sa.write("*SAV 1")
+                    self.scpi_sg.write("*SAV 1")
                 time.sleep(0.01)
             except Exception:
                 self.log.error("Connection failed")
@@ -211,8 +223,8 @@ class PA_App(QMainWindow):
 
     def sa_read_trace(self):
         if self.sa is not None:
-            # Query trace data PyVISA method for reading numerical data from instruments
-            p           = self.sa.query_ascii_values(":TRACe:DATA? TRACE1", container=np.array)
+            # Query trace data (binary REAL,32 transfer with ASCII fallback)
+            p           = self.sa_trace.read()
             # Calculate frequency points
             f           = np.linspace(self.Params['Fnominal'] - self.Fspan/2, self.Params['Fnominal'] + self.Fspan/2, len(p))
 
@@ -302,6 +314,8 @@ class PA_App(QMainWindow):
                 # Recall signal generator and spectrum analyzer state
                 self.scpi_sa.write("*RCL 1")
                 self.scpi_sg.write("*RCL 1")
+                # The recalled state may include the ASCII format, restore the binary transfer
+                self.sa_trace.configure()
                 self.timer.start()
 
 
@@ -1,6 +1,13 @@
 from PyQt6.QtCore       import QThread, pyqtSignal
 import numpy as np
 
+from rf_perf.sweep import SweepCompletion, SweepTimeCache
+from rf_perf.buffers import ResultBuffer
+from rf_perf.compression import CompressionSearch
+from rf_perf.intermod import two_tone_intermod
+from rf_perf.trace import TraceReader
+from rf_perf.listsweep import ListSweep
+
 class PaScan(QThread):
     # Define signals as class attributes (for progressbar and returned data)
     progress    = pyqtSignal(int)
@@ -14,14 +21,28 @@ class PaScan(QThread):
     lcd_oip5   = pyqtSignal(float)
     lcd_p_out  = pyqtSignal(float) # Power out
 
-    def __init__(self, f_scan,scpi_sa, scpi_sg, loss = 0):
+    def __init__(self, f_scan,scpi_sa, scpi_sg, loss = 0, op1db_search='model', intermod='trace',
+                 sg_list=True):
         super().__init__()
         self.f_scan     = f_scan
         self.scpi_sa    = scpi_sa
         self.scpi_sg    = scpi_sg
         self.loss       = loss
-        
+        # OP1dB search: 'model' (Rapp model guided) or 'bisection'
+        self.op1db_search = op1db_search
+        # OIP3/OIP5 extraction: 'trace' (one binary trace, host peak search) or 'marker'
+        self.intermod   = intermod
+        # SG list sweep (f_scan downloaded once, *TRG per point), stepped writes if False
+        self.sg_list    = sg_list
+
         self.running    = False
+        self.sweep      = None
+        self.reader     = None
+        self.sweep_times = None
+        self.sa_config  = None
+        # Number of sweeps (sa_sweep_marker_max calls) and OP1dB sweeps per scan point
+        self.sweeps     = 0
+        self.op1db_sweeps = []
 
     def run(self):
         # Save the instrument attributes for recall at the end of the scan
@@ -34,94 +55,161 @@ class PaScan(QThread):
         # Trace Clear/write mode
         self.scpi_sa.write("TRACe:MODE WRITe")
         self.scpi_sa.write("INITiate:CONTinuous OFF")
+        # Sweep completion by SRQ / *ESR? polling
+        self.sweep = SweepCompletion(self.scpi_sa)
+        # The span, RBW, VBW and points are fixed for the whole scan: one auto sweep time
+        span        = float(self.scpi_sa.query("sense:FREQuency:SPAN?"))
+        rbw         = float(self.scpi_sa.query("sense:BANDwidth:RESolution?"))
+        vbw         = float(self.scpi_sa.query("sense:BANDwidth:VIDeo?"))
+        points      = int(self.scpi_sa.query("sense:SWEep:POINts?"))
+        self.sa_config   = (span, rbw, vbw, 'AVER', points)
+        self.sweep_times = SweepTimeCache(self.scpi_sa, factor=10)
+        if self.intermod == 'trace':
+            # Binary trace transfer
+            self.reader = TraceReader(self.scpi_sa)
+            f_offset    = np.linspace(-span/2, span/2, points)
 
+        # SG frequency list (Hz), the power levels are set point by point
+        sg_sweep     = ListSweep(self.scpi_sg, np.asarray(self.f_scan)*1e6, use_list=self.sg_list)
         p_tx_nominal = float(self.scpi_sg.query("POW:LEV?"))
+        # Compression point search, seeded at every frequency by the previous one
+        compression  = CompressionSearch(p_tx_nominal - 6, p_tx_nominal + 5)
 
-        # Create a list to store the scan data
-        gain    = np.array([])
-        op1dB   = np.array([])
-        oip3    = np.array([])
-        oip5    = np.array([])
-
-        freq    = np.array([])
-        for i, f in enumerate(self.f_scan):
-            # Set the SG to the frequency of the current scan point and power level
-            p_tx = p_tx_nominal - 10 # Check gain at low power
-            self.scpi_sg.write(f"POW:LEV {p_tx}")
-            self.scpi_sg.write(f"freq {f} MHz")
-
-            # Set the SA center frequency
-            self.scpi_sa.write(f"sense:FREQuency:CENTer {f} MHz")
-
-            # Small signal gain
-            self.scpi_sg.write(":OUTPUT:MOD:STATE OFF") # Modulation off
-            self.scpi_sg.query(f"*OPC?")
-            peak_value = self.sa_sweep_marker_max()
-
-            # Set the reference level
-            max_level  = np.ceil( peak_value/10 + 1)*10
-            set_level  = float(self.scpi_sa.query(f"DISP:WIND:TRAC:Y:RLEV?") )
-            if set_level != max_level:
-                self.log.emit(f"Thread: Setting reference level to {max_level}")
-                self.scpi_sa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
-            # save the peak value and frequency
-            small_signal_gain   = peak_value + self.loss - p_tx
-            gain                = np.append(gain, small_signal_gain)
-            freq                = np.append(freq, f)
-            # Update the Gain LCD
-            self.lcd_g.emit(small_signal_gain)
-            self.lcd_p_out.emit(peak_value + self.loss)
-            # OP1dB
-            op1dB_i = self.find_op1db_binary_search(p_tx_nominal - 6, p_tx_nominal + 5, gain[-1])
-            op1dB   = np.append(op1dB, op1dB_i)
-            self.lcd_op1dB.emit(op1dB_i)
-
-            # OIP3 and OIP5
-            # Modulation On and tx power to nominal
-            self.scpi_sg.write(":OUTPUT:MOD:STATE ON")
-            self.scpi_sg.write(f"POW:LEV {p_tx_nominal}")
-            subcarrier_power = self.sa_sweep_marker_max()
-            p_i        = subcarrier_power + self.loss
-            # Get the frequency of subcarrier 1
-            freq_sig1  = float(self.scpi_sa.query("CALCulate:MARKer:X?"))
-            # Next peak (subcarrier 2)
-            self.scpi_sa.write("CALCulate:MARKer:MAXimum:NEXT")
-            # Get the frequency of subcarrier 2
-            freq_sig2  = float(self.scpi_sa.query("CALCulate:MARKer:X?"))
-            f_sub_h = max(freq_sig1, freq_sig2)
-            f_sub_l = min(freq_sig1, freq_sig2)
-            # Set the marker to OIP3 (sub_h + (sub_h - sub_l))
-            f_oip3 = f_sub_h + (f_sub_h - f_sub_l)
-            self.scpi_sa.write(f"CALCulate:MARKer:X {f_oip3} Hz")
-            # Get the peak value
-            marker_y_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?"))
-            p_i3        = marker_y_value + self.loss
-            # Next peak twice (OIP5)
-            f_oip5 = f_sub_h + (f_sub_h - f_sub_l)*2
-            self.scpi_sa.write(f"CALCulate:MARKer:X {f_oip5} Hz")
-            # Get the peak value
-            marker_y_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?"))
-            p_i5        = marker_y_value + self.loss
-
-            oip3_i = p_i + (p_i - p_i3)/2
-            oip5_i = p_i + (p_i - p_i5)/4
-            oip3 = np.append(oip3, oip3_i)
-            oip5 = np.append(oip5, oip5_i)
-            self.lcd_oip3.emit(oip3_i)
-            self.lcd_oip5.emit(oip5_i)
-
-            self.data.emit(freq, gain , True , f"Gain" , 'k')
-            self.data.emit(freq, op1dB, False, f"OP1dB", 'b')
-            self.data.emit(freq, oip3 , False, f"OIP3" , 'g')
-            self.data.emit(freq, oip5 , False, f"OIP5" , 'r')
-
-            # Update the progress bar
-            self.progress.emit(100 * (i + 1) // len(self.f_scan))
-            if not self.running:
-                break
+        # Preallocated buffer for the scan data
+        scan    = ResultBuffer(len(self.f_scan), columns=('freq', 'gain', 'op1dB', 'oip3', 'oip5'))
+        try:
+            for i, f in enumerate(self.f_scan):
+                # Set the SG to the frequency of the current scan point and power level
+                p_tx = p_tx_nominal - 10 # Check gain at low power
+                self.scpi_sg.write(f"POW:LEV {p_tx}")
+                if i == 0:
+                    sg_sweep.start()
+                else:
+                    sg_sweep.next()
+
+                # Set the SA center frequency
+                self.scpi_sa.write(f"sense:FREQuency:CENTer {f} MHz")
+
+                # 10x sweep time (average detector) held for all the sweeps of the point
+                with self.sweep_times.hold(self.sa_config):
+                    # Small signal gain
+                    self.scpi_sg.write(":OUTPUT:MOD:STATE OFF") # Modulation off
+                    self.scpi_sg.query(f"*OPC?")
+                    peak_value = self.sa_sweep_marker_max()
 
+                    # Set the reference level
+                    max_level  = np.ceil( peak_value/10 + 1)*10
+                    set_level  = float(self.scpi_sa.query(f"DISP:WIND:TRAC:Y:RLEV?") )
+                    if set_level != max_level:
+                        self.log.emit(f"Thread: Setting reference level to {max_level}")
+                        self.scpi_sa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
+                    # save the peak value and frequency
+                    small_signal_gain   = peak_value + self.loss - p_tx
+                    # Update the Gain LCD
+                    self.lcd_g.emit(small_signal_gain)
+                    self.lcd_p_out.emit(peak_value + self.loss)
+                    # OP1dB
+                    sweeps_start = self.sweeps
+                    if self.op1db_search == 'bisection':
+                        op1dB_i = self.find_op1db_binary_search(p_tx_nominal - 6, p_tx_nominal + 5, small_signal_gain)
+                    else:
+                        op1dB_i = compression.solve(self.measure_p_out, small_signal_gain)
+                    self.op1db_sweeps.append(self.sweeps - sweeps_start)
+                    self.log.emit(f"Thread: {f} MHz OP1dB {op1dB_i:.2f} dBm in {self.op1db_sweeps[-1]} sweeps")
+                    self.lcd_op1dB.emit(op1dB_i)
+
+                    # OIP3 and OIP5
+                    # Modulation On and tx power to nominal
+                    self.scpi_sg.write(":OUTPUT:MOD:STATE ON")
+                    self.scpi_sg.write(f"POW:LEV {p_tx_nominal}")
+                    if self.intermod == 'marker':
+                        oip3_i, oip5_i = self.measure_intermod_markers()
+                    else:
+                        try:
+                            tones   = two_tone_intermod(f*1e6 + f_offset, self.sa_sweep_trace())
+                            oip3_i  = tones.oip3 + self.loss
+                            oip5_i  = tones.oip5 + self.loss
+                            self.log.emit(f"Thread: {f} MHz tones at {tones.f_low*1e-6:.3f}/{tones.f_high*1e-6:.3f} MHz "
+                                          f"OIP3 {oip3_i:.2f} dBm OIP5 {oip5_i:.2f} dBm")
+                        except ValueError as e:
+                            # Tones in the noise or DUT saturated: no OIP3/OIP5 at this point
+                            self.log.emit(f"Thread: {f} MHz {e}, OIP3/OIP5 not measured")
+                            oip3_i  = np.nan
+                            oip5_i  = np.nan
+                # save the point results
+                scan.append(f, small_signal_gain, op1dB_i, oip3_i, oip5_i)
+                self.lcd_oip3.emit(oip3_i)
+                self.lcd_oip5.emit(oip5_i)
+
+                # Views of the results (no copy)
+                freq, gain, op1dB, oip3, oip5 = scan.views()
+                self.data.emit(freq, gain , True , f"Gain" , 'k')
+                self.data.emit(freq, op1dB, False, f"OP1dB", 'b')
+                self.data.emit(freq, oip3 , False, f"OIP3" , 'g')
+                self.data.emit(freq, oip5 , False, f"OIP5" , 'r')
+
+                # Update the progress bar
+                self.progress.emit(100 * (i + 1) // len(self.f_scan))
+                if not self.running:
+                    break
+        finally:
+            # Leave the list mode also on an error (a FREQ write has no effect in list mode)
+            sg_sweep.stop()
+        self.log.emit(f"Thread: SG {sg_sweep.mode}")
+        self.log.emit(f"Thread: OP1dB search ({self.op1db_search}) "
+                      f"{np.mean(self.op1db_sweeps):.1f} sweeps per point")
+        self.log.emit(f"Thread: {self.sweeps} sweeps, {self.sweep_times.misses} sweep time queries")
+        # Round trips saved by the SCPI shadow state cache and batches
+        self.log.emit(f"Thread: SCPI round trips saved SA={self.scpi_sa.round_trips_saved}, "
+                      f"SG={self.scpi_sg.round_trips_saved}")
         # Dump the data to a CSV file
-        self.csv.emit(freq, gain, op1dB, oip3, oip5)
+        self.csv.emit(*scan.views())
+
+    def measure_p_out(self, p_tx):
+        '''
+        Measure the PA output power at the input power p_tx (one sweep).
+        Args:
+            p_tx: SG power level in dBm
+
+        Returns: PA output power in dBm
+        '''
+        self.scpi_sg.write(f"POW:LEV {p_tx}")
+        p_out = self.sa_sweep_marker_max() + self.loss
+        self.lcd_p_out.emit(p_out)
+        return p_out
+
+    def measure_intermod_markers(self):
+        '''
+        OIP3 and OIP5 with the analyzer markers (two tone signal on, one sweep).
+
+        Returns: (OIP3, OIP5) in dBm
+        '''
+        subcarrier_power = self.sa_sweep_marker_max()
+        p_i        = subcarrier_power + self.loss
+        # Get the frequency of subcarrier 1
+        freq_sig1  = float(self.scpi_sa.query("CALCulate:MARKer:X?"))
+        # Next peak (subcarrier 2)
+        self.scpi_sa.write("CALCulate:MARKer:MAXimum:NEXT")
+        # Get the frequency of subcarrier 2
+        freq_sig2  = float(self.scpi_sa.query("CALCulate:MARKer:X?"))
+        f_sub_h = max(freq_sig1, freq_sig2)
+        f_sub_l = min(freq_sig1, freq_sig2)
+        # Set the marker to OIP3 (sub_h + (sub_h - sub_l))
+        f_oip3 = f_sub_h + (f_sub_h - f_sub_l)
+        self.scpi_sa.write(f"CALCulate:MARKer:X {f_oip3} Hz")
+        # Get the peak value
+        marker_y_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?"))
+        p_i3        = marker_y_value + self.loss
+        # Next peak twice (OIP5)
+        f_oip5 = f_sub_h + (f_sub_h - f_sub_l)*2
+        self.scpi_sa.write(f"CALCulate:MARKer:X {f_oip5} Hz")
+        # Get the peak value
+        marker_y_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?"))
+        p_i5        = marker_y_value + self.loss
+
+        oip3_i = p_i + (p_i - p_i3)/2
+        oip5_i = p_i + (p_i - p_i5)/4
+        return oip3_i, oip5_i
 
     def find_op1db_binary_search(self, p_tx_start, p_tx_end, small_signal_gain, resolution=0.1):
         '''
@@ -167,34 +255,43 @@ class PaScan(QThread):
 
         return op1dB_i
 
-    def sa_sweep_marker_max(self):
+    def sa_sweep(self):
         '''
         Perform a single sweep on the spectrum analyzer with average detector
-        and return the peak marker value.
-        Returns: Peak marker value in dBm
+        (10x the auto sweep time, programmed once per scan point by sweep_times.hold).
         '''
+        # Sweep counter (statistics)
+        self.sweeps += 1
 
         # Set detector to average
         self.scpi_sa.write("SENSE:DETECTOR AVERage")
-        # Read the Sweep time
-        sweep_time = float(self.scpi_sa.query("SENSE:SWEEP:TIME?"))
-        # call OPC after save
-        self.scpi_sa.query("*OPC?")
-        # Set sweep time to 10x for average detector
-        self.scpi_sa.write(f"SENSE:SWEEP:TIME {sweep_time*10}")
-        # Initiate a single sweep
-        self.scpi_sa.write("INITiate:IMMediate")
-        self.scpi_sa.query("*OPC?")
+        with self.sweep_times.hold(self.sa_config) as sweep_time:
+            # Initiate a single sweep and wait for its completion
+            self.sweep.start(sweep_time)
+            self.sweep.wait()
+
+    def sa_sweep_marker_max(self):
+        '''
+        Perform a single sweep on the spectrum analyzer with average detector
+        and return the peak marker value.
+        Returns: Peak marker value in dBm
+        '''
+        self.sa_sweep()
         # Set marker to peak
         self.scpi_sa.write("CALCulate:MARKer:MAXimum")
         # Get the peak value
         peak_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?"))
-        # Set sweep time to auto
-        self.scpi_sa.write("SWEEP:TIME:AUTO ON")
-        self.scpi_sa.query("*OPC?")
 
         return peak_value
 
+    def sa_sweep_trace(self):
+        '''
+        Perform a single sweep on the spectrum analyzer with average detector
+        and read the whole trace (binary transfer).
+        Returns: trace in dBm (numpy array)
+        '''
+        self.sa_sweep()
+        return self.reader.read()
 
     def stop(self):
         self.running = False
@@ -0,0 +1,28 @@
+"""
+Performance helpers for the course instrument applications.
+
+The modules in this package extend the building blocks of ``python_rf_course_utils``
+(SCPIWrapper, PlotWidget) with faster transfer and scan strategies:
+
+- ``rf_perf.trace``      : binary (REAL,32) trace reader with ASCII fallback, frequency axis cache
+- ``rf_perf.scpi``       : SCPI transaction helpers (deferred error checking, write coalescing,
+                           shadow state cache)
+- ``rf_perf.sweep``      : non-blocking sweep completion (SRQ or adaptive *ESR? polling), sweep time cache
+- ``rf_perf.timing``     : per-stage timing of measurement loops
+- ``rf_perf.buffers``    : preallocated result buffers with zero-copy views
+- ``rf_perf.compression``: model guided (Rapp) 1 dB compression point search
+- ``rf_perf.intermod``   : two tone carriers and IM3/IM5 products (OIP3/OIP5) from one trace
+- ``rf_perf.listsweep``  : signal generator list sweep (BUS/EXT triggered) with stepped fallback
+- ``rf_perf.adaptive``   : adaptive (non-uniform) frequency grid for response scans
+- ``rf_perf.cwsearch``   : coarse to fine CW search (one or all carriers) with host side peak interpolation
+- ``rf_perf.aioscpi``    : asyncio SCPI client (raw socket, HiSLIP) with pipelined queries
+- ``rf_perf.stitch``     : hi-res segment plan (fewest sweeps for an RBW) and overlap-aware stitching
+- ``rf_perf.decimate``   : peak preserving min/max per pixel column decimation of plotted traces
+- ``rf_perf.sessions``   : several SA/SG benches driven in parallel (thread, process or asyncio workers)
+- ``rf_perf.sim``        : simulated SG -> DUT -> SA bench served over SCPI sockets
+- ``rf_perf.bench``      : stand-alone benchmarks (run with ``python -m rf_perf.bench.<name>``)
+
+The applications import this package by absolute name, so the repository root must be
+on the PYTHONPATH (PyCharm adds the content root automatically; from a shell use
+``export PYTHONPATH=<repo root>``).
+"""
@@ -0,0 +1,95 @@
+"""
+Adaptive frequency grid for response scans.
+
+A uniform scan spends most of its points on the flat passband and the stopband of a
+filter. The linear interpolation error of an interval of width h is about
+h^2/8*|y''|, so after a coarse uniform pass only the intervals where the measured
+response bends (band edges, notches) or steps by more than ``max_step_db`` are split,
+batch by batch, until every interval meets the tolerance or the point budget is spent.
+
+Usage:
+    planner = AdaptiveScan(850.0, 950.0, tol_db=0.5, max_points=1024)
+    f_batch = planner.next_batch()
+    while len(f_batch):
+        planner.add(f_batch, measure(f_batch))
+        f_batch = planner.next_batch()
+    freq, power = planner.result()      # sorted, non-uniform grid
+"""
+import numpy as np
+
+
+class AdaptiveScan:
+    """
+    Args:
+        f_start:     first frequency of the scan
+        f_stop:      last frequency of the scan
+        n_coarse:    points of the uniform first pass
+        tol_db:      target interpolation error (dB)
+        max_step_db: largest response step between neighbours (dB)
+        min_step:    narrowest interval (same unit as f_start, default span/4096)
+        max_points:  point budget of the whole scan
+    """
+
+    def __init__(self, f_start: float, f_stop: float, n_coarse: int = 65, tol_db: float = 0.5,
+                 max_step_db: float = 3.0, min_step: float = None, max_points: int = 1024):
+        self.f_start    = f_start
+        self.f_stop     = f_stop
+        self.n_coarse   = min(n_coarse, max_points)
+        self.tol_db     = tol_db
+        self.max_step_db = max_step_db
+        self.min_step   = min_step if min_step is not None else (f_stop - f_start)/4096
+        self.max_points = max_points
+        self.freq       = np.array([])
+        self.power      = np.array([])
+        # Statistics
+        self.batches    = 0
+
+    @property
+    def points(self) -> int:
+        return len(self.freq)
+
+    def add(self, freq, power):
+        """Merge measured points into the grid."""
+        freq        = np.concatenate((self.freq, np.asarray(freq, dtype=float)))
+        power       = np.concatenate((self.power, np.asarray(power, dtype=float)))
+        order       = np.argsort(freq, kind='stable')
+        self.freq   = freq[order]
+        self.power  = power[order]
+
+    def result(self) -> tuple:
+        """Returns: (frequency, power) of the measured grid, sorted by frequency."""
+        return self.freq, self.power
+
+    def errors(self) -> np.ndarray:
+        """
+        Estimated linear interpolation error of every interval (dB): h^2/8 times the
+        larger second derivative at its two ends, or the step itself above max_step_db.
+        """
+        f, y    = self.freq, self.power
+        h       = np.diff(f)
+        slope   = np.diff(y)/h
+        # Second divided differences at the inner points, none at the ends
+        d2      = np.zeros(len(f))
+        d2[1:-1] = np.abs(2.0*np.diff(slope)/(f[2:] - f[:-2]))
+        err     = h**2/8.0*np.maximum(d2[:-1], d2[1:])
+        step    = np.abs(np.diff(y))
+        return np.where(step > self.max_step_db, np.maximum(err, step), err)
+
+    def next_batch(self) -> np.ndarray:
+        """
+        Returns: frequencies to measure next (ascending), empty when the scan is done
+        """
+        if self.points == 0:
+            self.batches += 1
+            return np.linspace(self.f_start, self.f_stop, self.n_coarse)
+        budget = self.max_points - self.points
+        if budget <= 0 or self.points < 3:
+            return np.array([])
+        err     = self.errors()
+        # Split the worst intervals first, down to the minimum interval width
+        split   = np.flatnonzero((err > self.tol_db) & (np.diff(self.freq) >= 2*self.min_step))
+        split   = split[np.argsort(-err[split], kind='stable')][:budget]
+        if len(split) == 0:
+            return np.array([])
+        self.batches += 1
+        return np.sort(0.5*(self.freq[split] + self.freq[split + 1]))
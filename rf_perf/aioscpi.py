@@ -0,0 +1,363 @@
+"""
+asyncio SCPI client over raw sockets (port 5025) and HiSLIP.
+
+The pyvisa sessions block their thread for every response, so driving several
+instruments at once takes a thread per instrument. An AsyncSCPI connection is a pair
+of asyncio streams: ``write()`` sends at once, ``query()`` sends and returns a future
+answered in order by the reader task of the connection. Queries to one instrument can
+be pipelined (several in flight, the instrument answers them in order) and any number
+of instruments are served by one event loop thread. A slow ``*OPC?`` only suspends
+the coroutine waiting for it.
+
+Usage:
+    async def main():
+        sa = await AsyncSCPIWrapper.connect("TCPIP0::10.0.0.26::5025::SOCKET", log=log, name='SA')
+        sg = await AsyncSCPIWrapper.connect("TCPIP0::10.0.0.25::hislip0::INSTR", log=log, name='SG')
+        await sg.write("freq 900 MHz")
+        idn_sa, idn_sg = await asyncio.gather(sa.query("*IDN?"), sg.query("*IDN?"))
+        trace = await sa.query_binary(":TRACe:DATA? TRACE1")     # REAL,32 SWAPped
+        await asyncio.gather(sa.close(), sg.close())
+
+    asyncio.run(main())
+"""
+import asyncio
+import logging
+import re
+import struct
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# HiSLIP (IVI-6.1) message types
+HS_INITIALIZE                = 0
+HS_INITIALIZE_RESPONSE       = 1
+HS_FATAL_ERROR               = 2
+HS_ERROR                     = 3
+HS_DATA                      = 6
+HS_DATA_END                  = 7
+HS_ASYNC_INITIALIZE          = 17
+HS_ASYNC_INITIALIZE_RESPONSE = 18
+# Prologue, message type, control code, message parameter, payload length
+HS_HEADER                    = struct.Struct('>2sBBIQ')
+
+
+def parse_block(data: bytes, dtype: str = '<f4') -> np.ndarray:
+    """
+    IEEE 488.2 definite length block (``#<n><length><data>``) to an array, an ASCII
+    comma separated response is parsed as well.
+    """
+    if not data.startswith(b'#'):
+        return np.array([float(v) for v in data.decode().split(',') if v.strip()], dtype=dtype)
+    n = int(data[1:2])
+    if n == 0:
+        # Indefinite length block, up to the terminator
+        return np.frombuffer(data[2:].rstrip(b'\n'), dtype=dtype)
+    length = int(data[2:2 + n])
+    return np.frombuffer(data[2 + n:2 + n + length], dtype=dtype)
+
+
+class AsyncSCPI:
+    """
+    Pipelined request/response connection (the transports implement ``_connect``,
+    ``_send`` and ``_receive``).
+
+    Args:
+        host:    instrument address
+        port:    TCP port
+        timeout: response timeout of a query (s)
+        log:     logger (defaults to the module logger)
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 10.0, log=None):
+        self.host       = host
+        self.port       = port
+        self.timeout    = timeout
+        self.log        = log if log is not None else logger
+        self.reader     = None
+        self.writer     = None
+        # Queries waiting for their response, in order: (future, binary)
+        self.pending    = deque()
+        self.task       = None
+        # Statistics
+        self.messages   = 0
+        self.queries    = 0
+
+    @property
+    def resource(self) -> str:
+        raise NotImplementedError
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.pending)
+
+    async def open(self):
+        await self._connect()
+        self.task = asyncio.get_running_loop().create_task(self._read_loop())
+        return self
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.writer = None
+        self._fail_pending(ConnectionError(f"{self.resource} closed"))
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def write(self, cmd: str):
+        """Send a program message (no response)."""
+        self.messages += 1
+        self._send(cmd.encode(), is_query=False)
+        await self.writer.drain()
+
+    def submit(self, cmd: str, binary: bool = False) -> asyncio.Future:
+        """
+        Send a query without waiting: the returned future gets the response (str, or
+        bytes for binary), queries submitted to one connection are answered in order.
+        """
+        if self.writer is None:
+            raise ConnectionError(f"{self.resource} is not open")
+        future = asyncio.get_running_loop().create_future()
+        # Queue the future and send in one step, the order of the queue is the order on the wire
+        self.pending.append((future, binary))
+        self.messages  += 1
+        self.queries   += 1
+        self._send(cmd.encode(), is_query=True)
+        return future
+
+    async def query(self, cmd: str, timeout: float = None) -> str:
+        future = self.submit(cmd)
+        await self.writer.drain()
+        return await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+
+    async def query_binary(self, cmd: str, dtype: str = '<f4', timeout: float = None) -> np.ndarray:
+        """Query a binary block (the instrument must be set up for it, e.g. REAL,32 SWAPped)."""
+        future = self.submit(cmd, binary=True)
+        await self.writer.drain()
+        return parse_block(await asyncio.wait_for(future, self.timeout if timeout is None else timeout), dtype)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                binary = self.pending[0][1] if self.pending else False
+                data   = await self._receive(binary)
+                if not self.pending:
+                    self.log.warning(f"{self.resource}: unexpected response {data[:40]!r}")
+                    continue
+                future, binary = self.pending.popleft()
+                # A query that timed out (cancelled) still consumes its response
+                if not future.done():
+                    future.set_result(data if binary else data.decode(errors='replace').strip())
+        except asyncio.CancelledError:
+            raise
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            self.log.error(f"{self.resource}: connection lost ({e})")
+            self._fail_pending(ConnectionError(f"{self.resource}: {e}"))
+
+    def _fail_pending(self, error: Exception):
+        while self.pending:
+            future, _ = self.pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    async def _connect(self):
+        raise NotImplementedError
+
+    def _send(self, data: bytes, is_query: bool):
+        raise NotImplementedError
+
+    async def _receive(self, binary: bool) -> bytes:
+        raise NotImplementedError
+
+
+class RawSocketSCPI(AsyncSCPI):
+    """SCPI over a raw TCP socket, line feed terminated (binary blocks are read by length)."""
+
+    def __init__(self, host: str, port: int = 5025, timeout: float = 10.0, log=None):
+        super().__init__(host, port, timeout, log)
+
+    @property
+    def resource(self) -> str:
+        return f"TCPIP0::{self.host}::{self.port}::SOCKET"
+
+    async def _connect(self):
+        # Large stream limit: ASCII traces are long lines
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, limit=1 << 24)
+
+    def _send(self, data: bytes, is_query: bool):
+        self.writer.write(data + b'\n')
+
+    async def _receive(self, binary: bool) -> bytes:
+        head = await self.reader.readexactly(1)
+        if head != b'#':
+            return head + await self.reader.readuntil(b'\n')
+        n = await self.reader.readexactly(1)
+        if n == b'0':
+            return head + n + await self.reader.readuntil(b'\n')
+        digits  = await self.reader.readexactly(int(n))
+        data    = await self.reader.readexactly(int(digits))
+        # Response message terminator
+        await self.reader.readuntil(b'\n')
+        return head + n + digits + data
+
+
+class HiSlipSCPI(AsyncSCPI):
+    """
+    SCPI over HiSLIP (IVI-6.1, synchronized mode): the synchronous channel carries the
+    program messages as Data/DataEnd messages, the asynchronous channel is opened as the
+    protocol requires and otherwise unused.
+
+    Args:
+        sub_address: HiSLIP sub-address (``hislip0``)
+        vendor_id:   two character client vendor ID
+    """
+    VERSION = 0x0100
+
+    def __init__(self, host: str, port: int = 4880, sub_address: str = 'hislip0', timeout: float = 10.0,
+                 vendor_id: str = 'ZZ', log=None):
+        super().__init__(host, port, timeout, log)
+        self.sub_address    = sub_address
+        self.vendor_id      = vendor_id
+        self.session_id     = None
+        self.message_id     = 0xffffff00
+        self.async_reader   = None
+        self.async_writer   = None
+        # RMT delivered: a complete response was read since the last message sent
+        self.rmt_delivered  = False
+
+    @property
+    def resource(self) -> str:
+        return f"TCPIP0::{self.host}::{self.sub_address},{self.port}::INSTR"
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        vendor = int.from_bytes(self.vendor_id.encode()[:2], 'big')
+        self._send_message(self.writer, HS_INITIALIZE, 0, (self.VERSION << 16) | vendor,
+                           self.sub_address.encode())
+        msg_type, _, param, payload = await self._read_message(self.reader)
+        if msg_type != HS_INITIALIZE_RESPONSE:
+            raise ConnectionError(f"{self.resource}: HiSLIP initialize refused ({msg_type}, {payload!r})")
+        self.session_id = param & 0xffff
+        self.async_reader, self.async_writer = await asyncio.open_connection(self.host, self.port)
+        self._send_message(self.async_writer, HS_ASYNC_INITIALIZE, 0, self.session_id)
+        msg_type, _, _, payload = await self._read_message(self.async_reader)
+        if msg_type != HS_ASYNC_INITIALIZE_RESPONSE:
+            raise ConnectionError(f"{self.resource}: HiSLIP async initialize refused ({msg_type}, {payload!r})")
+
+    async def close(self):
+        await super().close()
+        if self.async_writer is not None:
+            self.async_writer.close()
+            self.async_writer = None
+
+    @staticmethod
+    def _send_message(writer, msg_type: int, control: int, param: int, payload: bytes = b''):
+        writer.write(HS_HEADER.pack(b'HS', msg_type, control, param, len(payload)) + payload)
+
+    @staticmethod
+    async def _read_message(reader) -> tuple:
+        prologue, msg_type, control, param, length = HS_HEADER.unpack(await reader.readexactly(HS_HEADER.size))
+        if prologue != b'HS':
+            raise ValueError(f"Bad HiSLIP prologue {prologue!r}")
+        return msg_type, control, param, await reader.readexactly(length)
+
+    def _send(self, data: bytes, is_query: bool):
+        self._send_message(self.writer, HS_DATA_END, int(self.rmt_delivered), self.message_id, data + b'\n')
+        self.rmt_delivered  = False
+        self.message_id     = (self.message_id + 2) & 0xffffffff
+
+    async def _receive(self, binary: bool) -> bytes:
+        data = b''
+        while True:
+            msg_type, _, _, payload = await self._read_message(self.reader)
+            if msg_type in (HS_DATA, HS_DATA_END):
+                data += payload
+                if msg_type == HS_DATA_END:
+                    self.rmt_delivered = True
+                    return data
+            elif msg_type in (HS_ERROR, HS_FATAL_ERROR):
+                raise ValueError(f"HiSLIP error: {payload.decode(errors='replace')}")
+
+
+def open_resource(resource: str, timeout: float = 10.0, log=None) -> AsyncSCPI:
+    """
+    Connection (not opened yet) for a VISA style resource string:
+    ``TCPIP0::host::port::SOCKET``, ``TCPIP0::host::hislip0[,port]::INSTR``, ``host`` or
+    ``host:port`` (raw socket, port 5025 by default).
+    """
+    m = re.fullmatch(r'TCPIP\d*::([^:]+)::(\d+)::SOCKET', resource, re.IGNORECASE)
+    if m:
+        return RawSocketSCPI(m.group(1), int(m.group(2)), timeout=timeout, log=log)
+    m = re.fullmatch(r'TCPIP\d*::([^:]+)::(hislip\d+)(?:,(\d+))?::INSTR', resource, re.IGNORECASE)
+    if m:
+        return HiSlipSCPI(m.group(1), int(m.group(3) or 4880), m.group(2), timeout=timeout, log=log)
+    m = re.fullmatch(r'([^:]+)(?::(\d+))?', resource)
+    if m:
+        return RawSocketSCPI(m.group(1), int(m.group(2) or 5025), timeout=timeout, log=log)
+    raise ValueError(f"Unsupported resource {resource!r} (raw socket or HiSLIP)")
+
+
+class AsyncSCPIWrapper:
+    """
+    Coroutine version of SCPIWrapper: the same write/query calls (``query`` with an
+    expected type returns ``(success, value)``), awaited.
+
+    Args:
+        client: AsyncSCPI connection (open)
+        log:    logger (defaults to the module logger)
+        name:   instrument name for the log messages
+    """
+
+    def __init__(self, client: AsyncSCPI, log=None, name: str = ''):
+        self.client = client
+        self.log    = log if log is not None else logger
+        self.name   = name
+
+    @classmethod
+    async def connect(cls, resource: str, log=None, name: str = '', timeout: float = 10.0):
+        client = await open_resource(resource, timeout=timeout, log=log).open()
+        return cls(client, log=log, name=name)
+
+    @classmethod
+    async def from_wrapper(cls, scpi, timeout: float = 10.0):
+        """Second (async) connection to the instrument of a synchronous SCPIWrapper."""
+        return await cls.connect(scpi.instr.resource_name, log=scpi.log, name=scpi.name, timeout=timeout)
+
+    async def close(self):
+        await self.client.close()
+
+    async def write(self, cmd: str):
+        await self.client.write(cmd)
+
+    async def query(self, cmd: str, expected_type=None, timeout: float = None):
+        response = await self.client.query(cmd, timeout=timeout)
+        if expected_type is None:
+            return response
+        try:
+            return True, expected_type(response)
+        except ValueError:
+            self.log.error(f"{self.name}: unexpected response to {cmd}: {response!r}")
+            return False, None
+
+    async def query_binary(self, cmd: str, dtype: str = '<f4', timeout: float = None) -> np.ndarray:
+        return await self.client.query_binary(cmd, dtype=dtype, timeout=timeout)
+
+    async def opc(self, timeout: float = None):
+        """Wait for the pending operations (``*OPC?``), only this coroutine is suspended."""
+        await self.client.query("*OPC?", timeout=timeout)
@@ -0,0 +1,5 @@
+"""
+Stand-alone benchmarks for the course applications.
+
+Each module is a script: ``python -m rf_perf.bench.<module> --help``.
+"""
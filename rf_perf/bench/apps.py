@@ -0,0 +1,354 @@
+"""
+End-to-end benchmarks of the course applications against the simulated bench.
+
+Every scenario runs the measurement code of an application headless (the QThread
+``run()`` is called directly, no window or event loop) against rf_perf.sim, with the
+same instrument setup the application does on connect:
+
+    filter_scan            Ex5 filter scan, 1024 points 850-950 MHz (pipelined)
+    filter_scan_seq        the same scan in sequential mode
+    filter_scan_stepped    pipelined scan with stepped SG writes instead of the SG list sweep
+    filter_scan_zero_span  the same scan in zero span (time domain) mode
+    filter_scan_adaptive   adaptive (non-uniform) pipelined scan, at most 1024 points
+    filter_scan_async      pipelined scan as an asyncio coroutine (rf_perf.aioscpi connections)
+    hi_res                 311/o310 hi-res scan, 41 segments of about 30 MHz (at most 1001 points) around 1 GHz
+    hi_res_auto            the same range, sweep points planned for 3 bins per RBW (streamed in 10 segments)
+    hi_res_parallel        hi_res_auto split between two analyzers
+    pa_scan                workshop PaScan, 21 points 100-2100 MHz (gain, OP1dB, OIP3, OIP5)
+    pa_scan_bisect         PaScan with the OP1dB bisection search
+    pa_scan_markers        PaScan with the OIP3/OIP5 marker method
+    find_cw                Day2 155_find_cw, full span sweep and 7 zoom steps
+    find_cw_fast           Day2 155_find_cw coarse to fine search (10 Hz accuracy)
+    find_cw_all            Day2 155_find_cw all carriers of one full span sweep (3 tones)
+
+Recorded per scenario: wall time, SCPI round trips (queries answered), program
+messages, bytes to and from the instruments and the peak RSS of the process running the
+application (each scenario runs in a fresh interpreter, the simulator in this one).
+The run fails (exit status 1, after saving the results) if the response error of a
+filter scan (max_err_db) exceeds --max-err in any of the repeated runs.
+
+    python -m rf_perf.bench.apps --out bench.json
+    python -m rf_perf.bench.apps --scenario filter_scan --repeat 3 --out bench.json
+    python -m rf_perf.bench.apps --compare base.json bench.json
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import platform
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from rf_perf.sim.dut import BandpassDut
+from rf_perf.sim.server import SimBench, open_session
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parents[2]
+
+# Bench of every scenario: DUT and the CW tones seen by the analyzer
+BENCHES = {
+    'filter_scan'           : dict(dut='filter'),
+    'filter_scan_seq'       : dict(dut='filter'),
+    'filter_scan_stepped'   : dict(dut='filter'),
+    'filter_scan_zero_span' : dict(dut='filter'),
+    'filter_scan_adaptive'  : dict(dut='filter'),
+    'filter_scan_async'     : dict(dut='filter'),
+    'hi_res'                : dict(dut='through', tones=[(1000e6, -30.0), (1012.5e6, -60.0)]),
+    'hi_res_auto'           : dict(dut='through', tones=[(1000e6, -30.0), (1012.5e6, -60.0)]),
+    'hi_res_parallel'       : dict(dut='through', tones=[(1000e6, -30.0), (1012.5e6, -60.0)], analyzers=2),
+    'pa_scan'               : dict(dut='pa'),
+    'pa_scan_bisect'        : dict(dut='pa'),
+    'pa_scan_markers'       : dict(dut='pa'),
+    'find_cw'               : dict(dut='through', tones=[(1234.5678e6, -25.0)]),
+    'find_cw_fast'          : dict(dut='through', tones=[(1234.5678e6, -25.0)]),
+    'find_cw_all'           : dict(dut='through', tones=[(1234.5678e6, -25.0), (2400.0e6, -40.0),
+                                                         (3021.1234567e6, -50.0)]),
+}
+
+
+def load_app(path: str, name: str):
+    """Import an application module by file name (the course files start with a digit)."""
+    path = ROOT/path
+    # The applications import their sibling modules by plain name
+    sys.path.insert(0, str(path.parent))
+    spec    = importlib.util.spec_from_file_location(name, path)
+    module  = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def connect(rm, args, shadow: bool = False):
+    """pyvisa sessions and FastSCPIWrappers of the simulated SA and SG."""
+    from rf_perf.scpi import FastSCPIWrapper
+    sa      = open_session(rm, args.sa)
+    sg      = open_session(rm, args.sg)
+    scpi_sa = FastSCPIWrapper(instr=sa, log=logger, name='SA', shadow=shadow)
+    scpi_sg = FastSCPIWrapper(instr=sg, log=logger, name='SG', shadow=shadow)
+    return sa, sg, scpi_sa, scpi_sg
+
+
+def run_filter_scan(rm, args, pipelined: bool = True, sg_list: bool = True, zero_span: bool = False,
+                    adaptive: bool = False, use_async: bool = False) -> dict:
+    module                  = load_app('Exercises/ex5/solution/ex5_long_process.py', 'ex5_long_process')
+    sa, sg, scpi_sa, scpi_sg = connect(rm, args)
+    # Ex5_solution cb_connect and cb_go
+    with scpi_sa.batch(), scpi_sg.batch():
+        scpi_sa.write("*RST")
+        scpi_sa.write("*CLS")
+        scpi_sg.write("*RST")
+        scpi_sg.write("*CLS")
+    with scpi_sg.batch():
+        scpi_sg.write(":OUTP:STAT OFF")
+        scpi_sg.write(":POW:LEV -30 dBm")
+
+    thread  = module.LongProcess(f_scan=np.linspace(850.0, 950.0, 1024), scpi_sa=scpi_sa, scpi_sg=scpi_sg,
+                                 pipelined=pipelined, sg_list=sg_list, zero_span=zero_span, adaptive=adaptive,
+                                 use_async=use_async)
+    result  = {}
+    thread.data.connect(lambda f, p: result.update(freq=f, power=p))
+    thread.log.connect(logger.debug)
+    thread.run()
+    # Error of the interpolated response against the simulated filter (-30 dBm in)
+    f_dense = np.linspace(850.0, 950.0, 4001)
+    error   = np.interp(f_dense, result['freq'], result['power']) - (-30.0 + BandpassDut().response(f_dense*1e6))
+    return dict(points=len(result['freq']), peak_dbm=float(np.max(result['power'])),
+                peak_mhz=float(result['freq'][np.argmax(result['power'])]),
+                mean_err_db=float(np.mean(error)), max_err_db=float(np.max(np.abs(error))))
+
+
+def run_hi_res(rm, args, fixed: bool = False) -> dict:
+    module  = load_app('Day4/SpectrumAnalyzer/o310_long_process.py', 'o310_long_process')
+    sa, _, _, _ = connect(rm, args)
+    # More analyzers of the bench (HiResIPs)
+    extra   = [open_session(rm, r) for r in args.sa_extra or []]
+    # 311_main_vsa cb_connect and the vsa_defaults.yaml settings
+    for vsa in [sa] + extra:
+        vsa.write("*RST")
+        vsa.write("*CLS")
+    sa.write("sense:FREQuency:CENTer 1000.0 MHz")
+    sa.write("sense:FREQuency:SPAN 30.0 MHz")
+    sa.write("sense:BANDwidth:RESolution 0.1 MHz")
+    sa.write(":INITiate:CONTinuous ON")
+
+    if fixed:
+        # Segments of the 30 MHz span and 1001 points (the scan before the points planning)
+        thread  = module.LongProcess([sa] + extra, max_points=1001, bins_per_rbw=0.1*1000/30.0)
+    else:
+        thread  = module.LongProcess([sa] + extra)
+    result  = {}
+    t_start = time.perf_counter()
+    # Time to the first drawable data: the first segment (streaming) or the whole scan
+    thread.segment.connect(lambda start, f, p: result.setdefault('first_data_s', time.perf_counter() - t_start))
+    thread.data.connect(lambda f, p: result.update(freq=f, power=p, scan_s=time.perf_counter() - t_start))
+    thread.log.connect(logger.debug)
+    thread.run()
+    return dict(points=len(result['freq']), peak_dbm=float(np.max(result['power'])),
+                peak_mhz=float(result['freq'][np.argmax(result['power'])]),
+                monotonic=bool(np.all(np.diff(result['freq']) > 0)), analyzers=len(thread.vsas), segments=len(thread.plan),
+                sweep_points=thread.plan.points, predicted_s=thread.predicted_time,
+                first_data_s=result.get('first_data_s', result['scan_s']), scan_s=result['scan_s'])
+
+
+def run_pa_scan(rm, args, op1db_search: str = 'model', intermod: str = 'trace') -> dict:
+    module                  = load_app('Exercises/workshop/solution/pa_app_thread.py', 'pa_app_thread')
+    sa, sg, scpi_sa, scpi_sg = connect(rm, args, shadow=True)
+    # pa_app_solution cb_connect (the two tone arb is built into the simulated SG)
+    with scpi_sa.batch(), scpi_sg.batch():
+        scpi_sa.write("*RST")
+        scpi_sa.write("*CLS")
+        scpi_sg.write("*RST")
+        scpi_sg.write("*CLS")
+    scpi_sg.write(":OUTP:STAT ON;:OUTP:MOD:STAT ON")
+    scpi_sg.invalidate()
+    with scpi_sa.batch(), scpi_sg.batch():
+        scpi_sg.write(":POW:LEV -15 dBm")
+        scpi_sa.write("freq:span 22.0 MHz")
+        scpi_sa.write("sense:BANDwidth:RESolution 0.5 MHz")
+        scpi_sa.write("sense:DETEctor AVERage")
+        scpi_sa.write("TRACe:MODE WRITe")
+        scpi_sa.write("INITiate:CONTinuous On")
+        scpi_sa.write("freq:cent 500.0 MHz")
+        scpi_sg.write("freq 500.0 MHz")
+        scpi_sa.write("*SAV 1")
+        scpi_sg.write("*SAV 1")
+
+    thread  = module.PaScan(f_scan=np.linspace(100.0, 2100.0, 21), scpi_sa=scpi_sa, scpi_sg=scpi_sg, loss=32.5,
+                            op1db_search=op1db_search, intermod=intermod)
+    result  = {}
+    thread.csv.connect(lambda *columns: result.update(zip(('freq', 'gain', 'op1dB', 'oip3', 'oip5'), columns)))
+    thread.log.connect(logger.debug)
+    thread.run()
+    summary = {name: float(np.mean(result[name])) for name in ('gain', 'op1dB', 'oip3', 'oip5')}
+    summary['points']       = len(result['freq'])
+    summary['op1db_sweeps'] = float(np.mean(thread.op1db_sweeps))
+    return summary
+
+
+def run_find_cw(rm, args, fast: bool = False) -> dict:
+    module  = load_app('Day2/155_find_cw.py', 'find_cw')
+    from python_rf_course_utils.scpi import SCPIWrapper
+    sa      = open_session(rm, args.sa)
+    if fast:
+        success, fc, p, uncertainty, _ = module.find_cw_fast(SCPIWrapper(instr=sa, log=logger, name='SA'), sa)
+    else:
+        success, fc, p = module.find_cw(SCPIWrapper(instr=sa, log=logger, name='SA'), sa)
+        uncertainty    = None
+    # Error against the simulated carrier
+    f_true  = BENCHES['find_cw']['tones'][0][0]
+    return dict(success=success, freq_mhz=fc, power_dbm=p, uncertainty_hz=uncertainty,
+                error_hz=fc*1e6 - f_true if success else None)
+
+
+def run_find_cw_all(rm, args) -> dict:
+    module  = load_app('Day2/155_find_cw.py', 'find_cw')
+    from python_rf_course_utils.scpi import SCPIWrapper
+    sa      = open_session(rm, args.sa)
+    success, table = module.find_cw_all(SCPIWrapper(instr=sa, log=logger, name='SA'), sa)
+    # Error of the closest estimate to every simulated carrier
+    f_true  = np.array([f for f, _ in BENCHES['find_cw_all']['tones']])
+    f_found = np.array([f*1e6 for f, _, _ in table])
+    errors  = [float(f_found[np.argmin(abs(f_found - f))] - f) if len(f_found) else None for f in f_true]
+    return dict(success=success, carriers=len(table), table=table, error_hz=errors)
+
+
+SCENARIOS = {
+    'filter_scan'           : run_filter_scan,
+    'filter_scan_seq'       : lambda rm, args: run_filter_scan(rm, args, pipelined=False),
+    'filter_scan_stepped'   : lambda rm, args: run_filter_scan(rm, args, sg_list=False),
+    'filter_scan_zero_span' : lambda rm, args: run_filter_scan(rm, args, zero_span=True),
+    'filter_scan_adaptive'  : lambda rm, args: run_filter_scan(rm, args, adaptive=True),
+    'filter_scan_async'     : lambda rm, args: run_filter_scan(rm, args, sg_list=False, use_async=True),
+    'hi_res'                : lambda rm, args: run_hi_res(rm, args, fixed=True),
+    'hi_res_auto'           : run_hi_res,
+    'hi_res_parallel'       : run_hi_res,
+    'pa_scan'               : run_pa_scan,
+    'pa_scan_bisect'        : lambda rm, args: run_pa_scan(rm, args, op1db_search='bisection'),
+    'pa_scan_markers'       : lambda rm, args: run_pa_scan(rm, args, intermod='marker'),
+    'find_cw'               : run_find_cw,
+    'find_cw_fast'          : lambda rm, args: run_find_cw(rm, args, fast=True),
+    'find_cw_all'           : run_find_cw_all,
+}
+
+
+def child(args):
+    """Run one scenario in this process and print its result as JSON."""
+    import pyvisa
+    from PyQt6.QtCore import QCoreApplication
+    app     = QCoreApplication.instance() or QCoreApplication([])
+    rm      = pyvisa.ResourceManager('@py')
+    t_start = time.perf_counter()
+    result  = SCENARIOS[args.child](rm, args)
+    elapsed = time.perf_counter() - t_start
+    rm.close()
+    # ru_maxrss is in kB on Linux
+    print(json.dumps(dict(wall_time=elapsed, peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                          result=result)))
+
+
+def run_scenario(name: str, args) -> dict:
+    """Start the simulated bench, run the scenario in a child interpreter, add the bench statistics."""
+    with SimBench(time_scale=args.time_scale, latency=args.latency*1e-3, jitter=args.jitter*1e-3,
+                  seed=args.seed, **BENCHES[name]) as bench:
+        cmd     = [sys.executable, '-m', 'rf_perf.bench.apps', '--child', name,
+                   '--sa', bench.resource('sa'), '--sg', bench.resource('sg')]
+        for extra in sorted(set(bench.servers) - {'sa', 'sg'}):
+            cmd += ['--sa-extra', bench.resource(extra)]
+        out     = subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT)
+        if out.returncode != 0:
+            raise RuntimeError(f"{name} failed:\n{out.stderr}")
+        run     = json.loads(out.stdout.strip().splitlines()[-1])
+        stats   = bench.stats()
+    run['round_trips']  = sum(s['queries'] for s in stats.values())
+    run['messages']     = sum(s['messages'] for s in stats.values())
+    run['bytes']        = sum(s['bytes_in'] + s['bytes_out'] for s in stats.values())
+    run['instruments']  = stats
+    return run
+
+
+def summarize(runs: list) -> dict:
+    """Median of the repeated runs (the instrument statistics of the first run)."""
+    summary = dict(runs[0])
+    for key in ('wall_time', 'peak_rss_kb', 'round_trips', 'messages', 'bytes'):
+        summary[key] = float(np.median([r[key] for r in runs]))
+    summary['wall_times'] = [r['wall_time'] for r in runs]
+    return summary
+
+
+def compare(base_file: str, new_file: str):
+    with open(base_file) as f:
+        base = json.load(f)['scenarios']
+    with open(new_file) as f:
+        new = json.load(f)['scenarios']
+    keys = ('wall_time', 'round_trips', 'bytes', 'peak_rss_kb')
+    print(f"{'scenario':<18}" + ''.join(f"{k:>30}" for k in keys))
+    for name in sorted(set(base) & set(new)):
+        cells = []
+        for k in keys:
+            b, n    = base[name][k], new[name][k]
+            change  = f" ({100*(n - b)/b:+.0f}%)" if b else ''
+            cells.append(f"{b:.4g} -> {n:.4g}{change}")
+        print(f"{name:<18}" + ''.join(f"{c:>30}" for c in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario'    , action='append', choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument('--repeat'      , type=int  , default=1   , help="runs per scenario (median reported)")
+    parser.add_argument('--time-scale'  , type=float, default=1.0 , help="simulated sweep time scale")
+    parser.add_argument('--latency'     , type=float, default=0.5 , help="round trip time (ms)")
+    parser.add_argument('--jitter'      , type=float, default=0.1 , help="round trip jitter (ms)")
+    parser.add_argument('--seed'        , type=int  , default=0)
+    parser.add_argument('--max-err'     , type=float, default=1.0 , help="largest scan error (dB) of a passing run")
+    parser.add_argument('--out'         , help="JSON result file")
+    parser.add_argument('--compare'     , nargs=2, metavar=('BASE', 'NEW'), help="compare two result files")
+    # Internal: run one scenario against a running bench
+    parser.add_argument('--child'       , help=argparse.SUPPRESS)
+    parser.add_argument('--sa'          , help=argparse.SUPPRESS)
+    parser.add_argument('--sg'          , help=argparse.SUPPRESS)
+    parser.add_argument('--sa-extra'    , action='append', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+        child(args)
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    results = {}
+    failed  = []
+    for name in args.scenario or list(SCENARIOS):
+        runs            = [run_scenario(name, args) for _ in range(args.repeat)]
+        results[name]   = summarize(runs)
+        r               = results[name]
+        logger.info(f"{name:<22} {r['wall_time']:8.3f} s {r['round_trips']:7.0f} round trips "
+                    f"{r['bytes']/1024:9.1f} kB {r['peak_rss_kb']/1024:7.1f} MB RSS")
+        # Wrong data is a failure, whatever the speed
+        errors          = [run['result'].get('max_err_db', 0.0) for run in runs]
+        if max(errors) > args.max_err:
+            logger.error(f"{name}: max error {max(errors):.3g} dB > {args.max_err} dB "
+                         f"in {sum(e > args.max_err for e in errors)} of {len(runs)} runs")
+            failed.append(name)
+
+    if args.out:
+        meta = dict(date=time.strftime('%Y-%m-%d %H:%M:%S'), python=platform.python_version(),
+                    platform=platform.platform(), time_scale=args.time_scale, latency_ms=args.latency,
+                    jitter_ms=args.jitter, seed=args.seed)
+        with open(args.out, 'w') as f:
+            json.dump(dict(meta=meta, scenarios=results), f, indent=2)
+        logger.info(f"Results saved to {args.out}")
+    if failed:
+        sys.exit(f"Scan error above {args.max_err} dB: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
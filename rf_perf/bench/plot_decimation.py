@@ -0,0 +1,84 @@
+"""
+Frame time of the trace plot against the trace length, with and without the min/max
+per pixel column decimation (rf_perf.decimate).
+
+A frame is what timer_refresh_plot / cb_hi_res_plot cost on the GUI thread: the
+decimation (if any), the polyline of the points and its rendering into an image of the
+plot size (QPainter, offscreen). The trace is a noise floor with one single bin spur,
+``spur kept`` checks that the drawn points still reach it.
+
+    python -m rf_perf.bench.plot_decimation --lengths 1001 4001 16001 40001 160001
+    python -m rf_perf.bench.plot_decimation --width 1600 --line-width 4
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from rf_perf.decimate import MinMaxDecimator, column_starts, minmax_decimate
+
+
+def render(image, x: np.ndarray, y: np.ndarray, line_width: float):
+    """Draw the trace as one polyline over the whole image."""
+    from PyQt6.QtCore import QPointF
+    from PyQt6.QtGui import QColor, QPainter, QPen, QPolygonF
+    w, h    = image.width(), image.height()
+    px      = (x - x[0])*(w - 1)/(x[-1] - x[0])
+    py      = (0.0 - y)*(h - 1)/100.0
+    image.fill(QColor('white'))
+    painter = QPainter(image)
+    painter.setPen(QPen(QColor('blue'), line_width))
+    painter.drawPolyline(QPolygonF([QPointF(a, b) for a, b in zip(px.tolist(), py.tolist())]))
+    painter.end()
+
+
+def frame_time(func, frames: int) -> float:
+    """Median time of a frame (s)."""
+    times = []
+    for _ in range(frames):
+        t_start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t_start)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lengths'     , type=int  , nargs='+', default=[1001, 4001, 16001, 40001, 160001],
+                        help="trace lengths")
+    parser.add_argument('--width'       , type=int  , default=1000  , help="plot width (pixels)")
+    parser.add_argument('--height'      , type=int  , default=600   , help="plot height (pixels)")
+    parser.add_argument('--line-width'  , type=float, default=1.0   , help="pen width (311 uses 4)")
+    parser.add_argument('--frames'      , type=int  , default=5     , help="frames per case (median reported)")
+    parser.add_argument('--seed'        , type=int  , default=0)
+    args = parser.parse_args()
+
+    # No window: render into an image
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt6.QtGui import QGuiApplication, QImage
+    app     = QGuiApplication.instance() or QGuiApplication([])
+    image   = QImage(args.width, args.height, QImage.Format.Format_ARGB32)
+    rng     = np.random.default_rng(args.seed)
+
+    print(f"Plot {args.width} x {args.height} pixels, pen {args.line_width}")
+    print(f"{'points':>8}{'drawn':>8}{'full (ms)':>11}{'decim (ms)':>12}{'resplit (ms)':>14}{'speedup':>9}"
+          f"{'spur kept':>11}")
+    for n in args.lengths:
+        x       = np.linspace(400.0, 1600.0, n)
+        y       = (-90.0 + 2.0*rng.standard_normal(n)).astype(np.float32)
+        y[n//3] = -20.0
+        decimator = MinMaxDecimator(width=args.width)
+        xd, yd  = decimator(x, y)
+        t_full  = frame_time(lambda: render(image, x, y, args.line_width), args.frames)
+        # Same axis every frame: the column split is kept, only the min/max are recomputed
+        t_dec   = frame_time(lambda: render(image, *decimator(x, y), args.line_width), args.frames)
+        # Decimation with a new column split (once per Fc/Span change, zoom or resize)
+        t_split = frame_time(lambda: minmax_decimate(x, y, args.width, starts=column_starts(x, args.width)),
+                             args.frames)
+        print(f"{n:>8}{len(xd):>8}{t_full*1e3:>11.2f}{t_dec*1e3:>12.2f}{t_split*1e3:>14.2f}"
+              f"{t_full/t_dec:>8.1f}x{str(bool(yd.max() == y.max())):>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare result accumulation with np.append / np.concatenate against ResultBuffer.
+
+Two scenarios mirror the scan threads: a point scan (PaScan / ex5, 5 columns appended
+one point at a time) and the hi-res scan (o310, 2 columns appended one segment at a
+time). Reported: wall time, bytes copied by the accumulation and the peak memory.
+
+    python -m rf_perf.bench.result_buffer --points 1024 --segments 41 --segment-points 1001
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from rf_perf.buffers import ResultBuffer
+
+
+def measure(func):
+    tracemalloc.start()
+    t_start = time.perf_counter()
+    copied  = func()
+    elapsed = time.perf_counter() - t_start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, copied, peak
+
+
+def points_append(n: int, columns: int = 5) -> int:
+    arrays = [np.array([]) for _ in range(columns)]
+    copied = 0
+    for i in range(n):
+        for c in range(columns):
+            # np.append copies the whole array every time
+            copied   += arrays[c].nbytes
+            arrays[c] = np.append(arrays[c], float(i))
+    return copied
+
+
+def points_buffer(n: int, columns: int = 5) -> int:
+    buf = ResultBuffer(n, columns=[f"c{c}" for c in range(columns)])
+    for i in range(n):
+        buf.append(*([float(i)]*columns))
+        buf.views()
+    return buf.copied_bytes
+
+
+def segments_concatenate(n_seg: int, seg_points: int) -> int:
+    all_data = np.array([])
+    all_freq = np.array([])
+    segment  = np.zeros(seg_points)
+    copied   = 0
+    for _ in range(n_seg):
+        copied  += all_data.nbytes + all_freq.nbytes
+        all_data = np.concatenate([all_data, segment])
+        all_freq = np.concatenate([all_freq, segment])
+    return copied
+
+
+def segments_buffer(n_seg: int, seg_points: int) -> int:
+    buf     = ResultBuffer(n_seg*seg_points, columns=('freq', 'power'))
+    segment = np.zeros(seg_points)
+    for _ in range(n_seg):
+        buf.extend(segment, segment)
+    return buf.copied_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points'          , type=int, default=1024, help="points of a point scan")
+    parser.add_argument('--segments'        , type=int, default=41  , help="segments of the hi-res scan")
+    parser.add_argument('--segment-points'  , type=int, default=1001, help="sweep points per segment")
+    args = parser.parse_args()
+
+    cases = [
+        (f"point scan {args.points} x 5, np.append" , lambda: points_append(args.points)),
+        (f"point scan {args.points} x 5, buffer"    , lambda: points_buffer(args.points)),
+        (f"hi-res {args.segments} x {args.segment_points}, np.concatenate",
+         lambda: segments_concatenate(args.segments, args.segment_points)),
+        (f"hi-res {args.segments} x {args.segment_points}, buffer",
+         lambda: segments_buffer(args.segments, args.segment_points)),
+    ]
+    print(f"{'case':<48}{'time (ms)':>12}{'copied (kB)':>14}{'peak (kB)':>12}")
+    for name, func in cases:
+        elapsed, copied, peak = measure(func)
+        print(f"{name:<48}{elapsed*1e3:>12.2f}{copied/1024:>14.1f}{peak/1024:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Throughput of several simulated benches driven in parallel by a SessionManager.
+
+Every bench is a simulated SG -> band pass filter -> SA pair running the Ex5 filter scan
+(headless, as in rf_perf.bench.apps). The same scan is run on 1, 2, 4 ... benches at
+once; with independent sessions the wall time stays flat and the throughput (scans per
+minute) grows with the bench count. ``--slow-latency`` gives the last bench a slow LAN
+link, the scans of the other benches must not take longer because of it. With
+``--workers asyncio`` the scans are the LongProcess.run_async coroutine, all the benches
+in one event loop thread.
+
+    python -m rf_perf.bench.sessions --benches 1 2 4 --points 256
+    python -m rf_perf.bench.sessions --benches 4 --workers process --slow-latency 5
+    python -m rf_perf.bench.sessions --benches 1 4 8 --workers asyncio
+"""
+import argparse
+import functools
+import logging
+
+import numpy as np
+
+from rf_perf.bench.apps import load_app
+from rf_perf.sessions import BenchSession, SessionManager
+from rf_perf.sim.server import SimBench
+
+logger = logging.getLogger(__name__)
+
+
+def filter_scan(name, scpi_sa, scpi_sg, progress, points: int = 256) -> dict:
+    """Ex5 filter scan (cb_connect, cb_go and the LongProcess loop) on one bench."""
+    from PyQt6.QtCore import QCoreApplication
+    app     = QCoreApplication.instance() or QCoreApplication([])
+    module  = load_app('Exercises/ex5/solution/ex5_long_process.py', 'ex5_long_process')
+    with scpi_sa.batch(), scpi_sg.batch():
+        scpi_sa.write("*RST")
+        scpi_sa.write("*CLS")
+        scpi_sg.write("*RST")
+        scpi_sg.write("*CLS")
+    with scpi_sg.batch():
+        scpi_sg.write(":OUTP:STAT OFF")
+        scpi_sg.write(":POW:LEV -30 dBm")
+
+    thread  = module.LongProcess(f_scan=np.linspace(850.0, 950.0, points), scpi_sa=scpi_sa, scpi_sg=scpi_sg)
+    result  = {}
+    thread.data.connect(lambda f, p: result.update(freq=f, power=p))
+    thread.progress.connect(progress)
+    thread.run()
+    return dict(points=len(result['freq']), peak_dbm=float(np.max(result['power'])))
+
+
+async def filter_scan_async(name, sa, sg, progress, points: int = 256) -> dict:
+    """The same scan as a coroutine (LongProcess.run_async) on asyncio connections."""
+    module  = load_app('Exercises/ex5/solution/ex5_long_process.py', 'ex5_long_process')
+    await sa.write("*RST;*CLS")
+    await sg.write("*RST;*CLS")
+    await sg.write(":OUTP:STAT OFF;:POW:LEV -30 dBm")
+
+    thread  = module.LongProcess(f_scan=np.linspace(850.0, 950.0, points), scpi_sa=None, scpi_sg=None,
+                                 sg_list=False)
+    thread.progress.connect(progress)
+    freq, power = await thread.run_async(sa, sg)
+    return dict(points=len(freq), peak_dbm=float(np.max(power)))
+
+
+def run_benches(n: int, args) -> tuple:
+    """
+    Returns: (wall time, {name: BenchResult})
+    """
+    benches = []
+    for i in range(n):
+        latency = args.slow_latency if args.slow_latency and i == n - 1 and n > 1 else args.latency
+        benches.append(SimBench(dut='filter', time_scale=args.time_scale, latency=latency*1e-3,
+                                seed=args.seed + 2*i).start())
+    try:
+        sessions = [BenchSession(f"bench{i + 1}", b.resource('sa'), b.resource('sg'))
+                    for i, b in enumerate(benches)]
+        measure  = filter_scan_async if args.workers == 'asyncio' else filter_scan
+        manager  = SessionManager(sessions, functools.partial(measure, points=args.points),
+                                  workers=args.workers, timeout=args.timeout, log=logger)
+        results  = manager.run()
+    finally:
+        for b in benches:
+            b.stop()
+    return manager.elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--benches'     , type=int  , nargs='+', default=[1, 2, 4], help="bench counts")
+    parser.add_argument('--points'      , type=int  , default=256     , help="scan points per bench")
+    parser.add_argument('--workers'     , default='thread', choices=('thread', 'process', 'asyncio'))
+    parser.add_argument('--time-scale'  , type=float, default=1.0     , help="simulated sweep time scale")
+    parser.add_argument('--latency'     , type=float, default=0.5     , help="round trip time (ms)")
+    parser.add_argument('--slow-latency', type=float, default=None    , help="round trip time of the last bench (ms)")
+    parser.add_argument('--timeout'     , type=float, default=600.0   , help="time limit of a run (s)")
+    parser.add_argument('--seed'        , type=int  , default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+
+    from PyQt6.QtCore import QCoreApplication
+    app     = QCoreApplication.instance() or QCoreApplication([])
+
+    print(f"Ex5 filter scan, {args.points} points per bench, {args.workers} workers")
+    print(f"{'benches':>8}{'wall (s)':>10}{'scans/min':>11}{'speedup':>9}  bench (s)")
+    rate_1 = None
+    for n in args.benches:
+        elapsed, results = run_benches(n, args)
+        done    = [r for r in results.values() if r.status == 'done']
+        rate    = 60.0*len(done)/elapsed
+        rate_1  = rate_1 or rate/n
+        speedup = f"{rate/rate_1:>8.2f}x" if rate_1 else f"{'-':>9}"
+        times   = ' '.join(f"{r.elapsed:.2f}" if r.status == 'done' else r.status for r in results.values())
+        print(f"{n:>8}{elapsed:>10.2f}{rate:>11.1f}{speedup}  {times}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Compare ASCII and REAL,32 trace transfer: bytes on the wire and host parse time.
+
+Offline (default) the instrument responses are synthesized with the same formatting a
+Keysight analyzer uses, so only the host side is measured. With ``--resource`` the
+full query (instrument formatting + transfer + parse) is timed on a live analyzer.
+
+    python -m rf_perf.bench.trace_transfer --points 40001
+    python -m rf_perf.bench.trace_transfer --resource TCPIP0::10.0.0.6::inst0::INSTR
+"""
+import argparse
+import time
+
+import numpy as np
+import pyvisa
+from pyvisa import util
+
+from rf_perf.trace import TraceReader
+
+
+def best_time(func, repeat: int) -> float:
+    # Minimum over repeats is the least noisy estimate of the cost
+    t_min = np.inf
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        func()
+        t_min   = min(t_min, time.perf_counter() - t_start)
+    return t_min
+
+
+def bench_offline(points: int, repeat: int):
+    rng     = np.random.default_rng(0)
+    trace   = (-90.0 + 3.0*rng.standard_normal(points)).astype(np.float32)
+
+    # Instrument formatted responses (ASCII uses 10 significant digits, terminated by LF)
+    ascii_block     = ','.join(f"{v:.9E}" for v in trace) + '\n'
+    binary_block    = bytes(util.to_ieee_block(trace, datatype='f', is_big_endian=False)) + b'\n'
+
+    t_ascii  = best_time(lambda: util.from_ascii_block(ascii_block, converter='f', separator=',',
+                                                       container=np.array), repeat)
+    t_binary = best_time(lambda: util.from_ieee_block(binary_block, datatype='f', is_big_endian=False,
+                                                      container=np.ndarray), repeat)
+    return len(ascii_block.encode()), len(binary_block), t_ascii, t_binary
+
+
+def bench_live(resource: str, repeat: int):
+    rm      = pyvisa.ResourceManager('@py')
+    sa      = rm.open_resource(resource)
+    sa.timeout = 60000
+    try:
+        sa.write(":INITiate:CONTinuous OFF")
+        points  = int(sa.query(":SENSe:SWEep:POIN?"))
+
+        sa.write(":FORMat:TRACe:DATA ASCii")
+        t_ascii  = best_time(lambda: sa.query_ascii_values(":TRACe:DATA? TRACE1", container=np.array), repeat)
+        n_ascii  = len(sa.query(":TRACe:DATA? TRACE1").encode()) + 1
+
+        reader   = TraceReader(sa)
+        if not reader.is_binary:
+            raise RuntimeError("Instrument does not support REAL,32 transfer")
+        t_binary = best_time(reader.read, repeat)
+        # IEEE header (#<n><length>) + data + LF
+        n_binary = len(str(4*points)) + 2 + 4*points + 1
+        sa.write(":INITiate:CONTinuous ON")
+    finally:
+        sa.close()
+        rm.close()
+    return points, n_ascii, n_binary, t_ascii, t_binary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points'  , type=int, default=40001, help="trace points (offline mode)")
+    parser.add_argument('--repeat'  , type=int, default=10   , help="repetitions per measurement")
+    parser.add_argument('--resource', type=str, default=None , help="VISA resource of a live analyzer")
+    args = parser.parse_args()
+
+    if args.resource is None:
+        points = args.points
+        n_ascii, n_binary, t_ascii, t_binary = bench_offline(points, args.repeat)
+        what = "parse"
+    else:
+        points, n_ascii, n_binary, t_ascii, t_binary = bench_live(args.resource, args.repeat)
+        what = "query"
+
+    print(f"Trace points: {points}")
+    print(f"{'format':<10}{'bytes':>12}{what + ' (ms)':>14}")
+    print(f"{'ASCII':<10}{n_ascii:>12}{t_ascii*1e3:>14.2f}")
+    print(f"{'REAL,32':<10}{n_binary:>12}{t_binary*1e3:>14.2f}")
+    print(f"Bytes ratio {n_ascii/n_binary:.1f}x, time ratio {t_ascii/t_binary:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
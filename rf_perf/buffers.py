@@ -0,0 +1,78 @@
+"""
+Preallocated result buffers for the scan threads.
+
+Growing a result with ``np.append``/``np.concatenate`` copies the whole array on every
+point, O(N^2) copies for a N point scan. ResultBuffer allocates the known scan length
+once (growing by doubling if the estimate was short) and hands out views of the filled
+part, so the interim ``data.emit`` signals do not copy anything either.
+
+Usage:
+    buf = ResultBuffer(len(f_scan), columns=('freq', 'power'))
+    buf.append(f, p)
+    self.data.emit(*buf.views())
+"""
+import numpy as np
+
+
+class ResultBuffer:
+    """
+    Column buffer of ``capacity`` rows.
+
+    The views returned by ``views()``/``[name]`` stay valid after later appends: the
+    filled part of the array is never written again, and a growth allocates a new array
+    without touching the old one.
+
+    Args:
+        capacity: expected number of rows
+        columns:  column names
+        dtype:    numpy dtype of the data
+    """
+
+    def __init__(self, capacity: int, columns=('x', 'y'), dtype=np.float64):
+        self.columns        = tuple(columns)
+        self._index         = {name: i for i, name in enumerate(self.columns)}
+        self.data           = np.empty((len(self.columns), max(int(capacity), 1)), dtype=dtype)
+        self.count          = 0
+        # Statistics (bytes copied by growths, 0 when the capacity was right)
+        self.copied_bytes   = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def capacity(self) -> int:
+        return self.data.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+    def append(self, *values):
+        """Append one row (one value per column)."""
+        if self.count == self.capacity:
+            self._grow(self.count + 1)
+        self.data[:, self.count] = values
+        self.count += 1
+
+    def extend(self, *blocks):
+        """Append a block (one array per column, all of the same length)."""
+        n = len(blocks[0])
+        if self.count + n > self.capacity:
+            self._grow(self.count + n)
+        for row, block in zip(self.data, blocks):
+            row[self.count:self.count + n] = block
+        self.count += n
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.data[self._index[name], :self.count]
+
+    def views(self) -> tuple:
+        """Views of the filled part of every column (no copy)."""
+        return tuple(row[:self.count] for row in self.data)
+
+    def _grow(self, min_capacity: int):
+        capacity            = max(min_capacity, 2*self.capacity)
+        data                = np.empty((len(self.columns), capacity), dtype=self.data.dtype)
+        data[:, :self.count] = self.data[:, :self.count]
+        self.copied_bytes   += self.data[:, :self.count].nbytes
+        self.data           = data
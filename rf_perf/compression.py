@@ -0,0 +1,172 @@
+"""
+Model guided search of the 1 dB compression point.
+
+A bisection over an 11 dB window to 0.1 dB costs 7 sweeps per frequency. The AM/AM
+curve of an amplifier is smooth, so a compact model fitted to the points measured so
+far predicts the 1 dB point far better than the middle of the bracket. The Rapp model
+in dB (power exponent p, saturated output power Psat):
+
+    C(Pin) = 10/p * log10(1 + 10^(p*(Pin + G0 - Psat)/10))       compression (dB)
+
+One compressed point fixes Psat (p from the previous frequency), two or more fit both.
+Every step is kept inside the measured bracket (secant, then bisection, when the model
+prediction falls outside or repeats a point), and the search is seeded with the input
+1 dB point of the previous frequency, so a scan usually needs 1-4 sweeps per frequency.
+
+Usage:
+    search = CompressionSearch(p_tx_nominal - 6, p_tx_nominal + 5)
+    for f in f_scan:
+        op1db = search.solve(measure, small_signal_gain)   # measure(p_in) -> p_out (dBm)
+        log(f"{search.last_sweeps} sweeps")
+"""
+import numpy as np
+
+
+def rapp_compression(p_in, g0: float, psat: float, p: float):
+    """Compression (dB) of the Rapp model at the input power p_in (dBm)."""
+    return 10.0/p*np.log10(1.0 + 10.0**(p*(np.asarray(p_in) + g0 - psat)/10.0))
+
+
+def rapp_psat(p_in: float, c: float, g0: float, p: float) -> float:
+    """Saturated output power (dBm) of the Rapp model through one point (p_in, compression c)."""
+    return p_in + g0 - 10.0/p*np.log10(10.0**(p*c/10.0) - 1.0)
+
+
+def rapp_p_in(c: float, g0: float, psat: float, p: float) -> float:
+    """Input power (dBm) of the Rapp model at the compression c (dB)."""
+    return psat - g0 + 10.0/p*np.log10(10.0**(p*c/10.0) - 1.0)
+
+
+class CompressionSearch:
+    """
+    Args:
+        p_min:      lowest input power of the search (dBm)
+        p_max:      highest input power of the search (dBm)
+        tol:        accepted error of the compression at the solution (dB)
+        resolution: stop when the bracket is narrower than this (dB)
+        max_sweeps: measurement budget per solve
+        smoothness: initial Rapp exponent p
+        step:       input power step while no point is compressed (dB)
+    """
+    # Rapp exponents tried by the two parameter fit
+    P_GRID      = np.linspace(0.5, 8.0, 76)
+    # Points compressed less than this carry no model information (measurement noise)
+    MIN_COMPRESSION = 0.1
+
+    def __init__(self, p_min: float, p_max: float, tol: float = 0.05, resolution: float = 0.1,
+                 max_sweeps: int = 8, smoothness: float = 2.0, step: float = 3.0):
+        self.p_min      = p_min
+        self.p_max      = p_max
+        self.tol        = tol
+        self.resolution = resolution
+        self.max_sweeps = max_sweeps
+        self.smoothness = smoothness
+        self.step       = step
+        # Input 1 dB point of the previous solve (seed of the next one)
+        self.seed       = None
+        # Statistics
+        self.last_sweeps = 0
+        self.sweeps     = []
+
+    @property
+    def mean_sweeps(self) -> float:
+        return float(np.mean(self.sweeps)) if self.sweeps else 0.0
+
+    def fit(self, points: list, g0: float) -> tuple:
+        """
+        Rapp model through the compressed points.
+
+        Returns: (psat, p) or None if no point is compressed enough
+        """
+        pts = [(p_in, c) for p_in, c in points if c > self.MIN_COMPRESSION]
+        if not pts:
+            return None
+        p_in, c = np.array(pts).T
+        if len(pts) == 1:
+            return float(rapp_psat(p_in[0], c[0], g0, self.smoothness)), self.smoothness
+        best = None
+        for p in self.P_GRID:
+            psat    = np.mean(rapp_psat(p_in, c, g0, p))
+            err     = np.sum((rapp_compression(p_in, g0, psat, p) - c)**2)
+            if best is None or err < best[0]:
+                best = (err, float(psat), float(p))
+        return best[1], best[2]
+
+    def solve(self, measure, g0: float) -> float:
+        """
+        Find the output power at 1 dB compression.
+
+        Args:
+            measure: callable, input power (dBm) -> output power (dBm), one sweep per call
+            g0:      small signal gain (dB)
+        Returns: OP1dB (dBm), the output power at the highest tested input if the
+                 amplifier does not compress by 1 dB in the search range
+        """
+        points  = []            # (p_in, compression)
+        lo, hi  = None, None    # bracket: compression below / above 1 dB
+        p_next  = self.seed if self.seed is not None else 0.5*(self.p_min + self.p_max)
+        p_in1   = None
+
+        while len(points) < self.max_sweeps:
+            p_next  = float(np.clip(p_next, self.p_min, self.p_max))
+            c       = g0 - (measure(p_next) - p_next)
+            points.append((p_next, c))
+            if abs(c - 1.0) <= self.tol:
+                p_in1 = p_next + (1.0 - c)/self._slope(points, g0)
+                break
+            if c < 1.0:
+                lo = (p_next, c) if lo is None or p_next > lo[0] else lo
+            else:
+                hi = (p_next, c) if hi is None or p_next < hi[0] else hi
+            if lo is not None and lo[0] >= self.p_max:
+                break
+            if hi is not None and hi[0] <= self.p_min:
+                break
+            if lo is not None and hi is not None and hi[0] - lo[0] <= self.resolution:
+                p_in1 = lo[0] + (1.0 - lo[1])*(hi[0] - lo[0])/(hi[1] - lo[1])
+                break
+            p_next  = self._next(points, g0, lo, hi)
+
+        self.last_sweeps = len(points)
+        self.sweeps.append(self.last_sweeps)
+        if p_in1 is None:
+            # No solution in the range: the closest measured point
+            p_in, c = min(points, key=lambda pc: abs(pc[1] - 1.0))
+            return p_in + g0 - c
+        self.seed = p_in1
+        return p_in1 + g0 - 1.0
+
+    def _next(self, points: list, g0: float, lo, hi) -> float:
+        """Next input power: model prediction, safeguarded by the bracket (Brent style)."""
+        model = self.fit(points, g0)
+        if model is not None:
+            psat, p         = model
+            if len(points) > 1:
+                self.smoothness = p
+            p_pred          = rapp_p_in(1.0, g0, psat, p)
+        elif hi is None:
+            p_pred          = points[-1][0] + self.step
+        else:
+            p_pred          = hi[0] - self.step
+
+        if lo is not None and hi is not None:
+            is_stale = any(abs(p_pred - pc[0]) < 0.5*self.resolution for pc in points)
+            if not lo[0] < p_pred < hi[0] or is_stale:
+                # Secant between the bracket ends, bisection if that stagnates too
+                p_pred = lo[0] + (1.0 - lo[1])*(hi[0] - lo[0])/(hi[1] - lo[1])
+                if any(abs(p_pred - pc[0]) < 0.5*self.resolution for pc in points):
+                    p_pred = 0.5*(lo[0] + hi[0])
+        elif lo is not None and p_pred <= lo[0]:
+            p_pred = lo[0] + self.step
+        elif hi is not None and p_pred >= hi[0]:
+            p_pred = hi[0] - self.step
+        return p_pred
+
+    def _slope(self, points: list, g0: float) -> float:
+        """Local slope dC/dPin at the last point (model, or 0.4 dB/dB without one)."""
+        model = self.fit(points, g0)
+        if model is None:
+            return 0.4
+        psat, p = model
+        p_in    = points[-1][0]
+        return float((rapp_compression(p_in + 0.05, g0, psat, p) - rapp_compression(p_in - 0.05, g0, psat, p))/0.1)
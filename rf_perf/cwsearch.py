@@ -0,0 +1,279 @@
+"""
+Coarse to fine CW search with host side peak interpolation.
+
+The classic zoom (155_find_cw) sweeps seven fixed decades of span and reads the marker,
+whose frequency is quantized to a trace bin. The RBW filter is Gaussian, a parabola in
+dB, so a least squares parabola through the top bins of the peak locates the carrier to
+a small fraction of a bin. Every stage reads the trace once (binary), estimates the
+carrier frequency and its uncertainty, and the next span is chosen from that
+uncertainty: just wide enough (``guard`` times the uncertainty) to be sure to hold the
+carrier, or directly the span that meets the requested accuracy. A full span start
+usually needs 2-4 zoom stages.
+
+The uncertainty of a stage is the analyzer frequency readout error (a fraction of the
+span and of the RBW, as in the data sheet marker accuracy) plus the statistical error
+of the fitted vertex.
+
+Several carriers: ``find_all()`` picks every peak of the full span trace that rises
+``threshold_db`` above a rolling median noise floor (at least ``min_separation`` apart)
+and refines all of them stage by stage, visiting the carriers in frequency order (up
+then down) so the analyzer retunes by the smallest steps.
+
+Usage:
+    finder  = CwFinder(scpi_sa, accuracy=10.0, log=log)     # Hz
+    result  = finder.find()         # the analyzer is set to a single sweep and full span
+    log(f"{result.freq*1e-6:.6f} MHz +- {result.uncertainty:.1f} Hz in {result.elapsed:.2f} s")
+    table   = finder.find_all(threshold_db=10.0)           # [CwEstimate] by frequency
+"""
+import logging
+import time
+from collections import namedtuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from rf_perf.sweep import SweepCompletion
+from rf_perf.trace import TraceReader
+
+logger = logging.getLogger(__name__)
+
+CwEstimate = namedtuple('CwEstimate', ['freq', 'power', 'uncertainty', 'stages', 'elapsed'])
+
+
+def noise_floor(power: np.ndarray, window: int = 51) -> np.ndarray:
+    """Rolling median of a trace (dB), the window is shrunk to the trace length and made odd."""
+    window  = max(min(window, len(power)) | 1, 1)
+    padded  = np.pad(power, window//2, mode='reflect')
+    return np.median(sliding_window_view(padded, window), axis=1)
+
+
+def find_peaks(freq: np.ndarray, power: np.ndarray, threshold_db: float = 10.0, min_separation: float = 0.0,
+               window: int = 51) -> np.ndarray:
+    """
+    Peaks rising threshold_db above the rolling median noise floor.
+
+    Args:
+        freq:           trace frequency axis (Hz)
+        power:          trace (dBm)
+        threshold_db:   detection threshold above the noise floor (dB)
+        min_separation: weaker peaks closer than this to a stronger one are dropped (Hz)
+        window:         rolling median window (bins)
+    Returns: bin indices of the peaks, by frequency
+    """
+    floor   = noise_floor(power, window)
+    peaks   = np.flatnonzero((power[1:-1] > power[:-2]) & (power[1:-1] >= power[2:])) + 1
+    peaks   = peaks[power[peaks] > floor[peaks] + threshold_db]
+    # Strongest first, drop the peaks too close to a kept one
+    kept    = []
+    for i in peaks[np.argsort(-power[peaks], kind='stable')]:
+        if all(abs(freq[i] - freq[k]) >= min_separation for k in kept):
+            kept.append(i)
+    return np.sort(np.array(kept, dtype=int))
+
+
+def fit_peak(freq: np.ndarray, power: np.ndarray, fit_db: float = 6.0, noise_db: float = 0.1,
+             i: int = None) -> tuple:
+    """
+    Least squares parabola (in dB) through the bins of the highest peak within fit_db
+    of its maximum (at least the maximum and its two neighbours).
+
+    Args:
+        freq:     trace frequency axis (Hz)
+        power:    trace (dBm)
+        fit_db:   depth of the fitted region below the maximum (dB)
+        noise_db: trace noise (dB) assumed when the fit has no residual degree of freedom
+        i:        bin of the peak (default: the trace maximum)
+    Returns: (frequency, power, standard deviation of the frequency)
+    """
+    n   = len(power)
+    i   = int(np.argmax(power)) if i is None else int(i)
+    df  = float(freq[1] - freq[0]) if n > 1 else 0.0
+    if i == 0 or i == n - 1:
+        # Peak on the edge of the trace: no vertex, the bin itself
+        return float(freq[i]), float(power[i]), abs(df)
+    # Contiguous region around the maximum within fit_db
+    above   = power >= power[i] - fit_db
+    lo      = i - 1
+    while lo > 0 and above[lo - 1]:
+        lo -= 1
+    hi      = i + 1
+    while hi < n - 1 and above[hi + 1]:
+        hi += 1
+    x       = np.arange(lo - i, hi - i + 1, dtype=float)
+    y       = power[lo:hi + 1].astype(float)
+    a       = np.vander(x, 3)
+    coef, _, _, _ = np.linalg.lstsq(a, y, rcond=None)
+    c2, c1, c0 = coef
+    if c2 >= 0:
+        return float(freq[i]), float(power[i]), abs(df)
+    x0      = -c1/(2.0*c2)
+    if abs(x0) > 1.0:
+        # The vertex must lie next to the maximum bin
+        x0  = float(np.clip(x0, -1.0, 1.0))
+    dof     = len(x) - 3
+    sigma   = np.sqrt(np.sum((a @ coef - y)**2)/dof) if dof > 0 else noise_db
+    # Delta method: x0 = -c1/(2 c2)
+    cov     = sigma**2*np.linalg.inv(a.T @ a)
+    grad    = np.array([c1/(2.0*c2**2), -1.0/(2.0*c2), 0.0])
+    sd_x0   = float(np.sqrt(max(grad @ cov @ grad, 0.0)))
+    f0      = float(freq[i] + x0*df)
+    p0      = float(c0 + c1*x0 + c2*x0**2)
+    return f0, p0, min(sd_x0, 1.0)*abs(df)
+
+
+class CwFinder:
+    """
+    Args:
+        scpi:       SCPIWrapper of the spectrum analyzer
+        accuracy:   requested frequency uncertainty (Hz)
+        guard:      next span / current uncertainty
+        span_error: frequency readout error, fraction of the span
+        rbw_error:  frequency readout error, fraction of the RBW
+        min_span:   narrowest span of the analyzer (Hz)
+        max_stages: zoom stages after the first sweep
+        ref_level:  set the reference level above the strongest peak of the first sweep
+        log:        logger (defaults to the module logger)
+    """
+
+    def __init__(self, scpi, accuracy: float = 10.0, guard: float = 10.0, span_error: float = 1e-3,
+                 rbw_error: float = 0.02, min_span: float = 100.0, max_stages: int = 8, ref_level: bool = True,
+                 log=None):
+        self.scpi       = scpi
+        self.accuracy   = accuracy
+        self.guard      = guard
+        self.span_error = span_error
+        self.rbw_error  = rbw_error
+        self.min_span   = min_span
+        self.max_stages = max_stages
+        self.ref_level  = ref_level
+        self.log        = log if log is not None else logger
+        self.reader     = None
+        self.completion = None
+        # Stage history [(span, rbw, freq, power, uncertainty)]
+        self.stages     = []
+
+    def sweep(self) -> np.ndarray:
+        """Single sweep, then the trace in binary."""
+        # Sweep completion by SRQ / *ESR? polling (no blocking *OPC? on the session)
+        self.completion.start()
+        self.completion.wait()
+        return self.reader.read()
+
+    def estimate(self, freq: np.ndarray, power: np.ndarray, span: float, rbw: float, i: int = None) -> tuple:
+        """
+        Returns: (frequency, power, uncertainty) of the strongest carrier of a trace (or of
+                 the peak at bin i)
+        """
+        f0, p0, sd = fit_peak(freq, power, i=i)
+        return f0, p0, self.span_error*span + self.rbw_error*rbw + 2.0*sd
+
+    def next_span(self, uncertainty: float, span: float) -> float:
+        """Narrowest span that holds the carrier, or wider if that already meets the accuracy."""
+        # Uncertainty per Hz of span at the next stage (auto RBW ~ span/100)
+        u_per_span  = self.span_error + self.rbw_error/100.0
+        final_span  = self.accuracy/u_per_span
+        return float(min(max(self.guard*uncertainty, final_span, self.min_span), span/2.0))
+
+    def first_sweep(self) -> tuple:
+        """
+        Sweep with the current analyzer settings (normally full span), then set the
+        reference level above its strongest peak (as 155_find_cw).
+
+        Returns: (frequency axis, trace, span, RBW)
+        """
+        self.reader     = TraceReader(self.scpi, log=self.log)
+        self.completion = SweepCompletion(self.scpi, log=self.log)
+        f_start         = float(self.scpi.query(":FREQuency:STARt?"))
+        f_stop          = float(self.scpi.query(":FREQuency:STOP?"))
+        rbw             = float(self.scpi.query("sense:BANDwidth:RESolution?"))
+        trace           = self.sweep()
+        if self.ref_level:
+            # Set the reference level to the maximum (next 10 dB step above the peak)
+            max_level   = np.ceil(np.max(trace)/10 + 1)*10
+            self.scpi.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
+        return np.linspace(f_start, f_stop, len(trace)), trace, f_stop - f_start, rbw
+
+    def zoom(self, center: float, span: float) -> tuple:
+        """
+        Sweep around center.
+
+        Returns: (frequency axis, trace, RBW)
+        """
+        self.scpi.write(f"sense:FREQuency:CENTer {center} Hz")
+        self.scpi.write(f"sense:FREQuency:SPAN {span} Hz")
+        rbw     = float(self.scpi.query("sense:BANDwidth:RESolution?"))
+        trace   = self.sweep()
+        return np.linspace(center - span/2, center + span/2, len(trace)), trace, rbw
+
+    def find(self) -> CwEstimate:
+        """
+        Search the strongest carrier from the current analyzer settings (normally full span,
+        single sweep). The center frequency and the span are changed by the search.
+        """
+        t_start     = time.perf_counter()
+        self.stages = []
+        freq, trace, span, rbw = self.first_sweep()
+
+        for stage in range(self.max_stages + 1):
+            if stage > 0:
+                freq, trace, rbw = self.zoom(center, span)
+            f0, p0, u = self.estimate(freq, trace, span, rbw)
+            self.stages.append((span, rbw, f0, p0, u))
+            self.log.info(f"Stage {stage}: span {span:.4g} Hz, RBW {rbw:.4g} Hz, "
+                          f"{f0*1e-6:.6f} MHz +- {u:.4g} Hz, {p0:.2f} dBm")
+            if u <= self.accuracy or span <= self.min_span:
+                break
+            # Zoom on the estimate
+            center  = f0
+            span    = self.next_span(u, span)
+
+        return CwEstimate(f0, p0, u, len(self.stages), time.perf_counter() - t_start)
+
+    def find_all(self, threshold_db: float = 10.0, min_separation: float = None, window: int = 51) -> list:
+        """
+        Search every carrier of the first sweep and refine them all, stage by stage.
+
+        Args:
+            threshold_db:   detection threshold above the rolling median noise floor (dB)
+            min_separation: closest carriers told apart (Hz, default 3 RBW of the first sweep)
+            window:         rolling median window (bins)
+        Returns: [CwEstimate] sorted by frequency (stages: sweeps spent on the carrier,
+                 elapsed: time since the start of the search)
+        """
+        t_start = time.perf_counter()
+        freq, trace, span, rbw = self.first_sweep()
+        if min_separation is None:
+            min_separation = 3.0*rbw
+        peaks   = find_peaks(freq, trace, threshold_db, min_separation, window)
+        self.log.info(f"{len(peaks)} carriers above the noise floor + {threshold_db} dB")
+        # Per carrier state: [freq, power, uncertainty, span, sweeps, elapsed]
+        state   = []
+        for i in peaks:
+            f0, p0, u = self.estimate(freq, trace, span, rbw, i=i)
+            state.append([f0, p0, u, span, 1, time.perf_counter() - t_start])
+
+        for stage in range(1, self.max_stages + 1):
+            todo = [s for s in state if s[2] > self.accuracy and s[3] > self.min_span]
+            if not todo:
+                break
+            # Serpentine order: up the band on odd stages, down on even ones
+            todo.sort(key=lambda s: s[0], reverse=stage % 2 == 0)
+            for s in todo:
+                f0, _, u, span, _, _ = s
+                span                = self.next_span(u, span)
+                freq, trace, rbw    = self.zoom(f0, span)
+                f0, p0, u           = self.estimate(freq, trace, span, rbw)
+                s[:]                = [f0, p0, u, span, s[4] + 1, time.perf_counter() - t_start]
+            self.log.info(f"Stage {stage}: {len(todo)} carriers refined")
+
+        table = [CwEstimate(f0, p0, u, sweeps, elapsed) for f0, p0, u, _, sweeps, elapsed in state]
+        # Two candidates that converged on the same carrier: keep the more accurate one
+        table.sort(key=lambda c: (c.freq, c.uncertainty))
+        merged = []
+        for c in table:
+            if merged and abs(c.freq - merged[-1].freq) <= c.uncertainty + merged[-1].uncertainty:
+                if c.uncertainty < merged[-1].uncertainty:
+                    merged[-1] = c
+                continue
+            merged.append(c)
+        return merged
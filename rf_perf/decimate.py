@@ -0,0 +1,97 @@
+"""
+Peak preserving (min/max per pixel column) decimation of traces for plotting.
+
+A hi-res scan holds tens of thousands of bins, a plot a thousand pixel columns: drawing
+every bin costs the line rendering of all of them for no visible detail. Keeping every
+k-th bin would make narrow spurs vanish, so every pixel column keeps the minimum and
+the maximum of its bins instead (2 points per column): the drawn envelope is the same
+as that of the full trace.
+
+The column split (index of the first bin of every column) depends only on the frequency
+axis, the visible range and the plot width. MinMaxDecimator keeps it and recomputes it
+only when one of them changes (Fc/Span change, zoom or resize); a refresh with a new
+trace on the same axis is two ``reduceat`` passes.
+
+Usage:
+    decimator = MinMaxDecimator(width=self.plot_sa.width())
+    x, y      = decimator(freq, power)      # every frame
+    decimator.width = new_width             # on resize, the split is recomputed once
+"""
+import numpy as np
+
+
+def column_starts(x: np.ndarray, width: int, x_range: tuple = None) -> np.ndarray:
+    """
+    First bin of every non-empty pixel column of the visible range.
+
+    Args:
+        x:       increasing x axis of the trace
+        width:   pixel columns of the plot
+        x_range: visible (x_min, x_max) (default: the whole trace)
+    Returns: column start indices, followed by the end index of the last column
+    """
+    x_min, x_max = (x[0], x[-1]) if x_range is None else x_range
+    edges   = np.linspace(x_min, x_max, int(width) + 1)
+    # The last edge closes the last column (x_max included)
+    idx     = np.searchsorted(x, edges, side='left')
+    idx[-1] = np.searchsorted(x, x_max, side='right')
+    # Empty columns (axis coarser than the pixels there) are dropped
+    return np.unique(idx)
+
+
+def minmax_decimate(x: np.ndarray, y: np.ndarray, width: int, x_range: tuple = None,
+                    starts: np.ndarray = None) -> tuple:
+    """
+    Minimum and maximum of every pixel column, the trace itself when it has no more
+    than two points per column.
+
+    Args:
+        x:       increasing x axis of the trace
+        y:       trace values
+        width:   pixel columns of the plot
+        x_range: visible (x_min, x_max) (default: the whole trace)
+        starts:  column_starts() of x, width and x_range (computed if None)
+    Returns: (x, y) with two points per column, x at the column first and last bin
+    """
+    if len(x) <= 2*width:
+        return x, y
+    if starts is None:
+        starts = column_starts(x, width, x_range)
+    first   = starts[:-1]
+    last    = starts[1:] - 1
+    y_min   = np.minimum.reduceat(y[:starts[-1]], first)
+    y_max   = np.maximum.reduceat(y[:starts[-1]], first)
+    # Drawn as a vertical stroke per column, the line continues from the column maximum
+    x_out   = np.empty(2*len(first), dtype=x.dtype)
+    y_out   = np.empty(2*len(first), dtype=y.dtype)
+    x_out[0::2], x_out[1::2] = x[first], x[last]
+    y_out[0::2], y_out[1::2] = y_min, y_max
+    return x_out, y_out
+
+
+class MinMaxDecimator:
+    """
+    minmax_decimate with the column split kept between frames.
+
+    Args:
+        width:   pixel columns of the plot
+        x_range: visible (x_min, x_max) (None: the whole trace)
+    """
+
+    def __init__(self, width: int = 1000, x_range: tuple = None):
+        self.width      = width
+        self.x_range    = x_range
+        self._key       = None
+        self._starts    = None
+        # Statistics (one recompute per axis, zoom or resize change)
+        self.recomputes = 0
+
+    def __call__(self, x: np.ndarray, y: np.ndarray) -> tuple:
+        if len(x) <= 2*self.width:
+            return x, y
+        key = (len(x), float(x[0]), float(x[-1]), int(self.width), self.x_range)
+        if key != self._key:
+            self._key       = key
+            self._starts    = column_starts(x, self.width, self.x_range)
+            self.recomputes += 1
+        return minmax_decimate(x, y, self.width, starts=self._starts)
@@ -0,0 +1,141 @@
+"""
+Signal generator list sweep for frequency scans.
+
+A scan that retunes the generator with ``freq ... MHz`` makes the instrument parse a
+command and compute a new synthesizer state at every point. In list mode the whole
+frequency (and power) list is downloaded once, the generator precomputes the states and
+every point is a trigger: ``*TRG`` from the host (BUS) or the analyzer trigger output
+(EXTernal, wired to the generator trigger input, no host traffic at all).
+
+Generators without list mode (or refusing the list) are driven with stepped writes
+behind the same interface.
+
+Usage:
+    sg_list = ListSweep(scpi_sg, f_scan*1e6, log=log)
+    sg_list.start()             # download, output the first point
+    for i, f in enumerate(f_scan):
+        if i > 0:
+            sg_list.next()      # *TRG (or a stepped write)
+        ...
+    sg_list.stop()              # back to CW
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ListSweep:
+    """
+    The download and the error check go straight to the VISA resource (the error queue
+    tells whether the list was accepted), the points through the wrapper.
+
+    Args:
+        scpi:     SCPIWrapper of the signal generator
+        freq:     list frequencies (Hz)
+        power:    list power levels (dBm), None keeps the fixed power level (POW:LEV
+                  writes still apply during the sweep)
+        trigger:  point trigger, 'BUS' (``next()`` sends *TRG) or 'EXT' (the trigger
+                  input advances the list, ``next()`` only follows it)
+        use_list: False forces stepped writes
+        log:      logger (defaults to the module logger)
+    """
+
+    def __init__(self, scpi, freq, power=None, trigger: str = 'BUS', use_list: bool = True, log=None):
+        self.scpi       = scpi
+        self.instr      = getattr(scpi, 'instr', scpi)
+        self.freq       = np.asarray(freq, dtype=float)
+        self.power      = None if power is None else np.broadcast_to(np.asarray(power, dtype=float),
+                                                                     self.freq.shape)
+        self.trigger    = trigger
+        self.use_list   = use_list
+        self.log        = log if log is not None else logger
+        # List mode active (False: stepped writes)
+        self.is_list    = False
+        self.index      = None
+
+    @property
+    def mode(self) -> str:
+        return f'LIST ({self.trigger})' if self.is_list else 'STEPPED'
+
+    def start(self) -> bool:
+        """
+        Download the lists and output the first point, fall back to stepped writes if
+        the generator reports an error.
+
+        Returns: True if list mode is active
+        """
+        if not self.use_list:
+            self.is_list = False
+            self.index   = 0
+            self._write_point(0)
+            return False
+        self._drain_errors()
+        self.instr.write(":LIST:TYPE LIST")
+        self.instr.write(":LIST:FREQuency " + ','.join(f"{f:.3f}" for f in self.freq))
+        if self.power is not None:
+            self.instr.write(":LIST:POWer " + ','.join(f"{p:.2f}" for p in self.power))
+        self.instr.write(f":LIST:TRIGger:SOURce {self.trigger}")
+        self.instr.write(":TRIGger:SOURce IMMediate")
+        self.instr.write(":INITiate:CONTinuous OFF")
+        self.instr.write(":FREQuency:MODE LIST")
+        self.instr.write(f":POWer:MODE {'LIST' if self.power is not None else 'FIXed'}")
+        self.instr.write(":INITiate:IMMediate")
+        self.is_list = not self._drain_errors()
+        if not self.is_list:
+            self.log.warning("Signal generator list mode not available, using stepped writes")
+            self.instr.write(":FREQuency:MODE CW")
+            self.instr.write(":POWer:MODE FIXed")
+            self._drain_errors()
+        self._invalidate()
+        if not self.is_list:
+            self._write_point(0)
+        self.index = 0
+        self.log.debug(f"SG sweep: {self.mode}, {len(self.freq)} points")
+        return self.is_list
+
+    def next(self):
+        """Step to the next point of the list."""
+        if self.index is None:
+            raise RuntimeError("List sweep not started")
+        if self.index + 1 >= len(self.freq):
+            raise IndexError("End of the list")
+        self.index += 1
+        if not self.is_list:
+            self._write_point(self.index)
+        elif self.trigger == 'BUS':
+            self.scpi.write("*TRG")
+
+    def stop(self):
+        """Leave list mode (the generator returns to its CW frequency and power level)."""
+        if self.is_list:
+            self.instr.write(":FREQuency:MODE CW")
+            self.instr.write(":POWer:MODE FIXed")
+            self._invalidate()
+        self.index = None
+
+    def _invalidate(self):
+        # The shadow state cache of a FastSCPIWrapper did not see the mode changes
+        if hasattr(self.scpi, 'invalidate'):
+            self.scpi.invalidate()
+
+    def _write_point(self, i: int):
+        self.scpi.write(f"freq {self.freq[i]} Hz")
+        if self.power is not None:
+            self.scpi.write(f"POW:LEV {self.power[i]}")
+
+    def _drain_errors(self) -> bool:
+        """
+        Empty the instrument error queue.
+
+        Returns: True if at least one error was pending
+        """
+        is_error = False
+        for _ in range(32):
+            e = self.instr.query("SYST:ERR?").strip().split(',')
+            if int(e[0]) == 0:
+                break
+            is_error = True
+            self.log.debug(f"Instrument error: {','.join(e)}")
+        return is_error
@@ -0,0 +1,460 @@
+"""
+SCPI transaction helpers that reduce the number of LAN round trips.
+
+ErrorQueue: deferred instrument error checking. Instead of a ``SYST:ERR?`` after every
+write, a command group is sent as one message with a ``*ESR?`` marker after every command
+(``batch`` policy), or the error queue is checked only when asked (``manual`` policy).
+
+ShadowState: last known value of the instrument settings, used to drop writes that do not
+change anything and to answer setting queries without a round trip.
+
+FastSCPIWrapper: SCPIWrapper with ``batch()`` write coalescing (several commands sent as
+one ``;:`` joined program message) and an optional shadow state cache.
+"""
+import logging
+import re
+from collections import deque
+from contextlib import contextmanager
+
+from python_rf_course_utils.scpi import SCPIWrapper
+
+logger = logging.getLogger(__name__)
+
+# *ESR? bits reporting an error (query, device dependent, execution, command)
+ESR_ERROR_MASK = 4 | 8 | 16 | 32
+
+
+def short_header(cmd: str) -> str:
+    """
+    Canonical short form of a command header, e.g. 'sense:BANDwidth:RESolution 1 MHz'
+    -> 'SENS:BAND:RES' (IEEE 488.2 rule: 4 letters, 3 if the 4th is a vowel).
+    """
+    header = cmd.strip().split(' ', 1)[0].lstrip(':').upper()
+    nodes  = []
+    for node in header.split(':'):
+        m = re.fullmatch(r'([A-Z]+)(\d*)(\??)', node)
+        if m is None:
+            # Common commands (*RST, *OPC?) and anything unusual are kept as is
+            nodes.append(node)
+            continue
+        name, num, q = m.groups()
+        if len(name) > 4:
+            name = name[:3] if name[3] in 'AEIOU' else name[:4]
+        nodes.append(name + num + q)
+    return ':'.join(nodes)
+
+
+def join_program_message(cmds: list) -> str:
+    """
+    Join commands into one program message. Each subsystem command restarts from the root
+    (';:'), common commands (*RST, *CLS, ...) only need the ';' separator.
+    """
+    msg = ''
+    for cmd in cmds:
+        cmd = cmd.strip()
+        if not cmd:
+            continue
+        if not msg:
+            msg = cmd
+        elif cmd.startswith('*'):
+            msg += ';' + cmd
+        else:
+            msg += ';:' + cmd.lstrip(':')
+    return msg
+
+
+class ShadowState:
+    """
+    Shadow copy of the instrument settings written or read through the wrapper.
+
+    Only the settings listed in ``SETTINGS`` are cached. Writing a setting invalidates the
+    settings coupled to it on the instrument (e.g. a span change with auto RBW changes the
+    RBW and the sweep time). Commands in ``NEUTRAL`` do not change any cached setting;
+    any other command (*RST, *RCL, an unknown header) clears the whole cache.
+
+    The cache can not see changes made from the front panel or from another session
+    (e.g. pyarbtools), call ``invalidate()`` after those.
+    """
+    # Optional (default) nodes removed from the canonical header: root nodes only (SOURce
+    # is also a leaf, TRIGger:SOURce), trailing nodes only (TRIGger:LEVel is not TRIGger,
+    # POWer:LEVel:IMMediate:AMPLitude is POWer) and inner nodes (DISP:WIND:TRAC:Y:SCALe:RLEVel)
+    OPTIONAL_ROOT   = {'SENS', 'SOUR'}
+    OPTIONAL_LEAF   = {'LEV', 'IMM', 'AMPL', 'STAT', 'CW', 'FIX'}
+    OPTIONAL_INNER  = {'SCAL'}
+    # Cached settings (canonical header) and the settings they change on the instrument
+    SETTINGS    = {
+        # Spectrum analyzer
+        'FREQ:CENT'             : ('FREQ:STAR', 'FREQ:STOP'),
+        'FREQ:SPAN'             : ('FREQ:STAR', 'FREQ:STOP', 'BAND:RES', 'BAND:VID', 'SWE:TIME'),
+        'FREQ:STAR'             : ('FREQ:CENT', 'FREQ:SPAN', 'BAND:RES', 'BAND:VID', 'SWE:TIME'),
+        'FREQ:STOP'             : ('FREQ:CENT', 'FREQ:SPAN', 'BAND:RES', 'BAND:VID', 'SWE:TIME'),
+        'BAND:RES'              : ('BAND:RES:AUTO', 'BAND:VID', 'SWE:TIME'),
+        'BAND:RES:AUTO'         : ('BAND:RES', 'BAND:VID', 'SWE:TIME'),
+        'BAND:VID'              : ('BAND:VID:AUTO', 'SWE:TIME'),
+        'BAND:VID:AUTO'         : ('BAND:VID', 'SWE:TIME'),
+        'SWE:TIME'              : ('SWE:TIME:AUTO',),
+        'SWE:TIME:AUTO'         : ('SWE:TIME',),
+        'SWE:POIN'              : ('SWE:TIME',),
+        'DET'                   : ('DET:TRAC', 'DET:TRAC1', 'SWE:TIME'),
+        'DET:TRAC'              : ('DET', 'DET:TRAC1', 'SWE:TIME'),
+        'DET:TRAC1'             : ('DET', 'DET:TRAC', 'SWE:TIME'),
+        'TRAC:MODE'             : ('TRAC:TYPE', 'TRAC1:TYPE'),
+        'TRAC:TYPE'             : ('TRAC:MODE', 'TRAC1:TYPE'),
+        'TRAC1:TYPE'            : ('TRAC:MODE', 'TRAC:TYPE'),
+        'DISP:WIND:TRAC:Y:RLEV' : (),
+        'DISP:WIND:TRAC:Y:PDIV' : (),
+        'INIT:CONT'             : (),
+        # Signal generator
+        'FREQ'                  : (),
+        'POW'                   : (),
+        'OUTP'                  : (),
+        'OUTP:MOD'              : (),
+    }
+    # Commands that do not change any cached setting
+    NEUTRAL     = {'*CLS', '*OPC', '*WAI', '*SAV', '*ESE', '*SRE', '*TRG', 'INIT', 'ABOR',
+                   'CALC:MARK', 'CALC:MARK:MAX', 'CALC:MARK:MAX:NEXT', 'CALC:MARK:X',
+                   'FORM:TRAC:DATA', 'FORM:DATA', 'FORM:BORD'}
+
+    def __init__(self):
+        self.values         = {}
+        # Statistics
+        self.saved_writes   = 0
+        self.saved_queries  = 0
+
+    @property
+    def round_trips_saved(self) -> int:
+        return self.saved_writes + self.saved_queries
+
+    @classmethod
+    def canonical(cls, cmd: str) -> tuple:
+        """
+        Returns: (canonical header, normalized value or None for a query)
+        """
+        parts   = cmd.strip().split(None, 1)
+        header  = short_header(parts[0])
+        is_query = header.endswith('?')
+        nodes   = header.rstrip('?').split(':')
+        if len(nodes) > 1 and nodes[0] in cls.OPTIONAL_ROOT:
+            nodes = nodes[1:]
+        while len(nodes) > 1 and nodes[-1] in cls.OPTIONAL_LEAF:
+            nodes = nodes[:-1]
+        header  = ':'.join([n for n in nodes[:-1] if n not in cls.OPTIONAL_INNER] + nodes[-1:])
+        if is_query:
+            return header, None
+        value   = parts[1] if len(parts) > 1 else ''
+        return header, ' '.join(cls._normalize(v) for v in value.replace(',', ' ').split())
+
+    @staticmethod
+    def _normalize(token: str) -> str:
+        # Numbers compare by value (10 == 10.0 == 1e1), enumerations in short form (AVERage == AVER)
+        try:
+            return repr(float(token))
+        except ValueError:
+            return short_header(token) if token.isalpha() else token.upper()
+
+    def invalidate(self):
+        self.values.clear()
+
+    def write(self, cmd: str) -> bool:
+        """
+        Update the cache with a command about to be written.
+
+        Returns: False if the write is redundant and can be dropped
+        """
+        if ';' in cmd:
+            # Compound message, do not try to parse it
+            self.invalidate()
+            return True
+        header, value = self.canonical(cmd)
+        if header in self.SETTINGS:
+            if self.values.get(header) == value:
+                self.saved_writes += 1
+                return False
+            for coupled in self.SETTINGS[header]:
+                self.values.pop(coupled, None)
+            self.values[header] = value
+        elif header not in self.NEUTRAL:
+            self.invalidate()
+        return True
+
+    def query(self, cmd: str):
+        """
+        Returns: the cached response for a setting query (None if unknown)
+        """
+        header, _ = self.canonical(cmd)
+        value     = self.values.get(header)
+        # A value written with units ('100.0 MHZ') is not what the instrument would answer
+        if ';' in cmd or value is None or ' ' in value:
+            return None
+        self.saved_queries += 1
+        return value
+
+    def update(self, cmd: str, response: str):
+        """Cache the instrument response to a setting query."""
+        header, _ = self.canonical(cmd)
+        if ';' not in cmd and header in self.SETTINGS:
+            self.values[header] = ' '.join(self._normalize(v) for v in response.strip().split())
+
+
+class ErrorQueue:
+    """
+    Instrument error checking with a configurable policy:
+
+    - ``command`` : ``SYST:ERR?`` after every command (exact attribution, 2 round trips per write)
+    - ``batch``   : the commands of a ``group()`` are sent at its end as one program message
+                    with a ``*ESR?`` marker after every command (``CMD1;*ESR?;:CMD2;*ESR?``):
+                    a single round trip returns the event status of every command, the error
+                    queue is drained only if one of them reports an error. A write outside a
+                    group is sent at once and checked later (next group or ``check()``)
+    - ``manual``  : writes are sent at once, nothing is checked until ``check()`` is called
+
+    Reading ``*ESR?`` clears the register, so the marker after a command reports the events
+    of that command only: the errors of a group are tied to the commands that raised them
+    (in order, each flagged command raised at least one). The deferred checks of writes made
+    outside a group (one ``*OPC?;*ESR?`` for all of them) have no markers, their errors are
+    matched by the command header some instruments echo in the message (e.g.
+    ``-224,"Illegal parameter value;SENS:FREQ:SPAN"``), or reported against all of them.
+
+    Args:
+        instr:           pyvisa message based resource
+        log:             logger (defaults to the module logger)
+        policy:          'command', 'batch' or 'manual'
+        max_message_len: maximum length of a group program message with its markers (bytes)
+    """
+    POLICIES = ('command', 'batch', 'manual')
+
+    def __init__(self, instr, log=None, policy: str = 'batch', max_message_len: int = 1024):
+        self.instr      = instr
+        self.log        = log if log is not None else logger
+        self.policy     = None
+        self.set_policy(policy)
+        self.max_message_len = max_message_len
+        # Commands sent since the last check (bounded for the manual policy)
+        self.pending    = deque(maxlen=256)
+        # Commands of the open group, sent with their markers when it ends
+        self.buffer     = []
+        self.group_depth = 0
+        # Statistics
+        self.checks     = 0
+        self.errors     = []
+
+    def set_policy(self, policy: str):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Invalid error check policy: {policy}, expected one of {self.POLICIES}")
+        self.policy = policy
+
+    def write(self, cmd: str):
+        """Write a command, checked according to the policy (buffered inside a ``batch`` group)."""
+        if self.policy == 'batch' and self.group_depth > 0:
+            self.buffer.append(cmd)
+            return
+        self.instr.write(cmd)
+        self.sent(cmd)
+
+    def sent(self, cmd: str):
+        """Register a command that was just written to the instrument."""
+        if self.policy == 'command':
+            self.pending.clear()
+            self.pending.append(cmd)
+            self.checks += 1
+            self._drain()
+            return
+        # Checked with the next group or check()
+        self.pending.append(cmd)
+
+    @contextmanager
+    def group(self):
+        """Group commands, in ``batch`` mode they are sent and checked once on exit."""
+        self.group_depth += 1
+        try:
+            yield self
+        finally:
+            self.group_depth -= 1
+            if self.group_depth == 0 and self.policy == 'batch':
+                # Also checks the writes made before the group (check() if the group is empty)
+                self.flush() if self.buffer else self.check()
+
+    def flush(self) -> list:
+        """
+        Send the buffered group commands with their ``*ESR?`` markers (call before reading
+        from the instrument inside a group). Writes made outside the group before it are
+        checked by a leading marker of the same message.
+
+        Returns: list of (command, error code, error message) found
+        """
+        if not self.buffer:
+            return []
+        cmds, self.buffer = self.buffer, []
+        found   = []
+        # Culprit of every marker: the earlier deferred writes, then one per command
+        culprits = [self._attribute('') if self.pending else None]
+        msg     = '*ESR?' if self.pending else ''
+        for cmd in cmds:
+            chunk = join_program_message([msg, cmd, '*ESR?'])
+            if msg and len(chunk) > self.max_message_len:
+                found += self._send_marked(msg, culprits)
+                culprits, chunk = [], join_program_message([cmd, '*ESR?'])
+            msg = chunk
+            culprits.append(cmd)
+        found += self._send_marked(msg, culprits)
+        return found
+
+    def _send_marked(self, msg: str, culprits: list) -> list:
+        """Send a program message with markers, drain the errors if a marker reports one."""
+        self.checks += 1
+        status  = self.instr.query(msg).strip().replace(',', ';').split(';')
+        self.pending.clear()
+        culprits = [cmd for cmd in culprits if cmd is not None]
+        flagged = [cmd for cmd, esr in zip(culprits, status) if int(esr) & ESR_ERROR_MASK]
+        if not flagged:
+            return []
+        return self._drain(flagged)
+
+    def check(self) -> list:
+        """
+        Check the instrument status for errors caused by the pending commands.
+
+        Returns: list of (command, error code, error message) found by this check
+        """
+        if not self.pending:
+            return []
+        # Wait for all pending (overlapped) commands and read the event status in one round trip
+        self.checks += 1
+        status = self.instr.query("*OPC?;*ESR?").strip().replace(',', ';').split(';')
+        if int(status[-1]) & ESR_ERROR_MASK == 0:
+            self.pending.clear()
+            return []
+        return self._drain()
+
+    def _drain(self, flagged: list = None) -> list:
+        """
+        Read the error queue.
+
+        Args:
+            flagged: commands whose marker reported an error, in order (None: the pending
+                     commands, matched by the message)
+        """
+        errors  = []
+        for _ in range(32):
+            e = self.instr.query("SYST:ERR?").strip().split(',', 1)
+            code = int(e[0])
+            if code == 0:
+                break
+            errors.append((code, e[1].strip().strip('"') if len(e) > 1 else ''))
+        found   = []
+        for i, (code, msg) in enumerate(errors):
+            if flagged is None:
+                cmd = self._attribute(msg)
+            elif len(flagged) == 1 or len(flagged) == len(errors):
+                # One error per flagged command (in order), or all from the only one
+                cmd = flagged[min(i, len(flagged) - 1)]
+            else:
+                cmd = self._attribute(msg, flagged)
+            self.log.error(f"Error: {msg} (after '{cmd}')")
+            found.append((cmd, code, msg))
+        self.pending.clear()
+        self.errors.extend(found)
+        return found
+
+    def _attribute(self, msg: str, cmds=None) -> str:
+        """Find the command the error message refers to (among cmds, default the pending ones)."""
+        cmds = list(self.pending) if cmds is None else cmds
+        if len(cmds) == 1:
+            return cmds[0]
+        # The instrument context follows the ';' in the message
+        context = short_header(msg.split(';', 1)[1]) if ';' in msg else ''
+        if context:
+            for cmd in reversed(cmds):
+                # Either side may omit an optional node (SENSe)
+                header = short_header(cmd)
+                if header.endswith(context) or context.endswith(header):
+                    return cmd
+        return ' | '.join(cmds)
+
+
+class FastSCPIWrapper(SCPIWrapper):
+    """
+    SCPIWrapper that can coalesce writes into a single program message.
+
+    Inside ``with scpi.batch():`` writes are buffered and sent as one ``;:`` joined message
+    (one VXI-11 transaction instead of one per command). A message is split automatically
+    before it exceeds ``max_message_len`` bytes, and a query inside the batch flushes the
+    buffer first so the commands are executed in order.
+
+    With ``shadow=True`` writes that repeat the current value of a setting are dropped and
+    setting queries are answered from the ShadowState cache when the value is known.
+
+    Args (in addition to SCPIWrapper):
+        max_message_len: maximum length of a coalesced program message (bytes)
+        shadow:          enable the shadow state cache
+    """
+
+    def __init__(self, *args, max_message_len: int = 1024, shadow: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_message_len    = max_message_len
+        self.shadow             = ShadowState() if shadow else None
+        self._batch             = ''
+        self._batch_depth       = 0
+        # Statistics (commands written and program messages actually sent)
+        self.commands_sent      = 0
+        self.messages_sent      = 0
+
+    @contextmanager
+    def batch(self):
+        """Buffer writes and send them as coalesced program messages on exit."""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.flush()
+
+    @property
+    def round_trips_saved(self) -> int:
+        """SCPI transactions avoided by the shadow cache and the batches."""
+        saved = self.commands_sent - self.messages_sent
+        if self.shadow is not None:
+            saved += self.shadow.round_trips_saved
+        return saved
+
+    def invalidate(self):
+        """Forget the shadow state (after a change the wrapper could not see)."""
+        if self.shadow is not None:
+            self.shadow.invalidate()
+
+    def write(self, cmd: str, *args, **kwargs):
+        if self.shadow is not None and not self.shadow.write(cmd):
+            return None
+        self.commands_sent += 1
+        if self._batch_depth == 0:
+            self.messages_sent += 1
+            return super().write(cmd, *args, **kwargs)
+
+        msg = join_program_message([self._batch, cmd])
+        if self._batch and len(msg) > self.max_message_len:
+            self.flush()
+            msg = cmd.strip()
+        self._batch = msg
+
+    def query(self, cmd: str, *args, **kwargs):
+        # Only plain queries (string response) are answered from the cache
+        is_cached = self.shadow is not None and not args and not kwargs
+        if is_cached:
+            value = self.shadow.query(cmd)
+            if value is not None:
+                return value
+        self.flush()
+        response = super().query(cmd, *args, **kwargs)
+        if is_cached:
+            self.shadow.update(cmd, response)
+        return response
+
+    def flush(self):
+        """Send the buffered commands (if any) as one program message."""
+        if not self._batch:
+            return
+        msg         = self._batch
+        self._batch = ''
+        self.messages_sent += 1
+        super().write(msg)
@@ -0,0 +1,248 @@
+"""
+Several SA/SG benches driven in parallel from one PC.
+
+SCPIWrapper.connect and the application classes own one analyzer and one generator and
+run their loop on one thread, so a second bench waits for every round trip and sweep of
+the first. A SessionManager gives every bench a worker of its own (a thread, or a
+process with a private ResourceManager for CPU heavy loops) and its own VISA sessions:
+the benches only share the host CPU, their progress and results come back through one
+queue. A bench that times out or fails is reported as such, the others keep running.
+
+The measurement of a bench is a plain function (module level in process mode, it is
+pickled):
+
+    def measure(name, scpi_sa, scpi_sg, progress):
+        ...
+        progress(50)                # percent, reported as (name, 50)
+        return result               # picklable in process mode
+
+    manager = SessionManager([BenchSession('bench1', sa_resource, sg_resource), ...],
+                             measure, workers='thread', timeout=600.0, log=log)
+    results = manager.run(on_progress=lambda name, value, total: log.info(f"{name} {value}%"))
+    for r in results.values():
+        log.info(f"{r.name}: {r.status} in {r.elapsed:.1f} s")
+
+With ``workers='asyncio'`` all the benches run as coroutines of one event loop thread
+on rf_perf.aioscpi connections (no thread per bench), measure is then a coroutine
+function getting AsyncSCPIWrappers:
+
+    async def measure(name, sa, sg, progress):
+        await sg.write("freq 900 MHz")
+        return float(await sa.query("CALCulate:MARKer:Y?"))
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# VISA resource strings of a bench (None: instrument not used)
+BenchSession = namedtuple('BenchSession', ['name', 'sa', 'sg'])
+# status: 'done', 'error' or 'timeout'
+BenchResult  = namedtuple('BenchResult', ['name', 'status', 'result', 'error', 'elapsed'])
+
+
+def run_session(session: BenchSession, measure, events, shadow: bool = False, timeout_ms: int = 10000):
+    """
+    Worker body: open the bench sessions, run the measurement and report to the events
+    queue.
+
+    Args:
+        session:    BenchSession
+        measure:    measure(name, scpi_sa, scpi_sg, progress) -> result
+        events:     queue of (name, kind, payload) tuples, kind 'progress' or 'result'
+        shadow:     FastSCPIWrapper shadow state cache
+        timeout_ms: VISA timeout of every session (a dead instrument fails this bench only)
+    """
+    import pyvisa
+    from rf_perf.scpi import FastSCPIWrapper
+
+    t_start = time.perf_counter()
+    log     = logging.getLogger(f"{__name__}.{session.name}")
+    # pyvisa keeps one ResourceManager per process: private to a process worker, shared
+    # by the thread workers (each with its own sessions, closed here and not the manager)
+    rm      = pyvisa.ResourceManager('@py')
+    instrs  = []
+    try:
+        scpi = {}
+        for kind in ('sa', 'sg'):
+            resource = getattr(session, kind)
+            if resource is None:
+                scpi[kind] = None
+                continue
+            instr       = rm.open_resource(resource, read_termination='\n', write_termination='\n',
+                                           timeout=timeout_ms)
+            instrs.append(instr)
+            scpi[kind]  = FastSCPIWrapper(instr=instr, log=log, name=f"{session.name} {kind.upper()}",
+                                          shadow=shadow)
+        result  = measure(session.name, scpi['sa'], scpi['sg'],
+                          lambda value: events.put((session.name, 'progress', value)))
+        events.put((session.name, 'result', BenchResult(session.name, 'done', result, None,
+                                                        time.perf_counter() - t_start)))
+    except Exception as e:
+        log.error(f"{session.name}: {type(e).__name__}: {e}")
+        events.put((session.name, 'result', BenchResult(session.name, 'error', None, f"{type(e).__name__}: {e}",
+                                                        time.perf_counter() - t_start)))
+    finally:
+        for instr in instrs:
+            instr.close()
+
+
+async def run_session_async(session: BenchSession, measure, events, timeout: float = None,
+                            timeout_ms: int = 10000):
+    """
+    Coroutine worker body: open asyncio connections to the bench (AsyncSCPIWrapper), run
+    the measurement coroutine and report to the events queue.
+
+    Args:
+        session:    BenchSession
+        measure:    coroutine function measure(name, sa, sg, progress) -> result
+        events:     queue of (name, kind, payload) tuples, kind 'progress' or 'result'
+        timeout:    time limit of the measurement (s), it is cancelled after that
+        timeout_ms: response timeout of every query
+    """
+    from rf_perf.aioscpi import AsyncSCPIWrapper
+
+    t_start = time.perf_counter()
+    log     = logging.getLogger(f"{__name__}.{session.name}")
+    scpi    = {}
+    try:
+        for kind in ('sa', 'sg'):
+            resource    = getattr(session, kind)
+            scpi[kind]  = None if resource is None else await AsyncSCPIWrapper.connect(
+                resource, log=log, name=f"{session.name} {kind.upper()}", timeout=timeout_ms/1000)
+        result  = await asyncio.wait_for(measure(session.name, scpi['sa'], scpi['sg'],
+                                                 lambda value: events.put((session.name, 'progress', value))),
+                                         timeout)
+        status  = BenchResult(session.name, 'done', result, None, time.perf_counter() - t_start)
+    except asyncio.TimeoutError:
+        status  = BenchResult(session.name, 'timeout', None, f"No result after {timeout} s",
+                              time.perf_counter() - t_start)
+    except Exception as e:
+        log.error(f"{session.name}: {type(e).__name__}: {e}")
+        status  = BenchResult(session.name, 'error', None, f"{type(e).__name__}: {e}", time.perf_counter() - t_start)
+    finally:
+        for client in scpi.values():
+            if client is not None:
+                await client.close()
+    events.put((session.name, 'result', status))
+
+
+class SessionManager:
+    """
+    Args:
+        sessions:   [BenchSession]
+        measure:    measure(name, scpi_sa, scpi_sg, progress) -> result
+        workers:    'thread' (one thread per bench, the I/O waits release the GIL),
+                    'process' (one process per bench, spawned) or 'asyncio' (all the
+                    benches in one event loop thread, measure is a coroutine function
+                    getting AsyncSCPIWrapper connections)
+        timeout:    time limit of the whole run (s), the benches still running are
+                    reported as 'timeout' (their processes are terminated, their threads
+                    are abandoned as daemons)
+        shadow:     FastSCPIWrapper shadow state cache
+        timeout_ms: VISA timeout of every session
+        log:        logger (defaults to the module logger)
+    """
+
+    def __init__(self, sessions, measure, workers: str = 'thread', timeout: float = None, shadow: bool = False,
+                 timeout_ms: int = 10000, log=None):
+        if workers not in ('thread', 'process', 'asyncio'):
+            raise ValueError(f"workers must be 'thread', 'process' or 'asyncio', not {workers!r}")
+        names = [s.name for s in sessions]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Bench names must be unique: {names}")
+        self.sessions   = list(sessions)
+        self.measure    = measure
+        self.workers    = workers
+        self.timeout    = timeout
+        self.shadow     = shadow
+        self.timeout_ms = timeout_ms
+        self.log        = log if log is not None else logger
+        # Last progress value of every bench
+        self.progress   = {}
+        self.results    = {}
+        self.elapsed    = None
+        # Event queue poll period (s), the liveness of the workers is checked in between
+        self.poll       = 0.5
+
+    def _start(self) -> tuple:
+        """Returns: ({name: worker}, events queue)"""
+        if self.workers == 'thread':
+            events  = queue.Queue()
+            start   = lambda s: threading.Thread(target=run_session, name=s.name, daemon=True,
+                                                 args=(s, self.measure, events, self.shadow, self.timeout_ms))
+        elif self.workers == 'asyncio':
+            events  = queue.Queue()
+            loop    = threading.Thread(target=lambda: asyncio.run(self._run_async(events)), name='sessions',
+                                       daemon=True)
+            loop.start()
+            # One thread for all the benches
+            return {s.name: loop for s in self.sessions}, events
+        else:
+            context = multiprocessing.get_context('spawn')
+            events  = context.Queue()
+            start   = lambda s: context.Process(target=run_session, name=s.name, daemon=True,
+                                                args=(s, self.measure, events, self.shadow, self.timeout_ms))
+        workers = {s.name: start(s) for s in self.sessions}
+        for worker in workers.values():
+            worker.start()
+        return workers, events
+
+    async def _run_async(self, events):
+        await asyncio.gather(*(run_session_async(s, self.measure, events, self.timeout, self.timeout_ms)
+                               for s in self.sessions))
+
+    def run(self, on_progress=None) -> dict:
+        """
+        Run every bench and wait for all of them (or the timeout).
+
+        Args:
+            on_progress: on_progress(name, value, total) on every progress report, total is
+                         the mean progress of all the benches
+        Returns: {name: BenchResult} in the order of the sessions
+        """
+        t_start         = time.perf_counter()
+        self.progress   = {s.name: 0 for s in self.sessions}
+        self.results    = {}
+        workers, events = self._start()
+        deadline        = None if self.timeout is None else t_start + self.timeout
+
+        while len(self.results) < len(self.sessions):
+            wait = self.poll if deadline is None else min(deadline - time.perf_counter(), self.poll)
+            if wait <= 0:
+                break
+            try:
+                name, kind, payload = events.get(timeout=wait)
+            except queue.Empty:
+                # A process killed or crashed (exit code != 0) never posts its result
+                for s in self.sessions:
+                    if s.name not in self.results and getattr(workers[s.name], 'exitcode', None):
+                        self.results[s.name] = BenchResult(s.name, 'error', None, "Worker exited without a result",
+                                                           time.perf_counter() - t_start)
+                        self.log.error(f"{s.name}: worker exited without a result")
+                continue
+            if kind == 'progress':
+                self.progress[name] = payload
+                if on_progress is not None:
+                    on_progress(name, payload, sum(self.progress.values())/len(self.progress))
+            else:
+                self.results[name] = payload
+                self.log.info(f"{name}: {payload.status} in {payload.elapsed:.2f} s")
+
+        # Benches past the deadline (a dead instrument, a hung measurement)
+        for s in self.sessions:
+            if s.name not in self.results:
+                self.results[s.name] = BenchResult(s.name, 'timeout', None, f"No result after {self.timeout} s",
+                                                   time.perf_counter() - t_start)
+                self.log.warning(f"{s.name}: timeout")
+                if self.workers == 'process':
+                    workers[s.name].terminate()
+        for worker in workers.values():
+            worker.join(timeout=1.0)
+        self.elapsed = time.perf_counter() - t_start
+        return {s.name: self.results[s.name] for s in self.sessions}
@@ -0,0 +1,9 @@
+"""
+Simulated instruments for offline benchmarking.
+
+- ``rf_perf.sim.instruments``: SCPI spectrum analyzer and signal generator models
+- ``rf_perf.sim.dut``        : synthetic devices under test (Rapp PA, band pass filter)
+- ``rf_perf.sim.server``     : raw socket SCPI server and the SG -> DUT -> SA bench
+
+Run the bench with ``python -m rf_perf.sim.server --help``.
+"""
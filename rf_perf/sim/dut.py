@@ -0,0 +1,152 @@
+"""
+Synthetic devices under test placed between the simulated generator and analyzer.
+
+A signal is a list of tones ``(frequency Hz, power dBm)``. A DUT maps the tones at its
+input to the tones at its output:
+
+- Through:      fixed loss (cables and attenuators)
+- BandpassDut:  Butterworth band pass response (the ex5 filter scan)
+- PaDut:        Rapp model amplifier, the compression and the odd order intermodulation
+                products (IM3, IM5, ...) of a multi-tone input follow from the AM/AM curve
+"""
+import numpy as np
+
+
+def dbm_to_w(p_dbm):
+    return 10.0**((np.asarray(p_dbm) - 30.0)/10.0)
+
+
+def w_to_dbm(p_w):
+    return 10.0*np.log10(np.maximum(p_w, 1e-30)) + 30.0
+
+
+class Through:
+    """
+    Args:
+        loss: dB
+    """
+
+    def __init__(self, loss: float = 0.0):
+        self.loss = loss
+
+    def apply(self, tones: list) -> list:
+        return [(f, p - self.loss) for f, p in tones]
+
+
+class BandpassDut(Through):
+    """
+    Band pass filter, |H(f)|^2 = 1 / (1 + (Q*(f/f0 - f0/f))^(2n)) with Q = f0/bw.
+
+    Args:
+        f0:    center frequency (Hz)
+        bw:    3 dB bandwidth (Hz)
+        order: filter order
+        loss:  insertion loss (dB)
+    """
+
+    def __init__(self, f0: float = 900e6, bw: float = 40e6, order: int = 3, loss: float = 1.5):
+        super().__init__(loss)
+        self.f0     = f0
+        self.bw     = bw
+        self.order  = order
+
+    def response(self, f) -> np.ndarray:
+        """Transfer function in dB (insertion loss included)."""
+        f = np.maximum(np.asarray(f, dtype=float), 1.0)
+        x = (self.f0/self.bw)*(f/self.f0 - self.f0/f)
+        return -10.0*np.log10(1.0 + x**(2*self.order)) - self.loss
+
+    def apply(self, tones: list) -> list:
+        if not tones:
+            return []
+        f = np.array([t[0] for t in tones])
+        p = np.array([t[1] for t in tones]) + self.response(f)
+        return list(zip(f.tolist(), p.tolist()))
+
+
+class PaDut(Through):
+    """
+    Memoryless amplifier, Rapp AM/AM model:
+        |y| = G|x| / (1 + (G|x|/Vsat)^(2p))^(1/(2p))
+
+    The gain and the saturated power drift linearly with frequency so that a scan has
+    something to show. Tones closer than ``group_bw`` are amplified together (the
+    intermodulation products of a two tone signal fall on the same grid).
+
+    Args:
+        gain:       small signal gain at f0 (dB)
+        gain_slope: gain change (dB/GHz)
+        psat:       saturated output power at f0 (dBm)
+        psat_slope: saturated power change (dB/GHz)
+        p:          Rapp smoothness factor
+        f0:         reference frequency of the slopes (Hz)
+        loss:       output loss (dB), the attenuator in front of the analyzer
+        orders:     highest intermodulation order reported
+        group_bw:   widest tone spacing amplified as one signal (Hz)
+    """
+
+    def __init__(self, gain: float = 30.0, gain_slope: float = -2.0, psat: float = 17.0,
+                 psat_slope: float = -1.5, p: float = 2.0, f0: float = 1.1e9, loss: float = 0.0,
+                 orders: int = 7, group_bw: float = 100e6):
+        super().__init__(loss)
+        self.gain       = gain
+        self.gain_slope = gain_slope
+        self.psat       = psat
+        self.psat_slope = psat_slope
+        self.p          = p
+        self.f0         = f0
+        self.orders     = orders
+        self.group_bw   = group_bw
+
+    def gain_at(self, f: float) -> float:
+        return self.gain + self.gain_slope*(f - self.f0)*1e-9
+
+    def psat_at(self, f: float) -> float:
+        return self.psat + self.psat_slope*(f - self.f0)*1e-9
+
+    def am_am(self, v_in: np.ndarray, f: float) -> np.ndarray:
+        """Output envelope amplitude (sqrt W) of the input envelope amplitude (sqrt W)."""
+        v       = 10.0**(self.gain_at(f)/20.0)*v_in
+        v_sat   = np.sqrt(dbm_to_w(self.psat_at(f)))
+        return v/(1.0 + (v/v_sat)**(2*self.p))**(1.0/(2*self.p))
+
+    def apply(self, tones: list) -> list:
+        out = []
+        for group in self._groups(tones):
+            out.extend(self._amplify(group))
+        return [(f, p - self.loss) for f, p in out]
+
+    def _groups(self, tones: list) -> list:
+        groups = []
+        for f, p in sorted(tones):
+            if groups and f - groups[-1][-1][0] < self.group_bw:
+                groups[-1].append((f, p))
+            else:
+                groups.append([(f, p)])
+        return groups
+
+    def _amplify(self, group: list) -> list:
+        f       = np.array([t[0] for t in group])
+        a       = np.sqrt(dbm_to_w([t[1] for t in group]))
+        fc      = 0.5*(f.min() + f.max())
+        if len(group) == 1:
+            return [(float(f[0]), float(w_to_dbm(self.am_am(a, fc)[0]**2)))]
+
+        # Complex envelope of the tones on a common frequency grid, one period long
+        df      = np.min(np.diff(f))
+        k       = np.round((f - fc)/(df/2)).astype(int)
+        n_fft   = 1 << int(np.ceil(np.log2(4*(np.abs(k).max() + self.orders + 1))))
+        spec    = np.zeros(n_fft, dtype=complex)
+        spec[k % n_fft] = a
+        x       = np.fft.ifft(spec)*n_fft
+        # AM/AM on the envelope magnitude, the phase is kept
+        mag     = np.abs(x)
+        y       = np.where(mag > 0, self.am_am(mag, fc)/np.maximum(mag, 1e-30), 0.0)*x
+        out     = np.fft.fft(y)/n_fft
+
+        # Input tones and the products up to the requested order
+        span    = np.abs(k).max() + (self.orders - 1)*np.abs(np.diff(k)).min()//2
+        bins    = np.arange(-span, span + 1)
+        p_out   = np.abs(out[bins % n_fft])**2
+        keep    = p_out > 1e-25
+        return list(zip((fc + bins[keep]*df/2).tolist(), w_to_dbm(p_out[keep]).tolist()))
@@ -0,0 +1,725 @@
+"""
+Simulated SCPI instruments: a swept spectrum analyzer and a CW/two tone signal generator.
+
+Only the SCPI subset used by the course applications is implemented, but it is parsed
+the way an instrument does it: long and short header forms, optional nodes (SENSe,
+SOURce, IMMediate, ...), numeric suffixes, units, compound ``;`` program messages with
+relative headers, the IEEE 488.2 status system (*ESR?, *ESE, *SRE, *OPC) and the error
+queue (SYST:ERR?).
+
+The analyzer sweeps in simulated real time. The sweep time follows the swept analyzer
+rule t = k*span/(RBW*min(RBW, VBW)) (scaled by ``time_scale``), and every trace bin is
+rendered from the signal present at its own time in the sweep, so a generator that moves
+during a sweep shows up in the trace the way it would on the bench.
+
+A program message takes effect at the time given to ``execute()`` (``now``), the server
+passes its modelled arrival and processing time: the state changes do not depend on when
+the thread serving the socket gets to run.
+"""
+import bisect
+import copy
+import math
+import re
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+from rf_perf.scpi import short_header
+from rf_perf.sim.dut import Through, dbm_to_w, w_to_dbm
+
+# Optional nodes removed from the canonical header
+OPTIONAL    = {'LEV', 'IMM', 'AMPL', 'STAT', 'SCAL', 'CW', 'FIX', 'DATA', 'FUNC'}
+# Optional root nodes (SOURce is also a leaf, e.g. TRIGger:SOURce)
+OPTIONAL_ROOT = {'SENS', 'SOUR'}
+# Unit multipliers (the SCPI 'M' prefix is milli, mega is 'MA' or spelled out as MHZ)
+UNITS       = {'': 1.0, 'HZ': 1.0, 'KHZ': 1e3, 'MHZ': 1e6, 'MAHZ': 1e6, 'GHZ': 1e9,
+               'S': 1.0, 'MS': 1e-3, 'US': 1e-6, 'NS': 1e-9, 'DBM': 1.0, 'DB': 1.0}
+
+
+class ScpiError(Exception):
+    """SCPI error reported through the error queue (code, message)."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f'{code},"{message}"')
+        self.code = code
+
+
+def canonical(header: str) -> str:
+    """
+    Canonical header: short form, numeric suffixes and optional nodes removed,
+    e.g. ':SENSe:BANDwidth:RESolution' -> 'BAND:RES', 'CALC1:MARK1:Y?' -> 'CALC:MARK:Y?'.
+    """
+    header      = short_header(header)
+    is_query    = header.endswith('?')
+    if header.startswith('*'):
+        return header
+    nodes       = [re.sub(r'\d+$', '', n) for n in header.rstrip('?').split(':')]
+    if nodes[0] in OPTIONAL_ROOT:
+        nodes   = nodes[1:]
+    return ':'.join(n for n in nodes if n and n not in OPTIONAL) + ('?' if is_query else '')
+
+
+def parse_number(text: str) -> float:
+    m = re.fullmatch(r'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([A-Za-z]*)\s*', text)
+    if m is None or m.group(2).upper() not in UNITS:
+        raise ScpiError(-224, "Illegal parameter value")
+    return float(m.group(1))*UNITS[m.group(2).upper()]
+
+
+def parse_bool(text: str) -> bool:
+    token = text.strip().upper()
+    if token in ('ON', '1'):
+        return True
+    if token in ('OFF', '0'):
+        return False
+    raise ScpiError(-224, "Illegal parameter value")
+
+
+def parse_enum(text: str, choices: tuple) -> str:
+    """Match a long/short form mnemonic ('AVERage' accepts AVER, AVERAG, AVERAGE)."""
+    token = text.strip().upper()
+    for choice in choices:
+        short = ''.join(c for c in choice if c.isupper() or c.isdigit())
+        if token.startswith(short) and choice.upper().startswith(token):
+            return short
+    raise ScpiError(-224, "Illegal parameter value")
+
+
+def split_message(msg: str) -> list:
+    """Split a program message on ';' (outside of quoted strings)."""
+    parts, quote, start = [], None, 0
+    for i, c in enumerate(msg):
+        if c in '"\'':
+            quote = None if quote == c else (c if quote is None else quote)
+        elif c == ';' and quote is None:
+            parts.append(msg[start:i])
+            start = i + 1
+    parts.append(msg[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+class SimInstrument:
+    """
+    SCPI parser, status system and error queue shared by the simulated instruments.
+
+    Settings are kept in ``self.state`` under their canonical header. ``PARAMS`` lists
+    the settings (kind and *RST value), a kind is 'num', 'int', 'bool', 'list' (comma
+    separated numbers) or a tuple of enumeration mnemonics. ``ACTIONS`` maps the other headers to methods.
+    ``LIMITS`` holds the (min, max) range of numeric settings, also answered to ``<query>? MIN|MAX``.
+    """
+    IDN     = "Simulated,Instrument,SIM0001,1.0"
+    PARAMS  = {}
+    LIMITS  = {}
+    ALIASES = {}
+    ACTIONS = {
+        '*IDN?' : 'idn',        '*RST'  : 'rst',        '*CLS'  : 'cls',
+        '*OPC'  : 'opc',        '*OPC?' : 'opc_query',  '*WAI'  : 'wait',
+        '*ESR?' : 'esr_query',  '*ESE'  : 'ese_set',    '*ESE?' : 'ese_query',
+        '*SRE'  : 'sre_set',    '*SRE?' : 'sre_query',  '*STB?' : 'stb_query',
+        '*SAV'  : 'sav',        '*RCL'  : 'rcl',
+        'SYST:ERR?' : 'error_query', 'SYST:ERR:NEXT?' : 'error_query',
+    }
+
+    def __init__(self, seed: int = 0):
+        self.lock       = threading.RLock()
+        self.rng        = np.random.default_rng(seed)
+        self.errors     = deque(maxlen=32)
+        self.esr        = 0
+        self.ese        = 0
+        self.sre        = 0
+        self.saved      = {}
+        self.state      = {}
+        # Time (perf_counter) of the program message being executed
+        self.now        = time.perf_counter()
+        # Statistics: commands executed by canonical header
+        self.counts     = Counter()
+        self.rst()
+
+    # Program message execution
+    def execute(self, msg: str, t: float = None):
+        """
+        Execute one program message.
+
+        Args:
+            msg: program message
+            t:   time (perf_counter) the message takes effect, default now
+        Returns: response (str, or bytes if it contains a binary block), None for no response
+        """
+        responses = []
+        path      = []
+        with self.lock:
+            self.now = time.perf_counter() if t is None else t
+            for part in split_message(msg):
+                header, _, args = part.partition(' ')
+                if header.startswith(':'):
+                    nodes   = header[1:].split(':')
+                elif header.startswith('*'):
+                    nodes   = [header]
+                else:
+                    # Relative header, continues from the path of the previous command
+                    nodes   = path + header.split(':')
+                if not header.startswith('*'):
+                    path    = nodes[:-1]
+                try:
+                    response = self.dispatch(canonical(':'.join(nodes)), args.strip())
+                except ScpiError as e:
+                    self.push_error(e.code, str(e).split(',', 1)[1].strip('"'))
+                    continue
+                if response is not None:
+                    responses.append(response)
+        if not responses:
+            return None
+        if any(isinstance(r, bytes) for r in responses):
+            return b';'.join(r if isinstance(r, bytes) else r.encode() for r in responses)
+        return ';'.join(responses)
+
+    def dispatch(self, header: str, args: str):
+        self.update()
+        header = self.ALIASES.get(header, header)
+        self.counts[header] += 1
+        if header in self.ACTIONS:
+            return getattr(self, self.ACTIONS[header])(args)
+        if header.rstrip('?') in self.PARAMS:
+            name = header.rstrip('?')
+            if header.endswith('?'):
+                limit = args.upper()[:3]
+                if limit in ('MIN', 'MAX') and name in self.LIMITS:
+                    return str(self.LIMITS[name][limit == 'MAX'])
+                return self.format(name)
+            if not args:
+                raise ScpiError(-109, "Missing parameter")
+            self.set(name, self.parse(name, args))
+            return None
+        raise ScpiError(-113, "Undefined header")
+
+    def parse(self, name: str, args: str):
+        kind = self.PARAMS[name][0]
+        if kind == 'num':
+            return parse_number(args)
+        if kind == 'int':
+            return int(round(parse_number(args)))
+        if kind == 'bool':
+            return parse_bool(args)
+        if kind == 'list':
+            return [parse_number(v) for v in args.split(',')]
+        return parse_enum(args.split(',')[0], kind)
+
+    def format(self, name: str) -> str:
+        value = self.state[name]
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        if isinstance(value, float):
+            return repr(float(value))
+        if isinstance(value, list):
+            return ','.join(repr(float(v)) for v in value)
+        return str(value)
+
+    def set(self, name: str, value):
+        self.state[name] = value
+
+    def push_error(self, code: int, message: str):
+        self.errors.append(f'{code},"{message}"')
+        # Command errors (-1xx) set CME, the others EXE
+        self.esr |= 32 if -200 < code <= -100 else 16
+
+    def update(self):
+        """Advance the simulated time (end of a running operation)."""
+
+    # Common commands
+    def idn(self, args):
+        return self.IDN
+
+    def rst(self, args=''):
+        self.state = {name: default for name, (kind, default) in self.PARAMS.items()}
+
+    def cls(self, args):
+        self.errors.clear()
+        self.esr = 0
+
+    def opc(self, args):
+        self.esr |= 1
+
+    def opc_query(self, args):
+        self.wait(args)
+        return '1'
+
+    def wait(self, args):
+        pass
+
+    def esr_query(self, args):
+        value, self.esr = self.esr, 0
+        return str(value)
+
+    def ese_set(self, args):
+        self.ese = int(parse_number(args)) & 0xFF
+
+    def ese_query(self, args):
+        return str(self.ese)
+
+    def sre_set(self, args):
+        self.sre = int(parse_number(args)) & 0xBF
+
+    def sre_query(self, args):
+        return str(self.sre)
+
+    def stb_query(self, args):
+        stb = (4 if self.errors else 0) | (32 if self.esr & self.ese else 0)
+        return str(stb | (64 if stb & self.sre else 0))
+
+    def sav(self, args):
+        self.saved[int(parse_number(args or '0'))] = copy.deepcopy(self.state)
+
+    def rcl(self, args):
+        register = int(parse_number(args or '0'))
+        if register not in self.saved:
+            raise ScpiError(-224, "Illegal parameter value")
+        self.state = copy.deepcopy(self.saved[register])
+
+    def error_query(self, args):
+        return self.errors.popleft() if self.errors else '0,"No error"'
+
+
+class SimGenerator(SimInstrument):
+    """
+    Signal generator. With the modulation on it plays a two tone signal (the course
+    applications download it with pyarbtools) of the same total power.
+
+    List sweep: with FREQ:MODE LIST (and/or POW:MODE LIST) INIT outputs the first point of
+    LIST:FREQ / LIST:POW and every *TRG (LIST:TRIG:SOUR BUS) steps to the next one. The
+    external trigger input is not modelled.
+
+    Args:
+        tone_spacing: two tone spacing (Hz)
+        settle:       output muted after a frequency change (s)
+        seed:         random seed
+    """
+    IDN     = "Simulated,SG-1,SIM0002,1.0"
+    TRIGGERS = ('IMMediate', 'BUS', 'EXTernal', 'KEY')
+    PARAMS  = {
+        'FREQ'          : ('num' , 1e9),
+        'POW'           : ('num' , -20.0),
+        'OUTP'          : ('bool', False),
+        'OUTP:MOD'      : ('bool', False),
+        'FREQ:MODE'     : (('CW', 'FIXed', 'LIST'), 'CW'),
+        'POW:MODE'      : (('FIXed', 'LIST'), 'FIX'),
+        'LIST:TYPE'     : (('LIST', 'STEP'), 'STEP'),
+        'LIST:FREQ'     : ('list', []),
+        'LIST:POW'      : ('list', []),
+        'LIST:TRIG:SOUR': (TRIGGERS, 'IMM'),
+        'TRIG:SOUR'     : (TRIGGERS, 'IMM'),
+        'INIT:CONT'     : ('bool', False),
+    }
+    ACTIONS = {
+        **SimInstrument.ACTIONS,
+        'INIT'  : 'initiate',   '*TRG'  : 'trigger',    'TRIG'  : 'trigger',
+        'LIST:FREQ:POIN?' : 'list_freq_points', 'LIST:POW:POIN?' : 'list_pow_points',
+    }
+
+    def __init__(self, tone_spacing: float = 4e6, settle: float = 0.001, seed: int = 0):
+        self.tone_spacing   = tone_spacing
+        self.settle         = settle
+        # Output tones history [(time, tones)] read by the analyzers
+        self.history        = deque(maxlen=1024)
+        # Current list point (None while the list sweep is not initiated)
+        self.list_index     = None
+        super().__init__(seed)
+
+    def is_list(self) -> bool:
+        return self.state['FREQ:MODE'] == 'LIST' or self.state['POW:MODE'] == 'LIST'
+
+    def tones(self) -> list:
+        if not self.state['OUTP']:
+            return []
+        f, p = self.state['FREQ'], self.state['POW']
+        if self.list_index is not None and self.is_list():
+            if self.state['FREQ:MODE'] == 'LIST':
+                f = self.state['LIST:FREQ'][self.list_index]
+            if self.state['POW:MODE'] == 'LIST':
+                p = self.state['LIST:POW'][self.list_index]
+        if self.state['OUTP:MOD']:
+            d = self.tone_spacing/2
+            return [(f - d, p - 3.0103), (f + d, p - 3.0103)]
+        return [(f, p)]
+
+    def set(self, name: str, value):
+        changed = self.state.get(name) != value
+        super().set(name, value)
+        if changed:
+            if name in ('FREQ:MODE', 'POW:MODE', 'LIST:FREQ', 'LIST:POW'):
+                self.list_index = None
+            self.record(muted=name in ('FREQ', 'FREQ:MODE'))
+
+    def rst(self, args=''):
+        super().rst(args)
+        self.list_index = None
+        self.record()
+
+    def rcl(self, args):
+        super().rcl(args)
+        self.list_index = None
+        self.record(muted=True)
+
+    def list_length(self) -> int:
+        lengths = {len(self.state[f'LIST:{name}']) for name, mode in (('FREQ', 'FREQ:MODE'), ('POW', 'POW:MODE'))
+                   if self.state[mode] == 'LIST'}
+        if len(lengths) != 1 or 0 in lengths:
+            raise ScpiError(-221, "Settings conflict")
+        return lengths.pop()
+
+    def initiate(self, args):
+        if not self.is_list():
+            return
+        self.list_length()
+        self.list_index = 0
+        self.record(muted=True)
+
+    def trigger(self, args):
+        if self.list_index is None or self.state['LIST:TRIG:SOUR'] != 'BUS':
+            raise ScpiError(-211, "Trigger ignored")
+        if self.list_index + 1 < self.list_length():
+            self.list_index += 1
+        elif self.state['INIT:CONT']:
+            self.list_index = 0
+        else:
+            return
+        self.record(muted=self.state['FREQ:MODE'] == 'LIST')
+
+    def list_freq_points(self, args):
+        return str(len(self.state['LIST:FREQ']))
+
+    def list_pow_points(self, args):
+        return str(len(self.state['LIST:POW']))
+
+    def record(self, muted: bool = False):
+        now = self.now
+        if muted and self.settle > 0:
+            self.history.append((now, []))
+            now += self.settle
+        self.history.append((now, self.tones()))
+
+    def tones_at(self, t: float) -> list:
+        with self.lock:
+            times = [h[0] for h in self.history]
+            i     = bisect.bisect_right(times, t) - 1
+            return self.history[max(i, 0)][1] if self.history else []
+
+    def changes(self, t0: float, t1: float) -> list:
+        """Times of the output changes in (t0, t1)."""
+        with self.lock:
+            return [t for t, _ in self.history if t0 < t < t1]
+
+
+class SignalPath:
+    """
+    Analyzer input: generator -> DUT, plus fixed CW tones.
+
+    Args:
+        generator: SimGenerator or None
+        dut:       device under test (``apply(tones) -> tones``)
+        tones:     extra CW tones [(frequency Hz, power dBm)]
+    """
+
+    def __init__(self, generator: SimGenerator = None, dut=None, tones=()):
+        self.generator  = generator
+        self.dut        = dut if dut is not None else Through()
+        self.tones      = list(tones)
+
+    def at(self, t: float) -> list:
+        tones = self.dut.apply(self.generator.tones_at(t)) if self.generator is not None else []
+        return tones + self.tones
+
+    def changes(self, t0: float, t1: float) -> list:
+        return self.generator.changes(t0, t1) if self.generator is not None else []
+
+
+class SimAnalyzer(SimInstrument):
+    """
+    Swept spectrum analyzer. Span 0 is the zero span (time domain) mode: every bin is
+    the power at the center frequency at its own time, the RBW keeps its value.
+
+    Args:
+        source:     SignalPath of the analyzer input
+        time_scale: simulated sweep time / modelled sweep time (< 1 runs faster than the bench)
+        k_sweep:    sweep time factor of t = k*span/(RBW*min(RBW, VBW))
+        min_sweep:  shortest sweep time (s)
+        fft_rbw:    RBW below which the analyzer switches to FFT analysis (Hz)
+        fft_span:   span analyzed by one FFT (Hz)
+        danl:       displayed average noise level (dBm/Hz)
+        f_max:      upper frequency limit (Hz)
+        seed:       random seed
+    """
+    IDN         = "Simulated,SA-1,SIM0001,1.0"
+    DETECTORS   = ('AVERage', 'POSitive', 'NEGative', 'SAMPle', 'RMS', 'NORMal', 'QPEak',
+                   'EAVerage', 'RAVerage')
+    TRACE_MODES = ('WRITe', 'MAXHold', 'MINHold', 'AVERage', 'VIEW', 'BLANk')
+    PARAMS  = {
+        'FREQ:CENT'             : ('num' , 3e9),
+        'FREQ:SPAN'             : ('num' , 6e9),
+        'BAND:RES'              : ('num' , 3e6),
+        'BAND:RES:AUTO'         : ('bool', True),
+        'BAND:VID'              : ('num' , 3e6),
+        'BAND:VID:AUTO'         : ('bool', True),
+        'SWE:TIME'              : ('num' , 0.01),
+        'SWE:TIME:AUTO'         : ('bool', True),
+        'SWE:POIN'              : ('int' , 1001),
+        'DET'                   : (DETECTORS, 'NORM'),
+        'TRAC:TYPE'             : (TRACE_MODES, 'WRIT'),
+        'INIT:CONT'             : ('bool', True),
+        'DISP:WIND:TRAC:Y:RLEV' : ('num' , 0.0),
+        'DISP:WIND:TRAC:Y:PDIV' : ('num' , 10.0),
+        'FORM:TRAC'             : (('ASCii', 'REAL'), 'ASC'),
+        'FORM:BORD'             : (('NORMal', 'SWAPped'), 'NORM'),
+    }
+    LIMITS  = {'SWE:POIN': (101, 40001)}
+    ALIASES = {
+        'BAND'          : 'BAND:RES',       'BAND?'         : 'BAND:RES?',
+        'BWID'          : 'BAND:RES',       'BWID?'         : 'BAND:RES?',
+        'BWID:RES'      : 'BAND:RES',       'BWID:RES?'     : 'BAND:RES?',
+        'BAND:AUTO'     : 'BAND:RES:AUTO',  'BWID:VID'      : 'BAND:VID',
+        'DET:TRAC'      : 'DET',            'DET:TRAC?'     : 'DET?',
+        'TRAC:MODE'     : 'TRAC:TYPE',      'TRAC:MODE?'    : 'TRAC:TYPE?',
+        'FORM'          : 'FORM:TRAC',      'FORM?'         : 'FORM:TRAC?',
+        'CALC:MARK:MAX:PEAK' : 'CALC:MARK:MAX',
+    }
+    ACTIONS = dict(SimInstrument.ACTIONS, **{
+        'FREQ:STAR'         : 'start_freq',  'FREQ:STAR?'     : 'start_freq_query',
+        'FREQ:STOP'         : 'stop_freq',   'FREQ:STOP?'     : 'stop_freq_query',
+        'FREQ:SPAN:FULL'    : 'span_full',
+        'INIT'              : 'initiate',    'ABOR'           : 'abort',
+        'TRAC?'             : 'trace_query',
+        'CALC:MARK'         : 'marker_state', 'CALC:MARK:MODE' : 'marker_state',
+        'CALC:MARK:MAX'     : 'marker_max',  'CALC:MARK:MAX:NEXT' : 'marker_next',
+        'CALC:MARK:X'       : 'marker_x',    'CALC:MARK:X?'   : 'marker_x_query',
+        'CALC:MARK:Y?'      : 'marker_y_query',
+    })
+
+    def __init__(self, source: SignalPath = None, time_scale: float = 1.0, k_sweep: float = 2.5,
+                 min_sweep: float = 0.001, fft_rbw: float = 1e3, fft_span: float = 1e6, danl: float = -155.0,
+                 f_max: float = 6e9, seed: int = 0):
+        self.source         = source if source is not None else SignalPath()
+        self.time_scale     = time_scale
+        self.k_sweep        = k_sweep
+        self.min_sweep      = min_sweep
+        self.fft_rbw        = fft_rbw
+        self.fft_span       = fft_span
+        self.danl           = danl
+        self.f_max          = f_max
+        # Sweep state
+        self.sweep_start    = None
+        self.sweep_end      = None
+        self.opc_pending    = False
+        self.trace          = None
+        self.marker         = None
+        # Statistics
+        self.sweeps         = 0
+        super().__init__(seed)
+
+    # Settings coupling
+    def set(self, name: str, value):
+        if name in ('BAND:RES', 'BAND:VID', 'SWE:TIME'):
+            if value <= 0:
+                raise ScpiError(-222, "Data out of range")
+            self.state[name + ':AUTO'] = False
+        if name == 'FREQ:SPAN':
+            value = min(max(value, 0.0), self.f_max)
+        if name in self.LIMITS and not self.LIMITS[name][0] <= value <= self.LIMITS[name][1]:
+            raise ScpiError(-222, "Data out of range")
+        super().set(name, value)
+        self.couple()
+
+    def couple(self):
+        """Recompute the auto coupled RBW, VBW and sweep time."""
+        s = self.state
+        # Zero span (time domain): the RBW is not coupled to the span
+        if s['BAND:RES:AUTO'] and s['FREQ:SPAN'] > 0:
+            # Largest 1-3-10 step below span/100, 1 Hz .. 8 MHz
+            target  = max(s['FREQ:SPAN']/100.0, 1.0)
+            steps   = [m*10.0**e for e in range(0, 7) for m in (1, 3)]
+            s['BAND:RES'] = min(max([r for r in steps if r <= target], default=1.0), 8e6)
+        if s['BAND:VID:AUTO']:
+            s['BAND:VID'] = s['BAND:RES']
+        if s['SWE:TIME:AUTO']:
+            s['SWE:TIME'] = self.auto_sweep_time()
+
+    def auto_sweep_time(self) -> float:
+        s   = self.state
+        if s['FREQ:SPAN'] == 0:
+            return self.min_sweep
+        if s['BAND:RES'] < self.fft_rbw:
+            # Narrow RBW: FFT analysis, an acquisition of ~2/RBW per FFT segment
+            segments = math.ceil(max(s['FREQ:SPAN'], 1.0)/self.fft_span)
+            return max(2.0*segments/s['BAND:RES'], self.min_sweep)
+        bw  = s['BAND:RES']*min(s['BAND:RES'], s['BAND:VID'])
+        return max(self.k_sweep*s['FREQ:SPAN']/bw, self.min_sweep)
+
+    def rst(self, args=''):
+        super().rst(args)
+        self.sweep_start    = None
+        self.opc_pending    = False
+        self.trace          = None
+        self.marker         = None
+        self.couple()
+
+    def start_freq(self, args):
+        stop = self.state['FREQ:CENT'] + self.state['FREQ:SPAN']/2
+        self.set_range(parse_number(args), stop)
+
+    def stop_freq(self, args):
+        start = self.state['FREQ:CENT'] - self.state['FREQ:SPAN']/2
+        self.set_range(start, parse_number(args))
+
+    def set_range(self, start: float, stop: float):
+        if stop < start:
+            start, stop = stop, start
+        self.state['FREQ:CENT'] = (start + stop)/2
+        self.set('FREQ:SPAN', stop - start)
+
+    def start_freq_query(self, args):
+        return repr(self.state['FREQ:CENT'] - self.state['FREQ:SPAN']/2)
+
+    def stop_freq_query(self, args):
+        return repr(self.state['FREQ:CENT'] + self.state['FREQ:SPAN']/2)
+
+    def span_full(self, args):
+        self.set_range(0.0, self.f_max)
+
+    # Sweep
+    def initiate(self, args):
+        now                 = self.now
+        self.sweep_start    = now
+        self.sweep_end      = now + self.state['SWE:TIME']*self.time_scale
+        self.sweeps        += 1
+
+    def abort(self, args):
+        self.sweep_start    = None
+        self.opc_pending    = False
+
+    def update(self):
+        if self.sweep_start is not None and self.now >= self.sweep_end:
+            self.finish_sweep()
+
+    def finish_sweep(self):
+        self.trace          = self.render(self.sweep_start, self.sweep_end)
+        self.sweep_start    = None
+        if self.opc_pending:
+            self.esr       |= 1
+            self.opc_pending = False
+
+    def wait(self, args=''):
+        if self.sweep_start is not None:
+            time.sleep(max(self.sweep_end - time.perf_counter(), 0.0))
+            self.now = max(self.now, self.sweep_end)
+            self.finish_sweep()
+
+    def opc(self, args):
+        if self.sweep_start is not None:
+            self.opc_pending = True
+        else:
+            self.esr |= 1
+
+    def current_trace(self) -> np.ndarray:
+        """Trace of the last completed sweep (waits for a running sweep)."""
+        self.wait()
+        if self.trace is None or (self.state['INIT:CONT'] and self.sweep_start is None):
+            # Continuous sweep: the latest sweep ended just now
+            now         = self.now
+            self.trace  = self.render(now - self.state['SWE:TIME']*self.time_scale, now)
+        return self.trace
+
+    def frequencies(self) -> np.ndarray:
+        s = self.state
+        return np.linspace(s['FREQ:CENT'] - s['FREQ:SPAN']/2, s['FREQ:CENT'] + s['FREQ:SPAN']/2,
+                           s['SWE:POIN'])
+
+    def render(self, t0: float, t1: float) -> np.ndarray:
+        """Trace (dBm) of a sweep from t0 to t1, every bin sees the input at its own time."""
+        s       = self.state
+        f       = self.frequencies()
+        n       = len(f)
+        rbw     = s['BAND:RES']
+
+        # Noise: exponential power samples averaged by the detector
+        n_avg   = min(max(s['SWE:TIME']*min(rbw, s['BAND:VID'])/n, 1.0), 1e4)
+        noise   = dbm_to_w(self.danl + 10*np.log10(rbw))
+        det     = s['DET']
+        if det in ('AVER', 'RMS', 'EAV', 'RAV'):
+            power = noise*self.rng.gamma(n_avg, 1.0/n_avg, n)
+        elif det in ('POS', 'NORM', 'QPE'):
+            power = noise*(np.log(n_avg) + self.rng.exponential(1.0, n))
+        elif det == 'NEG':
+            power = noise*self.rng.exponential(1.0/n_avg, n)
+        else:
+            power = noise*self.rng.exponential(1.0, n)
+
+        # Tones through the Gaussian RBW filter (-3 dB at +-RBW/2), piecewise in time
+        t_bins  = np.linspace(t0, t1, n)
+        edges   = [0] + [int(np.searchsorted(t_bins, t)) for t in self.source.changes(t0, t1)] + [n]
+        for i0, i1 in zip(edges[:-1], edges[1:]):
+            if i1 <= i0:
+                continue
+            fb = f[i0:i1]
+            for ft, pt in self.source.at(t_bins[i0]):
+                if fb[0] - 8*rbw <= ft <= fb[-1] + 8*rbw:
+                    power[i0:i1] += dbm_to_w(pt)*10.0**(-0.30103*((fb - ft)/(rbw/2))**2)
+
+        trace = w_to_dbm(power).astype(np.float32)
+        mode  = s['TRAC:TYPE']
+        if self.trace is not None and len(self.trace) == n:
+            if mode == 'MAXH':
+                trace = np.maximum(self.trace, trace)
+            elif mode == 'MINH':
+                trace = np.minimum(self.trace, trace)
+            elif mode == 'VIEW':
+                trace = self.trace
+        return trace
+
+    def trace_query(self, args):
+        trace = self.current_trace()
+        if self.state['FORM:TRAC'] == 'REAL':
+            data    = trace.astype('<f4' if self.state['FORM:BORD'] == 'SWAP' else '>f4').tobytes()
+            length  = str(len(data))
+            return f'#{len(length)}{length}'.encode() + data
+        return ','.join(f'{v:.3f}' for v in trace.tolist())
+
+    # Markers
+    def marker_state(self, args):
+        if self.marker is None:
+            self.marker = self.state['SWE:POIN']//2
+
+    def marker_max(self, args):
+        self.marker = int(np.argmax(self.current_trace()))
+
+    def marker_next(self, args, excursion: float = 6.0):
+        """Next peak (not higher than the marker) rising ``excursion`` dB above its surroundings."""
+        trace   = self.current_trace()
+        ref     = trace[self.marker] if self.marker is not None else np.inf
+        peaks   = np.flatnonzero((trace[1:-1] >= trace[:-2]) & (trace[1:-1] > trace[2:])) + 1
+        for i in peaks[np.argsort(-trace[peaks], kind='stable')]:
+            if trace[i] > ref or i == self.marker:
+                continue
+            # The marker peak counts as higher: a second bin of its own lobe is no peak
+            higher  = np.flatnonzero(trace > trace[i])
+            if self.marker is not None:
+                higher = np.union1d(higher, [self.marker])
+            left    = higher[higher < i]
+            right   = higher[higher > i]
+            lo      = trace[left[-1]:i].min() if len(left) else trace[:i + 1].min()
+            hi      = trace[i:right[0] + 1].min() if len(right) else trace[i:].min()
+            if trace[i] - max(lo, hi) >= excursion:
+                self.marker = int(i)
+                return
+        raise ScpiError(-200, "Execution error; no peak found")
+
+    def marker_x(self, args):
+        f           = self.frequencies()
+        self.marker = int(np.argmin(np.abs(f - parse_number(args))))
+
+    def marker_x_query(self, args):
+        self.marker_state(args)
+        return repr(float(self.frequencies()[self.marker]))
+
+    def marker_y_query(self, args):
+        self.marker_state(args)
+        return repr(round(float(self.current_trace()[self.marker]), 3))
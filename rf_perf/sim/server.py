@@ -0,0 +1,287 @@
+"""
+Simulated bench served over raw SCPI sockets (pyvisa-py ``TCPIP0::host::port::SOCKET``).
+
+A SimServer puts one simulated instrument on a TCP port. Every program message costs a
+command processing time, every response a network round trip (latency + jitter) and
+its transfer time at the link throughput, so the round trip and byte savings of the
+rf_perf helpers show up in the wall time the way they do on a LAN.
+
+The times are modelled, not measured: a message takes effect at its arrival (or at the
+end of the previous message) plus its processing time, and the response leaves at that
+time plus the round trip. The server thread sleeps until these deadlines, a late wake
+up delays the socket traffic but not the instrument state, so runs with the same seed
+see the generator and analyzer events at the same relative times.
+
+SimBench starts a signal generator and a spectrum analyzer connected through a DUT:
+
+    with SimBench(dut='pa', time_scale=0.1) as bench:
+        rm      = pyvisa.ResourceManager('@py')
+        scpi_sa = FastSCPIWrapper(instr=bench.open(rm, 'sa'), log=log, name='SA')
+
+From a shell (serves until Ctrl-C):
+
+    python -m rf_perf.sim.server --dut filter --sa-port 5025 --sg-port 5026
+"""
+import argparse
+import logging
+import socket
+import socketserver
+import threading
+import time
+
+import numpy as np
+
+from rf_perf.sim.dut import BandpassDut, PaDut, Through
+from rf_perf.sim.instruments import SignalPath, SimAnalyzer, SimGenerator
+
+logger = logging.getLogger(__name__)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server  = self.server.sim
+        buffer  = b''
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            try:
+                chunk = self.request.recv(65536)
+                t_arrival = time.perf_counter()
+                # ACK at once (Linux clears TCP_QUICKACK, set it after every receive): with the
+                # delayed ACK the Nagle algorithm of a client without TCP_NODELAY holds a
+                # message sent after a write for ~40 ms, which no instrument does on a LAN
+                if hasattr(socket, 'TCP_QUICKACK'):
+                    self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            except OSError:
+                return
+            if not chunk:
+                return
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                msg = line.decode(errors='replace').strip()
+                if msg:
+                    response = server.process(msg, len(line) + 1, t_arrival)
+                    if response is not None:
+                        self.request.sendall(response)
+
+
+def sleep_until(t: float):
+    """Sleep until the perf_counter time t (no sleep if it is already past)."""
+    time.sleep(max(t - time.perf_counter(), 0.0))
+
+
+class SimServer:
+    """
+    One simulated instrument on a TCP port.
+
+    Args:
+        instrument: SimInstrument
+        host:       interface to listen on
+        port:       TCP port (0 picks a free port)
+        latency:    network round trip time of a response (s)
+        jitter:     standard deviation of the round trip time (s)
+        cmd_time:   processing time of one command (s)
+        throughput: link throughput (bytes/s)
+        seed:       random seed of the jitter
+    """
+
+    def __init__(self, instrument, host: str = '127.0.0.1', port: int = 0, latency: float = 0.5e-3,
+                 jitter: float = 0.1e-3, cmd_time: float = 50e-6, throughput: float = 10e6, seed: int = 0):
+        self.instrument = instrument
+        self.latency    = latency
+        self.jitter     = jitter
+        self.cmd_time   = cmd_time
+        self.throughput = throughput
+        self.rng        = np.random.default_rng(seed)
+        # End of the last message (modelled time), the messages are executed one at a time
+        self.lock       = threading.Lock()
+        self.t_done     = 0.0
+        self.server     = socketserver.ThreadingTCPServer((host, port), _Handler, bind_and_activate=False)
+        self.server.allow_reuse_address = True
+        self.server.daemon_threads      = True
+        self.server.server_bind()
+        self.server.server_activate()
+        self.server.sim = self
+        self.thread     = None
+        # Statistics
+        self.messages   = 0
+        self.queries    = 0
+        self.bytes_in   = 0
+        self.bytes_out  = 0
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    @property
+    def resource(self) -> str:
+        return f"TCPIP0::{self.server.server_address[0]}::{self.port}::SOCKET"
+
+    def process(self, msg: str, n_bytes: int, t_arrival: float = None):
+        """
+        Execute a program message with the modelled timing.
+
+        Args:
+            msg:       program message (without the terminator)
+            n_bytes:   message length on the link
+            t_arrival: receive time (perf_counter), default now
+        Returns: response bytes (terminated) or None
+        """
+        with self.lock:
+            self.messages  += 1
+            self.bytes_in  += n_bytes
+            if t_arrival is None:
+                t_arrival = time.perf_counter()
+            # Takes effect after the previous message and its own processing time
+            t_apply = max(t_arrival, self.t_done) + self.cmd_time*(msg.count(';') + 1)
+            sleep_until(t_apply)
+            response = self.instrument.execute(msg, t_apply)
+            # A blocking command (*OPC?, *WAI) moves the instrument time to the end of the sweep
+            self.t_done = max(t_apply, self.instrument.now)
+            if response is None:
+                return None
+            response = (response if isinstance(response, bytes) else response.encode()) + b'\n'
+            self.queries   += 1
+            self.bytes_out += len(response)
+            delay = self.latency + self.jitter*self.rng.standard_normal() + len(response)/self.throughput
+        sleep_until(self.t_done + max(delay, 0.0))
+        return response
+
+    def stats(self) -> dict:
+        return dict(messages=self.messages, queries=self.queries,
+                    bytes_in=self.bytes_in, bytes_out=self.bytes_out)
+
+    def reset_stats(self):
+        self.messages = self.queries = self.bytes_in = self.bytes_out = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SimBench:
+    """
+    Signal generator -> DUT -> spectrum analyzer, each instrument on its own port.
+
+    Args:
+        dut:        'pa', 'filter', 'through' or a DUT object (``apply(tones) -> tones``)
+        tones:      extra CW tones seen by the analyzer [(frequency Hz, power dBm)]
+        time_scale: analyzer sweep time scale (< 1 runs faster than the bench)
+        sa_port:    analyzer port (0 picks a free port)
+        sg_port:    generator port (0 picks a free port)
+        seed:       random seed
+        analyzers:  analyzers on the DUT output ('sa', then 'sa2', 'sa3'... on free ports)
+        **kwargs:   SimServer timing (latency, jitter, cmd_time, throughput)
+    """
+    DUTS = {'pa': lambda: PaDut(loss=32.5), 'filter': BandpassDut, 'through': Through}
+
+    def __init__(self, dut='through', tones=(), time_scale: float = 1.0, host: str = '127.0.0.1',
+                 sa_port: int = 0, sg_port: int = 0, seed: int = 0, analyzers: int = 1, **kwargs):
+        self.dut        = self.DUTS[dut]() if isinstance(dut, str) else dut
+        self.sg         = SimGenerator(seed=seed)
+        self.sa         = SimAnalyzer(SignalPath(self.sg, self.dut, tones), time_scale=time_scale, seed=seed)
+        self.servers    = {
+            'sa': SimServer(self.sa, host, sa_port, seed=seed, **kwargs),
+            'sg': SimServer(self.sg, host, sg_port, seed=seed + 1, **kwargs),
+        }
+        # More analyzers seeing the same signal (a splitter on the DUT output)
+        for i in range(2, analyzers + 1):
+            sa = SimAnalyzer(SignalPath(self.sg, self.dut, tones), time_scale=time_scale, seed=seed + i)
+            self.servers[f"sa{i}"] = SimServer(sa, host, 0, seed=seed + i, **kwargs)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        for server in self.servers.values():
+            server.start()
+        return self
+
+    def stop(self):
+        for server in self.servers.values():
+            server.stop()
+
+    def resource(self, name: str) -> str:
+        return self.servers[name].resource
+
+    def open(self, rm, name: str, timeout_ms: int = 10000):
+        """
+        Open a pyvisa session to one of the instruments (see open_session).
+
+        Args:
+            rm:   pyvisa ResourceManager ('@py')
+            name: 'sa' or 'sg'
+        """
+        return open_session(rm, self.resource(name), timeout_ms)
+
+    def stats(self) -> dict:
+        return {name: server.stats() for name, server in self.servers.items()}
+
+    def reset_stats(self):
+        for server in self.servers.values():
+            server.reset_stats()
+
+
+def open_session(rm, resource: str, timeout_ms: int = 10000):
+    """
+    Open a pyvisa session to a simulated instrument: line terminated raw socket with
+    TCP_NODELAY, a write goes out at once instead of waiting for the ACK of the previous one.
+
+    Args:
+        rm:       pyvisa-py ResourceManager ('@py')
+        resource: SimServer resource string
+    """
+    instr = rm.open_resource(resource, read_termination='\n', write_termination='\n', timeout=timeout_ms)
+    # pyvisa-py does not route VI_ATTR_TCPIP_NODELAY to its SOCKET sessions, set it on the socket
+    instr.visalib.sessions[instr.session].interface.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return instr
+
+
+def parse_tone(text: str) -> tuple:
+    """'1234.5:-30' -> (1234.5e6 Hz, -30 dBm)"""
+    f, p = text.split(':')
+    return float(f)*1e6, float(p)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dut'         , default='through', choices=sorted(SimBench.DUTS))
+    parser.add_argument('--host'        , default='127.0.0.1')
+    parser.add_argument('--sa-port'     , type=int  , default=5025)
+    parser.add_argument('--sg-port'     , type=int  , default=5026)
+    parser.add_argument('--cw'          , type=parse_tone, action='append', default=[],
+                        help="extra CW tone MHz:dBm (repeatable)")
+    parser.add_argument('--time-scale'  , type=float, default=1.0  , help="sweep time scale")
+    parser.add_argument('--latency'     , type=float, default=0.5  , help="round trip time (ms)")
+    parser.add_argument('--jitter'      , type=float, default=0.1  , help="round trip jitter (ms)")
+    parser.add_argument('--throughput'  , type=float, default=10.0 , help="link throughput (MB/s)")
+    parser.add_argument('--seed'        , type=int  , default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    bench = SimBench(args.dut, tones=args.cw, time_scale=args.time_scale, host=args.host,
+                     sa_port=args.sa_port, sg_port=args.sg_port, seed=args.seed,
+                     latency=args.latency*1e-3, jitter=args.jitter*1e-3, throughput=args.throughput*1e6)
+    bench.start()
+    logger.info(f"SA: {bench.resource('sa')}")
+    logger.info(f"SG: {bench.resource('sg')}")
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        logger.info(f"Stopped, {bench.stats()}")
+    finally:
+        bench.stop()
+
+
+if __name__ == "__main__":
+    main()
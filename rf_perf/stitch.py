@@ -0,0 +1,227 @@
+"""
+Segment planning and stitching for hi-res (multi sweep) scans.
+
+Stepping the center by exactly one span and concatenating the traces repeats the
+boundary bin of every pair of segments and keeps the edge bins. A SegmentPlan puts all
+the segments on one common bin grid: neighbours share ``overlap`` bins, ``trim`` bins
+are dropped at every inner segment edge and the rest of the shared bins are either
+split between the two segments ('drop') or cross-faded in linear power ('fade'). The
+stitched frequency axis is one strictly increasing grid, without repeated bins.
+
+``SegmentPlan.for_rbw`` picks the fewest segments that hold the requested bins per RBW
+over the range with at most ``max_points`` sweep points per segment (fewer segments,
+fewer sweeps), then the fewest points that still cover the range with that count.
+``query_max_points`` reads that limit from the analyzer (``:SWEep:POINts? MAX``).
+``partition`` splits the segments between several analyzers scanning in parallel.
+
+Usage:
+    max_points = query_max_points(vsa, fallback=1001)
+    plan    = SegmentPlan.for_rbw(f_start, f_stop, rbw, max_points=max_points, bins_per_rbw=3.0)
+    stitch  = Stitcher(plan, mode='fade')
+    for k, fc in enumerate(plan.centers):
+        ...                                     # center fc, span plan.span, plan.points points
+        start, stop = stitch.add(k, trace)      # stitch.power[start:stop] is final
+    freq, power = stitch.freq, stitch.power
+"""
+import logging
+
+import numpy as np
+import pyvisa
+
+logger = logging.getLogger(__name__)
+
+
+def query_max_points(instr, fallback: int, log=None) -> int:
+    """
+    Largest sweep point count of the analyzer (``:SWEep:POINts? MAX``).
+
+    Args:
+        instr:    pyvisa message based resource (or a SCPIWrapper, its ``instr`` is used)
+        fallback: point count used when the instrument does not answer the MAX query
+        log:      logger (defaults to the module logger)
+    Returns: maximum sweep points
+    """
+    instr   = getattr(instr, 'instr', instr)
+    log     = log if log is not None else logger
+    try:
+        points = int(float(instr.query(":SENSe:SWEep:POINts? MAX")))
+    except (pyvisa.errors.VisaIOError, ValueError) as e:
+        # No response (or not a number): flush it, the error queue is drained below
+        instr.clear()
+        log.debug(f"Sweep points MAX query failed ({e})")
+        points = None
+    # An instrument may answer with the current value and queue an error
+    for _ in range(32):
+        e = instr.query("SYST:ERR?").strip().split(',')
+        if int(e[0]) == 0:
+            break
+        points = None
+        log.debug(f"Instrument error: {','.join(e)}")
+    if points is None or points < 2:
+        log.warning(f"Maximum sweep points unknown, using {fallback}")
+        return int(fallback)
+    return points
+
+
+class SegmentPlan:
+    """
+    Segments k = 0..segments-1 start at bin k*(points - overlap) of a common grid of
+    ``bins`` bins from f_start to f_stop (any frequency unit).
+
+    Args:
+        f_start:  first frequency of the stitched scan
+        f_stop:   last frequency of the stitched scan
+        points:   sweep points of every segment
+        segments: number of segments
+        overlap:  bins shared by two neighbouring segments
+        trim:     bins dropped at every inner segment edge (overlap >= 2*trim)
+    """
+
+    def __init__(self, f_start: float, f_stop: float, points: int, segments: int, overlap: int = 3,
+                 trim: int = 1):
+        if segments < 1 or points < 2:
+            raise ValueError(f"At least one segment of two points, not {segments} x {points}")
+        if not 2*trim <= overlap < points:
+            raise ValueError(f"Overlap {overlap} must be within [2*trim, points) (trim {trim}, points {points})")
+        self.f_start    = f_start
+        self.f_stop     = f_stop
+        self.points     = int(points)
+        self.segments   = int(segments)
+        self.overlap    = int(overlap)
+        self.trim       = int(trim)
+        self.step       = self.points - self.overlap
+        self.bins       = (self.segments - 1)*self.step + self.points
+        self.df         = (f_stop - f_start)/(self.bins - 1)
+        self.span       = (self.points - 1)*self.df
+        # First grid bin and center frequency of every segment
+        self.starts     = np.arange(self.segments)*self.step
+        self.centers    = f_start + (self.starts + (self.points - 1)/2)*self.df
+
+    @classmethod
+    def for_rbw(cls, f_start: float, f_stop: float, rbw: float, max_points: int, bins_per_rbw: float = 3.0,
+                overlap: int = 3, trim: int = 1, min_points: int = 101, fixed_points: bool = False,
+                min_segments: int = 1):
+        """
+        Fewest segments with at least bins_per_rbw bins per RBW.
+
+        Args:
+            rbw:          resolution bandwidth (same unit as the frequencies)
+            max_points:   largest sweep point count of the instrument
+            bins_per_rbw: target bin density
+            min_points:   smallest sweep point count used
+            fixed_points: keep max_points (the bins get denser) instead of the fewest points
+            min_segments: smallest segment count (e.g. one per analyzer of a parallel scan)
+        """
+        # Grid intervals needed over the range
+        intervals   = (f_stop - f_start)*bins_per_rbw/rbw
+        segments    = max(int(np.ceil((intervals + 1 - overlap)/(max_points - overlap))), min_segments, 1)
+        if fixed_points:
+            points  = max_points
+        else:
+            points  = int(np.ceil((intervals + 1 + (segments - 1)*overlap)/segments))
+            points  = min(max(points, min_points, overlap + 1), max_points)
+        return cls(f_start, f_stop, points, segments, overlap, trim)
+
+    def __len__(self) -> int:
+        return self.segments
+
+    def freq(self) -> np.ndarray:
+        """Stitched frequency axis (strictly increasing)."""
+        return self.f_start + np.arange(self.bins)*self.df
+
+    def segment_freq(self, k: int) -> np.ndarray:
+        """Frequency axis of the trace of segment k."""
+        return self.f_start + (self.starts[k] + np.arange(self.points))*self.df
+
+    def partition(self, n: int) -> list:
+        """
+        Split the segments between n workers (analyzers), round robin: worker i gets the
+        segments i, i+n, i+2n... so the segments of all the workers come in about
+        frequency order.
+
+        Returns: [array of segment indices] of every worker
+        """
+        return [np.arange(i, self.segments, n) for i in range(n)]
+
+    def usable(self, k: int) -> tuple:
+        """First and last (inclusive) grid bin of segment k after the edge trim."""
+        lo = self.starts[k] + (self.trim if k > 0 else 0)
+        hi = self.starts[k] + self.points - 1 - (self.trim if k < self.segments - 1 else 0)
+        return int(lo), int(hi)
+
+    def __repr__(self) -> str:
+        return (f"SegmentPlan({self.segments} x {self.points} points, span {self.span:.6g}, "
+                f"bin {self.df:.4g}, overlap {self.overlap}, trim {self.trim})")
+
+
+class Stitcher:
+    """
+    Stitched result of a SegmentPlan, preallocated (freq and power of ``plan.bins`` bins,
+    NaN until measured).
+
+    Args:
+        plan: SegmentPlan
+        mode: 'drop' (every shared bin from one segment, split in the middle) or 'fade'
+              (linear cross-fade of the shared bins, in linear power)
+    """
+
+    def __init__(self, plan: SegmentPlan, mode: str = 'drop'):
+        if mode not in ('drop', 'fade'):
+            raise ValueError(f"mode must be 'drop' or 'fade', not {mode!r}")
+        self.plan   = plan
+        self.mode   = mode
+        self.freq   = plan.freq()
+        self.power  = np.full(plan.bins, np.nan)
+        # Linear power accumulated by the cross-fade
+        self._acc   = np.zeros(plan.bins) if mode == 'fade' else None
+        usable      = [plan.usable(k) for k in range(len(plan))]
+        # Stitched bins final once segments 0..k are in: [bounds[k], bounds[k+1])
+        if mode == 'drop':
+            inner   = [(usable[k + 1][0] + usable[k][1] + 1)//2 for k in range(len(plan) - 1)]
+        else:
+            inner   = [usable[k + 1][0] for k in range(len(plan) - 1)]
+        self.bounds = np.array([0] + inner + [plan.bins])
+        self._usable = usable
+
+    def weights(self, k: int) -> np.ndarray:
+        """Weight of every bin of segment k in the stitched result."""
+        plan    = self.plan
+        w       = np.zeros(plan.points)
+        b0      = plan.starts[k]
+        if self.mode == 'drop':
+            w[self.bounds[k] - b0:self.bounds[k + 1] - b0] = 1.0
+            return w
+        lo, hi  = self._usable[k]
+        w[lo - b0:hi - b0 + 1] = 1.0
+        if k > 0:
+            # Shared with the previous segment: ramp up
+            shared = self._usable[k - 1][1] - lo + 1
+            w[lo - b0:lo - b0 + shared] = np.arange(1, shared + 1)/(shared + 1)
+        if k < len(plan) - 1:
+            # Shared with the next segment: ramp down
+            shared = hi - self._usable[k + 1][0] + 1
+            w[hi - b0 - shared + 1:hi - b0 + 1] = np.arange(shared, 0, -1)/(shared + 1)
+        return w
+
+    def add(self, k: int, trace) -> tuple:
+        """
+        Stitch the trace of segment k (dB).
+
+        Returns: (start, stop) of the stitched bins final once the segments 0..k are in
+        """
+        plan    = self.plan
+        trace   = np.asarray(trace, dtype=float)
+        if len(trace) != plan.points:
+            raise ValueError(f"Segment {k}: {len(trace)} points, the plan has {plan.points}")
+        b0      = plan.starts[k]
+        if self.mode == 'drop':
+            start, stop = self.bounds[k], self.bounds[k + 1]
+            self.power[start:stop] = trace[start - b0:stop - b0]
+        else:
+            w       = self.weights(k)
+            used    = np.flatnonzero(w)
+            self._acc[b0 + used] += w[used]*10**(trace[used]/10)
+            # The shared bins are complete only when both neighbours are in
+            region  = slice(b0 + used[0], b0 + used[-1] + 1)
+            self.power[region] = 10*np.log10(np.maximum(self._acc[region], 1e-30))
+        return int(self.bounds[k]), int(self.bounds[k + 1])
@@ -0,0 +1,192 @@
+"""
+Non-blocking sweep completion.
+
+A blocking ``*OPC?`` holds the VISA session for the whole sweep and needs a timeout
+longer than the slowest sweep. SweepCompletion arms the status system instead
+(``*ESE 1`` maps the OPC bit to the ESB summary, ``*SRE 32`` raises a service request
+on ESB) and ends every sweep with ``*OPC``. The caller is free to use the session (or
+another instrument) while the sweep runs and then waits for the SRQ event, or polls
+``*ESR?`` at an interval derived from the expected sweep time when SRQ is not available.
+
+Usage:
+    done = SweepCompletion(scpi_sa, log=log)
+    done.start()                # INIT:IMM;*OPC, returns immediately
+    scpi_sg.write("freq ...")   # useful work while the analyzer sweeps
+    done.wait()
+
+Slow (e.g. 10x for the average detector) sweeps of a measurement block share one
+programmed sweep time, the auto value is queried once per analyzer configuration:
+
+    times = SweepTimeCache(scpi_sa, factor=10)
+    with times.hold((span, rbw, vbw, 'AVER', points)) as sweep_time:
+        done.start(sweep_time)
+        ...
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+import pyvisa
+from pyvisa import constants
+
+logger = logging.getLogger(__name__)
+
+
+class SweepCompletion:
+    """
+    Args:
+        scpi:     SCPIWrapper or raw pyvisa resource of the analyzer
+        log:      logger (defaults to the module logger)
+        use_srq:  wait on the service request event if the VISA session supports it
+        min_poll: shortest *ESR? polling interval (s)
+        max_poll: longest *ESR? polling interval (s)
+    """
+
+    def __init__(self, scpi, log=None, use_srq: bool = True, min_poll: float = 0.005, max_poll: float = 0.25):
+        self.scpi       = scpi
+        self.instr      = getattr(scpi, 'instr', scpi)
+        self.log        = log if log is not None else logger
+        self.min_poll   = min_poll
+        self.max_poll   = max_poll
+        self.use_srq    = use_srq and self._enable_srq()
+        # State of the running sweep
+        self.t_start    = None
+        self.sweep_time = None
+        # Statistics
+        self.polls      = 0
+        self.arm()
+
+    def _enable_srq(self) -> bool:
+        try:
+            self.instr.enable_event(constants.EventType.service_request, constants.EventMechanism.queue)
+            return True
+        except (pyvisa.errors.VisaIOError, NotImplementedError, AttributeError):
+            self.log.debug("SRQ events not supported, polling *ESR?")
+            return False
+
+    def arm(self):
+        """Program the status system. Call again after *RST or *CLS."""
+        self.scpi.write("*ESE 1")
+        self.scpi.write("*SRE 32")
+        # Clear a stale OPC bit left by an earlier *OPC
+        self.scpi.query("*ESR?")
+
+    def start(self, sweep_time: float = None):
+        """
+        Start a single sweep and return immediately.
+
+        Args:
+            sweep_time: expected sweep time in seconds (queried with :SWEep:TIME? if None)
+        """
+        if sweep_time is None:
+            sweep_time = float(self.scpi.query(":SWEep:TIME?"))
+        self.sweep_time = sweep_time
+        if self.use_srq:
+            self.instr.discard_events(constants.EventType.service_request, constants.EventMechanism.queue)
+        if hasattr(self.scpi, 'batch'):
+            # One program message (and the shadow cache sees both commands)
+            with self.scpi.batch():
+                self.scpi.write("INITiate:IMMediate")
+                self.scpi.write("*OPC")
+        else:
+            self.scpi.write("INITiate:IMMediate;*OPC")
+        self.t_start    = time.perf_counter()
+
+    def is_done(self) -> bool:
+        """Single non-blocking check of the OPC bit (reading *ESR? clears it)."""
+        self.polls += 1
+        return int(self.scpi.query("*ESR?")) & 1 == 1
+
+    def wait(self, timeout: float = None):
+        """
+        Wait for the end of the sweep started by ``start()``.
+
+        Args:
+            timeout: seconds from the sweep start (default: 10x the sweep time + 5 s)
+        Raises:
+            TimeoutError: the sweep did not complete in time
+        """
+        if timeout is None:
+            timeout = 10.0*self.sweep_time + 5.0
+        deadline = self.t_start + timeout
+
+        if self.use_srq:
+            remaining = max(deadline - time.perf_counter(), 0.0)
+            try:
+                self.instr.wait_on_event(constants.EventType.service_request, int(remaining*1000))
+            except pyvisa.errors.VisaIOError as e:
+                if e.error_code != constants.StatusCode.error_timeout:
+                    raise
+                raise TimeoutError(f"Sweep not completed after {timeout:.2f} s") from e
+            # Clear the ESB source (the service request is cleared by the serial poll)
+            self.instr.read_stb()
+            self.is_done()
+            return
+
+        # Sleep most of the expected sweep, then poll with an increasing interval
+        time.sleep(max(self.t_start + 0.9*self.sweep_time - time.perf_counter(), 0.0))
+        interval = min(max(0.05*self.sweep_time, self.min_poll), self.max_poll)
+        while not self.is_done():
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"Sweep not completed after {timeout:.2f} s")
+            time.sleep(interval)
+            interval = min(2.0*interval, self.max_poll)
+
+
+class SweepTimeCache:
+    """
+    Auto sweep times of the analyzer configurations seen so far.
+
+    The auto sweep time only depends on the span, the RBW, the VBW, the detector and
+    the sweep points, so ``:SWEep:TIME?`` is queried once per configuration. ``hold()``
+    programs ``factor`` times the auto value for a whole measurement block and restores
+    the auto sweep time when the block ends (nested holds of the same block are free).
+
+    Args:
+        scpi:   SCPIWrapper or raw pyvisa resource of the analyzer
+        factor: sweep time multiplier of the block
+    """
+
+    def __init__(self, scpi, factor: float = 10.0):
+        self.scpi       = scpi
+        self.factor     = factor
+        self.times      = {}
+        # Sweep time of the active block (None outside a block)
+        self.sweep_time = None
+        self._depth     = 0
+        # Statistics
+        self.hits       = 0
+        self.misses     = 0
+
+    def invalidate(self):
+        self.times.clear()
+
+    def get(self, key: tuple) -> float:
+        """
+        Args:
+            key: (span, RBW, VBW, detector, points) of the current configuration, the
+                 sweep time must be in auto mode on a miss
+
+        Returns: auto sweep time (s)
+        """
+        if key in self.times:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.times[key] = float(self.scpi.query("SENSE:SWEEP:TIME?"))
+        return self.times[key]
+
+    @contextmanager
+    def hold(self, key: tuple):
+        """Program factor x the auto sweep time until the end of the block, yield it (s)."""
+        if self._depth == 0:
+            self.sweep_time = self.get(key)*self.factor
+            self.scpi.write(f"SENSE:SWEEP:TIME {self.sweep_time}")
+        self._depth += 1
+        try:
+            yield self.sweep_time
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                self.sweep_time = None
+                self.scpi.write("SENSE:SWEEP:TIME:AUTO ON")
@@ -0,0 +1,46 @@
+"""
+Per-stage timing of measurement loops.
+
+Usage:
+    timer = StageTimer()
+    for f in f_scan:
+        with timer.stage('sweep'):
+            ...
+    log.info(timer.report(len(f_scan)))
+"""
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """Accumulate the wall time spent in the named stages of a loop."""
+
+    def __init__(self):
+        self.totals     = defaultdict(float)
+        self.counts     = defaultdict(int)
+        self.t_start    = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        t_stage = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] += time.perf_counter() - t_stage
+            self.counts[name] += 1
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t_start
+
+    def as_dict(self) -> dict:
+        return dict(self.totals)
+
+    def report(self, n_points: int) -> str:
+        """One line summary: total time, points per second and the share of every stage."""
+        elapsed = self.elapsed
+        rate    = n_points/elapsed if elapsed > 0 else 0.0
+        stages  = ', '.join(f"{name} {t*1e3/max(n_points, 1):.1f} ms ({100*t/elapsed:.0f}%)"
+                            for name, t in sorted(self.totals.items(), key=lambda kv: -kv[1]))
+        return f"{n_points} points in {elapsed:.2f} s ({rate:.1f} points/s) per point: {stages}"
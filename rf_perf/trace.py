@@ -0,0 +1,175 @@
+"""
+Binary trace transfer for swept spectrum analyzers.
+
+An ASCII trace of 40001 points is ~600 kB on the wire and must be formatted by the
+instrument and parsed by Python. In ``REAL,32`` format the same trace is 160 kB of
+IEEE-754 floats that ``numpy.frombuffer`` maps without any parsing.
+
+Usage:
+    reader = TraceReader(vsa, log=log)   # after *RST (it resets the format to ASCII)
+    power  = reader.read()               # float32 numpy array (dBm)
+"""
+import logging
+
+import numpy as np
+import pyvisa
+
+logger = logging.getLogger(__name__)
+
+# *ESR? bits reporting an error (query, device dependent, execution, command), as rf_perf.scpi
+ESR_ERROR_MASK = 4 | 8 | 16 | 32
+
+
+class TraceReader:
+    """
+    Read spectrum analyzer traces in binary REAL,32 format, falling back to ASCII
+    only if the instrument refuses the binary format.
+
+    Args:
+        instr: pyvisa message based resource (or a SCPIWrapper, its ``instr`` is used)
+        trace: trace number to read (TRACE1 by default)
+        log:   logger (defaults to the module logger)
+    """
+
+    def __init__(self, instr, trace: int = 1, log=None):
+        # Accept both a raw VISA resource and a SCPIWrapper
+        self.instr          = getattr(instr, 'instr', instr)
+        self.trace          = trace
+        self.log            = log if log is not None else logger
+        # Transfer state (set by configure)
+        self.is_binary      = False
+        self.is_big_endian  = False
+        self.configure()
+
+    @property
+    def mode(self) -> str:
+        return 'REAL,32' if self.is_binary else 'ASCII'
+
+    def configure(self) -> bool:
+        """
+        Program the instrument for binary transfer. Must be called again after
+        *RST or *RCL because both may restore the ASCII format.
+
+        Returns: True if binary transfer is active
+        """
+        # Errors of the application still pending are reported (not silently dropped) first
+        self._flush_errors()
+        self.instr.write(":FORMat:TRACe:DATA REAL,32")
+        if self._command_failed():
+            self.log.warning("Instrument refused REAL,32 trace format, using ASCII")
+            self.instr.write(":FORMat:TRACe:DATA ASCii")
+            self.is_binary = False
+            return False
+
+        # Little endian (SWAPped) avoids a byte swap on x86 hosts, NORMal is the IEEE default
+        self.instr.write(":FORMat:BORDer SWAPped")
+        self.is_big_endian  = self._command_failed()
+        self.is_binary      = True
+        self.log.debug(f"Trace transfer: {self.mode} "
+                       f"({'big' if self.is_big_endian else 'little'} endian)")
+        return True
+
+    def read(self) -> np.ndarray:
+        """
+        Query the trace data.
+
+        Returns: trace values as a float32 numpy array (read only when binary)
+        """
+        cmd = f":TRACe:DATA? TRACE{self.trace}"
+        if self.is_binary:
+            try:
+                return self._read_binary(cmd)
+            except (pyvisa.errors.VisaIOError, ValueError) as e:
+                # Flush the partial response and retry once with a fresh configuration
+                # (a *RCL may have restored the ASCII format behind our back)
+                self.log.warning(f"Binary trace read failed ({e}), reconfiguring")
+                self.instr.clear()
+                if self.configure():
+                    try:
+                        return self._read_binary(cmd)
+                    except (pyvisa.errors.VisaIOError, ValueError):
+                        self.instr.clear()
+                        self.log.warning("Binary trace read failed twice, using ASCII")
+                        self.instr.write(":FORMat:TRACe:DATA ASCii")
+                        self.is_binary = False
+
+        return self.instr.query_ascii_values(cmd, container=np.array).astype(np.float32)
+
+    def _read_binary(self, cmd: str) -> np.ndarray:
+        return self.instr.query_binary_values(cmd, datatype='f', is_big_endian=self.is_big_endian,
+                                              container=np.ndarray)
+
+    def _flush_errors(self):
+        """Clear the event status, logging (warning) the errors of earlier commands."""
+        if int(self.instr.query("*ESR?")) & ESR_ERROR_MASK:
+            self._drain_errors(logging.WARNING)
+
+    def _command_failed(self) -> bool:
+        """
+        Check the event status for an error of the last command (after _flush_errors).
+
+        Returns: True if the command failed (its errors are removed from the queue)
+        """
+        if int(self.instr.query("*ESR?")) & ESR_ERROR_MASK:
+            self._drain_errors(logging.DEBUG)
+            return True
+        return False
+
+    def _drain_errors(self, level: int = logging.DEBUG) -> bool:
+        """
+        Empty the instrument error queue.
+
+        Args:
+            level: log level of the removed errors
+        Returns: True if at least one error was pending
+        """
+        is_error = False
+        # The queue depth is limited, stop on a sane bound in case of a misbehaving instrument
+        for _ in range(32):
+            e = self.instr.query("SYST:ERR?").strip().split(',')
+            if int(e[0]) == 0:
+                break
+            is_error = True
+            self.log.log(level, f"Instrument error: {','.join(e)}")
+        return is_error
+
+
+class FreqAxisCache:
+    """
+    Cache of the trace frequency axis (MHz).
+
+    The axis only changes when the center frequency, span or sweep points change, so the
+    three SCPI queries that rebuild it are sent only after ``invalidate()`` (called by the
+    callbacks that change these settings) or when the trace length no longer matches.
+
+    Args:
+        query: callable sending a SCPI query and returning the response string
+    """
+
+    def __init__(self, query):
+        self.query  = query
+        self.freq   = None
+        # Statistics (a refresh loop with a valid cache only counts hits)
+        self.hits   = 0
+        self.misses = 0
+
+    def invalidate(self):
+        self.freq = None
+
+    def get(self, num_points: int = None) -> np.ndarray:
+        """
+        Args:
+            num_points: length of the trace the axis is used with (None to skip the check)
+
+        Returns: frequency axis in MHz
+        """
+        if self.freq is not None and (num_points is None or len(self.freq) == num_points):
+            self.hits  += 1
+            return self.freq
+
+        self.misses += 1
+        start_freq  = float(self.query(":FREQuency:START?" ))*1e-6
+        stop_freq   = float(self.query(":FREQuency:STOP?"  ))*1e-6
+        points      =   int(self.query(":SENSe:SWEep:POIN?"))
+        self.freq   = np.linspace(start_freq, stop_freq, points)
+        return self.freq